@@ -0,0 +1,80 @@
+"""
+Processing of synthetic enrichment output of 1k to 1M rows.
+
+The row-wise reference clean_term_names and the dense calc_dist are skipped
+above the sizes that finish in minutes.
+"""
+from magine.enrichment import enrichr
+
+from . import synthetic
+
+sizes = [1000, 10000, 100000, 1000000]
+
+
+class CleanTermNames(object):
+    params = [sizes]
+    param_names = ['n_rows']
+    timeout = 600
+
+    def setup(self, n_rows):
+        self.data = synthetic.enrichment_table(n_rows)
+
+    def time_normalize_term_names(self, n_rows):
+        # cold, names seen before are otherwise not cleaned again
+        enrichr._term_name_memo.clear()
+        enrichr.normalize_term_names(self.data)
+
+    def peakmem_normalize_term_names(self, n_rows):
+        self.time_normalize_term_names(n_rows)
+
+
+class CleanTermNamesRowWise(object):
+    params = [sizes]
+    param_names = ['n_rows']
+    timeout = 600
+
+    def setup(self, n_rows):
+        if n_rows > 100000:
+            raise NotImplementedError('row-wise reference is too slow')
+        self.data = synthetic.enrichment_table(n_rows)
+
+    def time_clean_term_names(self, n_rows):
+        self.data.apply(enrichr.clean_term_names, axis=1)
+
+
+class RemoveRedundant(object):
+    params = [sizes, ['exact', 'minhash']]
+    param_names = ['n_rows', 'method']
+    timeout = 1200
+
+    def setup(self, n_rows, method):
+        self.data = synthetic.enrichment_table(n_rows)
+
+    def time_remove_redundant(self, n_rows, method):
+        self.data.copy().remove_redundant(level='sample', method=method)
+
+    def peakmem_remove_redundant(self, n_rows, method):
+        self.time_remove_redundant(n_rows, method)
+
+    def track_rows_kept(self, n_rows, method):
+        return self.data.copy().remove_redundant(level='sample',
+                                                 method=method).shape[0]
+
+    track_rows_kept.unit = 'rows'
+
+
+class CalcDist(object):
+    params = [sizes, [None, .5]]
+    param_names = ['n_rows', 'threshold']
+    timeout = 1200
+
+    def setup(self, n_rows, threshold):
+        if threshold is None and n_rows > 10000:
+            raise NotImplementedError('dense matrix is too large')
+        self.data = synthetic.enrichment_table(n_rows)
+
+    def time_calc_dist(self, n_rows, threshold):
+        self.data.calc_dist(level='dataframe', threshold=threshold)
+
+    def peakmem_calc_dist(self, n_rows, threshold):
+        self.time_calc_dist(n_rows, threshold)
@@ -0,0 +1,134 @@
+"""
+Throughput of the enrichR client against a local stand-in server.
+
+The server replays the scores recorded in
+magine/tests/Data/enrichr_test_enrichr.csv, and latency is added to every
+request to mimic the public service. track_ benchmarks count the requests
+the server received, so changes that add calls show up as regressions.
+"""
+import os
+import shutil
+import tempfile
+
+import magine.tests
+from magine.data.experimental_data import load_data
+from magine.enrichment.enrichr import Enrichr, run_enrichment_for_project
+from magine.tests.enrichr_server import EnrichrServer
+
+from . import synthetic
+
+exp_data_file = os.path.join(os.path.dirname(magine.tests.__file__), 'Data',
+                             'example_apoptosis.csv')
+
+
+def _sample_lists(genes, n_samples):
+    genes = sorted(genes)
+    return [genes[i::2] + genes[:i] for i in range(n_samples)]
+
+
+class EnrichrClient(object):
+    params = [[0., 0.02], [1, 4]]
+    param_names = ['latency', 'max_workers']
+    timeout = 300
+
+    def setup(self, latency, max_workers):
+        self.server = EnrichrServer(latency=latency).start()
+        self.databases = sorted(self.server.libraries)
+        genes = set()
+        for terms in self.server.libraries.values():
+            for term_genes, _ in terms.values():
+                genes.update(term_genes)
+        self.genes = sorted(genes)
+        self.sample_lists = _sample_lists(self.genes, 10)
+
+    def teardown(self, latency, max_workers):
+        self.server.stop()
+
+    def _client(self, max_workers):
+        # new client each call, identical lists are shared within a client
+        return Enrichr(url=self.server.url, max_workers=max_workers)
+
+    def _n_requests(self, func):
+        self.server.requests.clear()
+        func()
+        return sum(self.server.requests.values())
+
+    def time_run(self, latency, max_workers):
+        self._client(max_workers).run(self.genes, self.databases)
+
+    def time_run_samples(self, latency, max_workers):
+        self._client(max_workers).run_samples(
+            self.sample_lists, list(range(len(self.sample_lists))),
+            self.databases
+        )
+
+    def peakmem_run_samples(self, latency, max_workers):
+        self.time_run_samples(latency, max_workers)
+
+    def track_requests_run(self, latency, max_workers):
+        return self._n_requests(lambda: self.time_run(latency, max_workers))
+
+    def track_requests_run_samples(self, latency, max_workers):
+        return self._n_requests(
+            lambda: self.time_run_samples(latency, max_workers)
+        )
+
+    track_requests_run.unit = 'requests'
+    track_requests_run_samples.unit = 'requests'
+
+
+class RunEnrichmentForProject(object):
+    params = [[False, True], ['recorded', 'synthetic']]
+    param_names = ['partitioned', 'data']
+    timeout = 600
+
+    def setup(self, partitioned, data):
+        if partitioned:
+            try:
+                import pyarrow  # noqa: F401
+            except ImportError:
+                raise NotImplementedError('partitioned runs need pyarrow')
+        if data == 'recorded':
+            self.server = EnrichrServer(latency=.01).start()
+            self.exp_data = load_data(exp_data_file)
+        else:
+            self.server = EnrichrServer(synthetic.libraries(),
+                                        latency=.01).start()
+            self.exp_data = synthetic.experimental_data(
+                genes=synthetic.gene_names(2000)
+            )
+        self.databases = sorted(self.server.libraries)
+        self.out_dirs = []
+
+    def teardown(self, partitioned, data):
+        self.server.stop()
+        for i in self.out_dirs:
+            shutil.rmtree(i, ignore_errors=True)
+
+    def _run(self, partitioned):
+        # outputs of earlier runs would be reused, so start empty each time
+        out_dir = tempfile.mkdtemp()
+        self.out_dirs.append(out_dir)
+        # the combined table is written to the working directory
+        cwd = os.getcwd()
+        os.chdir(out_dir)
+        try:
+            run_enrichment_for_project(self.exp_data, 'bench', self.databases,
+                                       output_path=out_dir, max_workers=4,
+                                       partitioned=partitioned,
+                                       url=self.server.url)
+        finally:
+            os.chdir(cwd)
+
+    def time_run_enrichment_for_project(self, partitioned, data):
+        self._run(partitioned)
+
+    def peakmem_run_enrichment_for_project(self, partitioned, data):
+        self._run(partitioned)
+
+    def track_requests(self, partitioned, data):
+        self.server.requests.clear()
+        self._run(partitioned)
+        return sum(self.server.requests.values())
+
+    track_requests.unit = 'requests'
@@ -0,0 +1,234 @@
+"""
+Run the benchmarks without asv and save the results as json.
+
+Every case runs in a new process, so peak RSS is that of the case alone.
+time_ benchmarks report the best wall time of --repeat calls, peakmem_
+benchmarks the peak RSS, and track_ benchmarks their return value, such as
+the number of requests sent to the enrichR stand-in. Every case also
+records its wall time including setup and its peak RSS.
+
+Examples
+--------
+Run from the repository root::
+
+    python -m benchmarks.run --output bench.json
+    python -m benchmarks.run --bench RemoveRedundant --compare bench.json
+
+The benchmarks can also be run with asv, see asv.conf.json.
+"""
+import argparse
+import datetime
+import importlib
+import itertools
+import json
+import multiprocessing
+import os
+import platform
+import re
+import subprocess
+import sys
+import time
+import traceback
+
+_kinds = ('time_', 'peakmem_', 'track_')
+_units = {'time_': 'seconds', 'peakmem_': 'bytes'}
+
+
+def _peak_rss():
+    try:
+        import resource
+    except ImportError:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # kilobytes on linux, bytes on macOS
+    return peak if sys.platform == 'darwin' else peak * 1024
+
+
+def _param_grid(cls):
+    params = getattr(cls, 'params', [])
+    if not params:
+        return [()]
+    if not all(isinstance(i, (list, tuple)) for i in params):
+        params = [params]
+    return list(itertools.product(*params))
+
+
+def discover(pattern=None):
+    """ (module, class, method, params) of every benchmark case """
+    bench_dir = os.path.dirname(os.path.abspath(__file__))
+    cases = []
+    for f_name in sorted(os.listdir(bench_dir)):
+        if not (f_name.startswith('bench_') and f_name.endswith('.py')):
+            continue
+        module_name = 'benchmarks.' + f_name[:-3]
+        module = importlib.import_module(module_name)
+        for class_name in sorted(dir(module)):
+            cls = getattr(module, class_name)
+            if not isinstance(cls, type) or cls.__module__ != module_name:
+                continue
+            for method in sorted(dir(cls)):
+                if not method.startswith(_kinds):
+                    continue
+                name = '.'.join([f_name[:-3], class_name, method])
+                if pattern is not None and not re.search(pattern, name):
+                    continue
+                for params in _param_grid(cls):
+                    cases.append((module_name, class_name, method, params))
+    return cases
+
+
+def _run_case(module_name, class_name, method_name, params, repeat, queue):
+    try:
+        cls = getattr(importlib.import_module(module_name), class_name)
+        bench = cls()
+        try:
+            if hasattr(bench, 'setup'):
+                bench.setup(*params)
+        except NotImplementedError as e:
+            queue.put(dict(skipped=str(e) or True))
+            return
+        method = getattr(bench, method_name)
+        try:
+            if method_name.startswith('time_'):
+                times = []
+                for _ in range(repeat):
+                    start = time.perf_counter()
+                    method(*params)
+                    times.append(time.perf_counter() - start)
+                value = min(times)
+            elif method_name.startswith('peakmem_'):
+                method(*params)
+                value = _peak_rss()
+            else:
+                value = method(*params)
+        finally:
+            if hasattr(bench, 'teardown'):
+                bench.teardown(*params)
+        queue.put(dict(value=value, peak_rss=_peak_rss()))
+    except Exception:
+        queue.put(dict(error=traceback.format_exc()))
+
+
+def run_case(module_name, class_name, method_name, params, repeat=3):
+    """ Run one case in a new process
+
+    Returns
+    -------
+    dict
+        value, unit, wall_time and peak_rss, or skipped or error
+    """
+    cls = getattr(importlib.import_module(module_name), class_name)
+    timeout = getattr(cls, 'timeout', 600)
+    ctx = multiprocessing.get_context('spawn')
+    queue = ctx.Queue()
+    process = ctx.Process(target=_run_case, args=(
+        module_name, class_name, method_name, params, repeat, queue
+    ))
+    start = time.perf_counter()
+    process.start()
+    try:
+        result = queue.get(timeout=timeout)
+    except Exception:
+        result = dict(error='timed out after {} s'.format(timeout))
+    process.join(5)
+    if process.is_alive():
+        process.terminate()
+    result['wall_time'] = time.perf_counter() - start
+    kind = [i for i in _kinds if method_name.startswith(i)][0]
+    result['unit'] = _units.get(kind, getattr(getattr(cls, method_name),
+                                              'unit', ''))
+    return result
+
+
+def _commit():
+    try:
+        return subprocess.check_output(
+            ['git', 'rev-parse', 'HEAD'], stderr=subprocess.DEVNULL,
+            cwd=os.path.dirname(os.path.abspath(__file__))
+        ).decode().strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def _key(result):
+    return result['name'], json.dumps(result['params'])
+
+
+def compare(results, previous, factor=1.2):
+    """ Results that are worse than in previous
+
+    Times and memory are regressions if they grew by more than factor,
+    tracked values such as request counts if they grew at all.
+
+    Returns
+    -------
+    list of tuple
+        (name, params, old value, new value)
+    """
+    old = dict((_key(i), i) for i in previous['results'] if 'value' in i)
+    regressions = []
+    for result in results['results']:
+        before = old.get(_key(result))
+        if before is None or 'value' not in result:
+            continue
+        new_value, old_value = result['value'], before['value']
+        if new_value is None or old_value is None:
+            continue
+        if result['name'].rsplit('.', 1)[-1].startswith('track_'):
+            worse = new_value > old_value
+        else:
+            worse = new_value > old_value * factor
+        if worse:
+            regressions.append((result['name'], result['params'], old_value,
+                                new_value))
+    return regressions
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('--bench', default=None,
+                        help='regular expression of benchmarks to run')
+    parser.add_argument('--repeat', type=int, default=3)
+    parser.add_argument('--output', default=None, help='json file to write')
+    parser.add_argument('--compare', default=None,
+                        help='json file of earlier results')
+    parser.add_argument('--factor', type=float, default=1.2,
+                        help='slowdown that counts as a regression')
+    args = parser.parse_args(argv)
+
+    results = dict(
+        commit=_commit(), date=datetime.datetime.now().isoformat(),
+        python=platform.python_version(), machine=platform.platform(),
+        cpu_count=os.cpu_count(), results=[]
+    )
+    for module_name, class_name, method, params in discover(args.bench):
+        name = '.'.join([module_name.split('.', 1)[1], class_name, method])
+        result = run_case(module_name, class_name, method, params,
+                          args.repeat)
+        result.update(name=name, params=list(params))
+        results['results'].append(result)
+        if 'value' in result:
+            status = '{} {}'.format(result['value'], result['unit'])
+        elif 'skipped' in result:
+            status = 'skipped'
+        else:
+            status = 'failed\n' + result['error']
+        print('{}{}: {}'.format(name, list(params), status))
+        sys.stdout.flush()
+
+    if args.output is not None:
+        with open(args.output, 'w') as f:
+            json.dump(results, f, indent=1)
+    if args.compare is not None:
+        with open(args.compare, 'r') as f:
+            regressions = compare(results, json.load(f), args.factor)
+        for name, params, old_value, new_value in regressions:
+            print('Regression {}{}: {} -> {}'.format(name, params,
+                                                     old_value, new_value))
+        if regressions:
+            return 1
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,127 @@
+"""
+Synthetic enrichment output and experimental data for the benchmarks.
+
+Gene sets of terms are windows of a sorted gene vocabulary, so terms with
+nearby windows overlap like related ontology terms do and remove_redundant
+has work to do. Tables are built with array operations so that a million
+rows take seconds.
+"""
+import numpy as np
+import pandas as pd
+
+from magine.data.experimental_data import ExperimentalData
+from magine.enrichment.enrichment_result import EnrichmentResult
+from magine.tests.enrichr_server import libraries_from_table
+
+
+def gene_names(n_genes):
+    return np.array(['G{:05d}'.format(i) for i in range(n_genes)],
+                    dtype=object)
+
+
+def enrichment_table(n_rows, n_samples=10, n_genes=20000,
+                     db='GO_Biological_Process_2017', seed=0):
+    """ Enrichment output with n_rows rows
+
+    Each sample has 80% of a shared pool of terms. Term names carry GO ids,
+    so clean_term_names has ids to strip.
+
+    Parameters
+    ----------
+    n_rows : int
+    n_samples : int
+    n_genes : int
+        Size of the gene vocabulary
+    db : str
+    seed : int
+
+    Returns
+    -------
+    EnrichmentResult
+    """
+    rng = np.random.RandomState(seed)
+    per_sample = max(n_rows // n_samples, 1)
+    n_terms = max(int(per_sample / .8), 1)
+    genes = gene_names(n_genes)
+    sizes = rng.randint(5, 60, n_terms)
+    starts = rng.randint(0, n_genes - 60, n_terms)
+    term_genes = np.array([','.join(genes[i:i + s])
+                           for i, s in zip(starts, sizes)], dtype=object)
+    term_names = np.array(['term {} (GO:{:07d})'.format(i, i)
+                           for i in range(n_terms)], dtype=object)
+
+    terms = np.concatenate([rng.choice(n_terms, per_sample, replace=False)
+                            for _ in range(n_samples)])
+    n = len(terms)
+    sample = np.repeat(np.arange(n_samples), per_sample)
+    p_values = 10 ** -rng.uniform(0, 8, n)
+    z_scores = -rng.uniform(.5, 3, n)
+    return EnrichmentResult({
+        'term_name': term_names[terms],
+        'rank': np.tile(np.arange(1, per_sample + 1), n_samples),
+        'p_value': p_values,
+        'z_score': z_scores,
+        'combined_score': np.log(p_values) * z_scores,
+        'adj_p_value': np.minimum(p_values * per_sample, 1.),
+        'genes': term_genes[terms],
+        'n_genes': sizes[terms],
+        'db': db,
+        'significant': p_values < .05,
+        'sample_id': np.array(['{}hr'.format(i) for i in range(n_samples)],
+                              dtype=object)[sample],
+    })
+
+
+def libraries(n_terms=2000, n_genes=2000,
+              databases=('GO_Biological_Process_2017', 'KEGG_2016')):
+    """ Gene set libraries for the enrichR stand-in server
+
+    Returns
+    -------
+    dict
+        See magine.tests.enrichr_server.EnrichrServer
+    """
+    tables = [enrichment_table(n_terms, n_samples=1, n_genes=n_genes, db=db,
+                               seed=seed)
+              for seed, db in enumerate(databases)]
+    return libraries_from_table(pd.concat(tables, ignore_index=True))
+
+
+def experimental_data(n_species=300, n_samples=4, genes=None, seed=0):
+    """ Proteomics and RNA-seq measurements of n_species species
+
+    Parameters
+    ----------
+    n_species : int
+    n_samples : int
+    genes : array_like, optional
+        Names to use for species, defaults to gene_names
+    seed : int
+
+    Returns
+    -------
+    ExperimentalData
+    """
+    rng = np.random.RandomState(seed)
+    if genes is None:
+        genes = gene_names(n_species)
+    genes = rng.choice(np.asarray(genes, dtype=object), n_species)
+    frames = []
+    for source, species_type in (('label_free', 'protein'),
+                                 ('ph_silac', 'protein'),
+                                 ('rna_seq', 'gene')):
+        for i in range(n_samples):
+            fold_change = rng.choice([-1, 1], n_species) * \
+                rng.uniform(1, 8, n_species)
+            p_value = 10 ** -rng.uniform(0, 4, n_species)
+            frames.append(pd.DataFrame({
+                'identifier': genes,
+                'label': genes,
+                'species_type': species_type,
+                'source': source,
+                'sample_id': '{}hr'.format(i),
+                'fold_change': fold_change,
+                'p_value': p_value,
+                'significant': p_value < .05,
+            }))
+    return ExperimentalData(pd.concat(frames, ignore_index=True))
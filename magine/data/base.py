@@ -1,6 +1,9 @@
+from collections import OrderedDict
+
 import numpy as np
 import pandas as pd
 
+from magine.data.row_index import RowIndex
 from magine.plotting.heatmaps import heatmap_from_array
 
 flag = 'significant'
@@ -11,14 +14,77 @@ class BaseData(pd.DataFrame):
     This class derived from pd.DataFrame
     """
     _index = None
+    # bytes of pivot tables kept by pivoter, 0 to disable the cache
+    pivot_cache_bytes = 64 * 2 ** 20
 
     def __init__(self, *args, **kwargs):
         super(BaseData, self).__init__(*args, **kwargs)
+        object.__setattr__(self, '_version', 0)
+        object.__setattr__(self, '_pivot_cache', None)
+        object.__setattr__(self, '_row_indexes', None)
 
     @property
     def _constructor(self):
         return BaseData
 
+    def _clear_item_cache(self):
+        # pandas calls this whenever values are set through __setitem__,
+        # loc/iloc or inplace operations
+        super(BaseData, self)._clear_item_cache()
+        self._data_changed()
+
+    def copy(self, deep=True):
+        """ pandas.DataFrame.copy, keeping the cached tables of this frame """
+        # pandas also clears the item cache of the frame that is copied,
+        # which does not change its data
+        version = self.__dict__.get('_version', 0)
+        cache = self.__dict__.get('_pivot_cache')
+        indexes = self.__dict__.get('_row_indexes')
+        new_data = super(BaseData, self).copy(deep=deep)
+        object.__setattr__(self, '_version', version)
+        object.__setattr__(self, '_pivot_cache', cache)
+        object.__setattr__(self, '_row_indexes', indexes)
+        return new_data
+
+    def _update_inplace(self, result, verify_is_copy=True):
+        super(BaseData, self)._update_inplace(result,
+                                              verify_is_copy=verify_is_copy)
+        self._data_changed()
+
+    def _data_changed(self):
+        # tables computed from the data are stale
+        object.__setattr__(self, '_version',
+                           self.__dict__.get('_version', 0) + 1)
+        object.__setattr__(self, '_pivot_cache', None)
+        object.__setattr__(self, '_row_indexes', None)
+
+    def row_index(self, column):
+        """ RowIndex of a column, built once until the data is changed
+
+        Parameters
+        ----------
+        column : str
+
+        Returns
+        -------
+        magine.data.row_index.RowIndex
+        """
+        indexes = self.__dict__.get('_row_indexes')
+        if indexes is None:
+            indexes = dict()
+            object.__setattr__(self, '_row_indexes', indexes)
+        if column not in indexes:
+            indexes[column] = RowIndex(self[column].values)
+        return indexes[column]
+
+    def _select(self, species, index):
+        # rows whose index is in species, or contains species if a str
+        if isinstance(species, str):
+            rows = self.row_index(index).contains(species)
+        else:
+            rows = self.row_index(index).rows(species)
+        return self.iloc[rows]
+
     @property
     def sig(self):
         """ terms with significant flag """
@@ -45,14 +111,45 @@ class BaseData(pd.DataFrame):
 
         Returns
         -------
+        pandas.DataFrame
+            Tables are cached until the data is changed, up to
+            pivot_cache_bytes per frame. Writes through a column, such as
+            d['fold_change'].iloc[0] = 1, bypass the frame so each table is
+            also checked against a hash of the columns it was made from.
 
         """
-        d_copy = self.copy()
         if index is None:
             index = self._index
+        key = (_hashable(index), _hashable(columns), _hashable(values),
+               convert_to_log, fill_value, min_sig)
+        cache = self.__dict__.get('_pivot_cache')
+        version = None
+        if cache is not None or self.pivot_cache_bytes:
+            used = _keys(index) + _keys(columns) + _keys(values)
+            if min_sig:
+                used.append(flag)
+            version = (self.__dict__.get('_version', 0),
+                       _fingerprint(self, used))
+        if cache is not None:
+            array = cache.get(key, version)
+            if array is not None:
+                return array.copy()
+
+        array = self._pivot(convert_to_log, columns, values, index,
+                            fill_value, min_sig)
+        if self.pivot_cache_bytes:
+            if cache is None:
+                cache = PivotCache(self.pivot_cache_bytes)
+                object.__setattr__(self, '_pivot_cache', cache)
+            cache.put(key, version, array)
+            return array.copy()
+        return array
 
+    def _pivot(self, convert_to_log, columns, values, index, fill_value,
+               min_sig):
+        d_copy = self
         if convert_to_log:
-            d_copy.log2_normalize_df(values, inplace=True)
+            d_copy = d_copy.log2_normalize_df(values)
 
         if min_sig:
             if not isinstance(min_sig, int):
@@ -61,9 +158,8 @@ class BaseData(pd.DataFrame):
                 print('In order to filter based on minimum sig figs, '
                       'please add a "significant" column')
 
-            d_copy.require_n_sig(index=index, columns=columns,
-                                 n_sig=min_sig,
-                                 inplace=True)
+            d_copy = d_copy.require_n_sig(index=index, columns=columns,
+                                          n_sig=min_sig)
             if not d_copy.shape[0]:
                 return pd.DataFrame()
 
@@ -104,42 +200,41 @@ class BaseData(pd.DataFrame):
         """
         if index is None:
             index = self._index
-        # create safe copy of array
-        new_data = self.copy()
-
-        # get list of columns
-        cols_to_check = list(new_data[columns].unique())
-        if flag not in new_data.columns:
+        if flag not in self.columns:
             raise AssertionError('Requires significant column')
-        # pivot
-        sig = pd.pivot_table(new_data,
-                             index=index,
-                             fill_value=0,
-                             values=flag,
-                             columns=columns
-                             )[cols_to_check]
-
-        # convert everything that's not 0 to 1
-        sig[sig > 0] = 1
-        sig = sig[sig.T.sum() >= n_sig]
-        if isinstance(index, list):
-            keepers = {i[0] for i in sig.index.values}
-            new_data = new_data[new_data[index[0]].isin(keepers)]
-        elif isinstance(index, str):
-            n_before = len(new_data[index].unique())
-            keepers = {i for i in sig.index.values}
-            new_data = new_data.loc[new_data[index].isin(keepers)]
-            n_after = len(new_data[index].unique())
-            if verbose:
-                print("Number in index went from {} to {}"
-                      "".format(n_before, n_after))
+
+        # number of columns each index is significant in
+        flagged = self[flag].fillna(False).astype(bool).values
+        # observed, or categorical index columns give every combination
+        n_sig_columns = self.loc[flagged, _keys(index) + [columns]].groupby(
+            index, observed=True)[columns].nunique()
+        if n_sig > 0:
+            keep = n_sig_columns.index[n_sig_columns.values >= n_sig]
         else:
-            print("Index is not a str or a list. What is it?")
+            keep = self.groupby(index, observed=True)[columns].size().index
+        mask = self._index_mask(index, keep)
+        if verbose and isinstance(index, str):
+            print("Number in index went from {} to {}"
+                  "".format(self[index].nunique(),
+                            self.loc[mask, index].nunique()))
 
         if inplace:
-            self._update_inplace(new_data)
+            self._update_inplace(self.loc[mask])
         else:
-            return new_data
+            return self.loc[mask]
+
+    def _index_mask(self, index, keep):
+        """ Rows whose index is in keep
+
+        For a list of index columns, keep is a MultiIndex and rows are kept
+        if their first index column is in its first level.
+        """
+        if isinstance(index, list):
+            return self[index[0]].isin(keep.get_level_values(0)).values
+        elif isinstance(index, str):
+            return self[index].isin(keep).values
+        print("Index is not a str or a list. What is it?")
+        return np.ones(self.shape[0], dtype=bool)
 
     def present_in_all_columns(self, columns='sample_id',
                                index=None, inplace=False):
@@ -160,38 +255,22 @@ class BaseData(pd.DataFrame):
         """
         if index is None:
             index = self._index
-        # create safe copy of array
-        new_data = self.copy()
-        n_before = len(new_data[index].unique())
-        # get list of columns
-        cols_to_check = list(new_data[columns].unique())
-
-        if flag not in new_data.columns:
+        if flag not in self.columns:
             raise AssertionError("Missing {} column in data".format(flag))
 
-        # pivot
-        pivoted_df = pd.pivot_table(new_data, index=index, fill_value=np.nan,
-                                    values=flag, columns=columns
-                                    )[cols_to_check]
-
-        # sig = pivoted_df.loc[~np.any(np.isnan(pivoted_df.values), axis=1)]
-        sig = pivoted_df.loc[~pivoted_df.isnull().T.any()]
-        if isinstance(index, list):
-            keepers = {i[0] for i in sig.index.values}
-            new_data = new_data[new_data[index[0]].isin(keepers)]
-        elif isinstance(index, str):
-            keepers = {i for i in sig.index.values}
-            new_data = new_data.loc[new_data[index].isin(keepers)]
-        else:
-            print("Index is not a str or a list. What is it?")
-        n_after = len(new_data[index].unique())
-
-        print("Number in index went from {} to {}".format(n_before, n_after))
+        # number of columns each index has a flag in
+        measured = self[flag].notnull().values
+        n_columns = self.loc[measured, _keys(index) + [columns]].groupby(
+            index, observed=True)[columns].nunique()
+        keep = n_columns.index[n_columns.values == self[columns].nunique()]
+        mask = self._index_mask(index, keep)
+        print("Number in index went from {} to {}".format(
+            _n_unique(self, index), _n_unique(self.loc[mask], index)))
 
         if inplace:
-            self._update_inplace(new_data)
+            self._update_inplace(self.loc[mask])
         else:
-            return new_data
+            return self.loc[mask]
 
     def log2_normalize_df(self, column='fold_change', inplace=False):
         """ Convert "fold_change" column to log2.
@@ -281,14 +360,12 @@ class BaseData(pd.DataFrame):
             values = self._value_name
         if columns is None:
             columns = self._sample_id_name
-        df = self.copy()
         if subset is not None:
             if subset_index is None:
                 subset_index = index
-            if isinstance(subset, str):
-                df = df.loc[df[subset_index].str.contains(subset)]
-            else:
-                df = df.loc[df[subset_index].isin(subset)]
+            df = self._select(subset, subset_index)
+        else:
+            df = self.copy()
         if not df.shape[0]:
             print("No terms match subset")
             return
@@ -302,3 +379,68 @@ class BaseData(pd.DataFrame):
             sort_row=sort_row, annotate_sig=annotate_sig,
             linewidths=linewidths, min_sig=min_sig, rank_index=rank_index
         )
+
+
+class PivotCache(object):
+    """ Pivot tables of a frame, least recently used first to be dropped
+
+    Parameters
+    ----------
+    max_bytes : int
+        Total memory of the tables kept
+    """
+
+    def __init__(self, max_bytes):
+        self.max_bytes = max_bytes
+        self.n_bytes = 0
+        self._tables = OrderedDict()
+
+    def __len__(self):
+        return len(self._tables)
+
+    def get(self, key, version):
+        """ Table of key, if computed at version of the frame """
+        entry = self._tables.get(key)
+        if entry is None or entry[0] != version:
+            return None
+        self._tables.move_to_end(key)
+        return entry[1]
+
+    def put(self, key, version, table):
+        n_bytes = int(table.memory_usage(deep=True).sum())
+        if n_bytes > self.max_bytes:
+            return
+        if key in self._tables:
+            self.n_bytes -= self._tables.pop(key)[2]
+        self._tables[key] = (version, table, n_bytes)
+        self.n_bytes += n_bytes
+        while self.n_bytes > self.max_bytes:
+            _, (_, _, dropped) = self._tables.popitem(last=False)
+            self.n_bytes -= dropped
+
+
+def _hashable(value):
+    if isinstance(value, list):
+        return tuple(value)
+    return value
+
+
+def _fingerprint(df, columns):
+    # hash of the values of columns, changed by any write to them
+    columns = [i for i in dict.fromkeys(columns) if i in df.columns]
+    if not columns or not df.shape[0]:
+        return 0
+    hashes = pd.util.hash_pandas_object(df[columns], index=False)
+    return int(hashes.values.sum())
+
+
+def _keys(index):
+    if isinstance(index, list):
+        return list(index)
+    return [index]
+
+
+def _n_unique(df, index):
+    if isinstance(index, list):
+        return df[index].drop_duplicates().shape[0]
+    return df[index].nunique()
@@ -28,6 +28,10 @@ sample_id = 'sample_id'
 identifier = 'identifier'
 label = 'label'
 valid_cols = [fold_change, flag, p_val, species_type, sample_id]
+# stored as categoricals when read from parquet, feather or arrow files
+categorical_cols = [identifier, label, exp_method, species_type, sample_id]
+_parquet_extensions = ('.parquet', '.pq')
+_feather_extensions = ('.feather', '.arrow')
 
 
 def load_data_csv(file_name, **kwargs):
@@ -40,7 +44,10 @@ def load_data_csv(file_name, **kwargs):
 
 
 def load_data(file_name, **kwargs):
-    """ Load data into EnrichmentResult data class
+    """ Load data into ExperimentalData data class
+
+    Parquet, feather and arrow files are read with load_data_parquet and
+    load_data_feather, anything else as a csv.
 
     Parameters
     ----------
@@ -50,14 +57,181 @@ def load_data(file_name, **kwargs):
 
     Returns
     -------
-    df : EnrichmentResult
+    df : ExperimentalData
 
     """
+    if str(file_name).endswith(_parquet_extensions):
+        return load_data_parquet(file_name, **kwargs)
+    if str(file_name).endswith(_feather_extensions):
+        return load_data_feather(file_name, **kwargs)
     df = pd.read_csv(file_name, **kwargs)
     df = df[df[fold_change].notnull()]
     return ExperimentalData(df)
 
 
+def load_data_parquet(file_name, columns=None):
+    """ Load a parquet file, such as one written by csv_to_parquet
+
+    Requires pyarrow. identifier, label, source, species_type and sample_id
+    are loaded as categoricals and significant as bool.
+
+    Parameters
+    ----------
+    file_name : str
+        File or directory of a parquet dataset
+    columns : list, optional
+        Only load these columns
+
+    Returns
+    -------
+    ExperimentalData
+    """
+    df = read_typed(file_name, columns=columns)
+    return ExperimentalData(df[df[fold_change].notnull()])
+
+
+def load_data_feather(file_name, columns=None, memory_map=True):
+    """ Load a feather (arrow IPC) file
+
+    Requires pyarrow. Columns are typed as in load_data_parquet.
+
+    Parameters
+    ----------
+    file_name : str
+    columns : list, optional
+        Only load these columns
+    memory_map : bool
+        Memory map the file instead of reading it
+
+    Returns
+    -------
+    ExperimentalData
+    """
+    df = read_typed(file_name, columns=columns, memory_map=memory_map)
+    return ExperimentalData(df[df[fold_change].notnull()])
+
+
+def read_typed(file_name, columns=None, memory_map=True):
+    """ Read a parquet or feather file with the column types of MAGINE
+
+    Strings of categorical_cols are dictionary encoded by arrow, so they
+    are never converted to python objects.
+
+    Parameters
+    ----------
+    file_name : str
+    columns : list, optional
+    memory_map : bool
+        Memory map feather files
+
+    Returns
+    -------
+    pandas.DataFrame
+    """
+    try:
+        import pyarrow.feather as feather
+        import pyarrow.parquet as pq
+    except ImportError:
+        raise ImportError('read_typed requires pyarrow')
+    if str(file_name).endswith(_feather_extensions):
+        table = feather.read_table(file_name, columns=columns,
+                                   memory_map=memory_map)
+    else:
+        table = pq.read_table(file_name, columns=columns,
+                              memory_map=memory_map)
+    return _typed_frame(table)
+
+
+def _typed_frame(table):
+    """ DataFrame of an arrow table, with the column types of read_typed
+
+    Parameters
+    ----------
+    table : pyarrow.Table
+
+    Returns
+    -------
+    pandas.DataFrame
+    """
+    import pyarrow as pa
+    import pyarrow.compute as pc
+    for name in categorical_cols:
+        if name not in table.column_names:
+            continue
+        i = table.schema.get_field_index(name)
+        if not pa.types.is_dictionary(table.schema.field(i).type):
+            table = table.set_column(i, name,
+                                     pc.dictionary_encode(table[name]))
+    df = table.to_pandas()
+    if flag in df.columns and df[flag].dtype != bool:
+        df[flag] = df[flag].fillna(False).astype(bool)
+    return df
+
+
+def csv_to_parquet(csv_file, parquet_file=None, block_size=1 << 24):
+    """ Convert a csv file of data to parquet
+
+    The csv is streamed, so it does not have to fit in memory. Read the
+    output with load_data or load_data_parquet.
+
+    Parameters
+    ----------
+    csv_file : str
+    parquet_file : str, optional
+        Defaults to csv_file with a .parquet extension
+    block_size : int
+        Bytes of csv converted at a time
+
+    Returns
+    -------
+    str
+        parquet_file
+    """
+    try:
+        import pyarrow.csv as pa_csv
+        import pyarrow.parquet as pq
+    except ImportError:
+        raise ImportError('csv_to_parquet requires pyarrow')
+    if parquet_file is None:
+        parquet_file = os.path.splitext(csv_file)[0] + '.parquet'
+    reader = pa_csv.open_csv(
+        csv_file,
+        read_options=pa_csv.ReadOptions(block_size=block_size),
+        convert_options=_csv_convert_options()
+    )
+    with pq.ParquetWriter(parquet_file, reader.schema) as writer:
+        for batch in reader:
+            writer.write_batch(batch)
+    return parquet_file
+
+
+def _csv_convert_options():
+    """ pyarrow csv options with the column types of MAGINE data """
+    import pyarrow as pa
+    import pyarrow.csv as pa_csv
+    # types inferred from the first block could be wrong for later blocks
+    column_types = {fold_change: pa.float64(), p_val: pa.float64(),
+                    flag: pa.bool_()}
+    for name in (identifier, label, exp_method, species_type):
+        column_types[name] = pa.string()
+    return pa_csv.ConvertOptions(column_types=column_types,
+                                 strings_can_be_null=True)
+
+
+def _unique_rows(df):
+    """ Mask of rows that are not a duplicate of an earlier row
+
+    Same as ~df.duplicated(). Rows are hashed, and only rows that share a
+    hash are compared.
+    """
+    hashes = pd.util.hash_pandas_object(df, index=False).values
+    repeated = pd.Series(hashes).duplicated(keep=False).values
+    keep = np.ones(df.shape[0], dtype=bool)
+    if repeated.any():
+        keep[repeated] = ~df.iloc[np.flatnonzero(repeated)].duplicated().values
+    return keep
+
+
 class Sample(BaseData):
     """ Provides tools for subsets of data types
 
@@ -74,11 +248,18 @@ class Sample(BaseData):
         self._up = None
         self._down = None
         self._sig = None
+        object.__setattr__(self, '_ids_by_sample', None)
 
     @property
     def _constructor(self):
         return Sample
 
+    def _clear_item_cache(self):
+        # pandas calls this whenever values are set through __setitem__,
+        # loc/iloc or inplace operations
+        super(Sample, self)._clear_item_cache()
+        object.__setattr__(self, '_ids_by_sample', None)
+
     @property
     def exp_methods(self):
         """ List of sample_ids in data"""
@@ -112,19 +293,117 @@ class Sample(BaseData):
     @property
     def up_by_sample(self):
         """List of up regulated species by sample"""
-        return [self.loc[self[sample_id] == i].up.id_list
-                for i in self.sample_ids]
+        return [set(i) for i in self.ids_by_sample('up')]
 
     @property
     def down_by_sample(self):
         """List of down regulated species by sample"""
-        return [self.loc[self[sample_id] == i].down.id_list
-                for i in self.sample_ids]
+        return [set(i) for i in self.ids_by_sample('down')]
 
     @property
     def by_sample(self):
         """List of significantly flagged species by sample"""
-        return [self.loc[self[sample_id] == i].id_list
+        return [set(i) for i in self.ids_by_sample()]
+
+    def ids_by_sample(self, direction='both'):
+        """ Identifiers of each sample as arrays
+
+        Array form of by_sample, up_by_sample and down_by_sample, for
+        callers that do not need sets, such as to count species. All three
+        are found in one groupby, which is kept until the data is changed.
+
+        Parameters
+        ----------
+        direction : {'both', 'up', 'down'}
+            'up' and 'down' are significantly flagged species with a
+            positive or negative fold change
+
+        Returns
+        -------
+        list of np.ndarray
+            Unique identifiers, one array per sample_id in sample_ids
+        """
+        if direction not in ('both', 'up', 'down'):
+            raise ValueError("direction must be 'both', 'up' or 'down'")
+        if direction != 'both' and flag not in self.columns:
+            raise KeyError(flag)
+        cached = self.__dict__.get('_ids_by_sample')
+        if cached is None or cached[0] != self.shape[0]:
+            cached = (self.shape[0], self._group_ids_by_sample())
+            object.__setattr__(self, '_ids_by_sample', cached)
+        return list(cached[1][direction])
+
+    def _group_ids_by_sample(self):
+        # unique identifiers per (sample_id, direction), direction is 1 for
+        # up, -1 for down and 0 otherwise
+        direction = np.zeros(self.shape[0], dtype=np.int8)
+        if flag in self.columns:
+            direction[(self[flag] & (self[fold_change] > 0)).values] = 1
+            direction[(self[flag] & (self[fold_change] < 0)).values] = -1
+        codes, ids = pd.factorize(self[self._identifier].values)
+        # missing identifiers have code -1, the last entry
+        ids = np.append(np.asarray(ids, dtype=object), np.nan)
+        keys = pd.DataFrame({
+            sample_id: self[sample_id].values, 'direction': direction,
+            'code': codes,
+        }).drop_duplicates()
+        groups = keys.groupby([sample_id, 'direction'], sort=False).indices
+        codes = keys['code'].values
+
+        arrays = {'both': [], 'up': [], 'down': []}
+        for i in self.sample_ids:
+            rows = [groups[(i, d)] for d in (-1, 0, 1) if (i, d) in groups]
+            both = np.unique(codes[np.concatenate(rows)]) if rows \
+                else codes[:0]
+            arrays['both'].append(ids[both])
+            arrays['up'].append(ids[codes[groups.get((i, 1), [])]])
+            arrays['down'].append(ids[codes[groups.get((i, -1), [])]])
+        return arrays
+
+    def ranked_by_sample(self, statistic='signed_p'):
+        """ Species of each sample ranked by a signed statistic
+
+        Used for preranked enrichment, see LocalEnrichr.run_prerank.
+        Species measured more than once in a sample keep the statistic with
+        the largest magnitude.
+
+        Parameters
+        ----------
+        statistic : {'signed_p', 'fold_change'}
+            'signed_p' is -log10(p_value) with the sign of the fold change,
+            'fold_change' is the log2 fold change
+
+        Returns
+        -------
+        list of pandas.Series
+            Statistic indexed by identifier, sorted descending, one per
+            sample_id in sample_ids
+        """
+        fc = self[fold_change].values.astype(float)
+        if statistic == 'signed_p':
+            p_values = np.maximum(self[p_val].values.astype(float),
+                                  np.finfo(float).tiny)
+            values = np.sign(fc) * -np.log10(p_values)
+        elif statistic == 'fold_change':
+            with np.errstate(divide='ignore', invalid='ignore'):
+                values = np.sign(fc) * np.log2(np.abs(fc))
+        else:
+            raise ValueError("statistic must be 'signed_p' or 'fold_change'")
+        ranked = pd.DataFrame({
+            identifier: self[self._identifier].values,
+            sample_id: self[sample_id].values,
+            'statistic': values,
+        })
+        ranked = ranked[np.isfinite(ranked['statistic'])]
+        ranked['magnitude'] = ranked['statistic'].abs()
+        ranked = ranked.sort_values('magnitude', ascending=False)
+        ranked = ranked.drop_duplicates([sample_id, identifier])
+        by_sample = dict(
+            (i, group.set_index(identifier)['statistic'].sort_values(
+                ascending=False))
+            for i, group in ranked.groupby(sample_id)
+        )
+        return [by_sample.get(i, pd.Series(dtype=float))
                 for i in self.sample_ids]
 
     def subset(self, species=None, index='identifier', sample_ids=None,
@@ -134,9 +413,11 @@ class Sample(BaseData):
         Parameters
         ----------
         species : list, str
-            List of species to create subset dataframe from
+            List of species to create subset dataframe from, or a pattern
+            that the index contains
         index : str
-            Index to filter based on provided 'species' list
+            Index to filter based on provided 'species' list. Its rows are
+            looked up in row_index(index), built on the first call
         sample_ids : str, list
             List or string to filter sample
         exp_methods : str, list
@@ -146,11 +427,10 @@ class Sample(BaseData):
         -------
         magine.data.experimental_data.Species
         """
-        df = self.copy()
-        if isinstance(species, str):
-            df = df.loc[df[index].str.contains(species)]
-        elif isinstance(species, (list, tuple, set)):
-            df = df.loc[df[index].isin(species)]
+        if isinstance(species, (str, list, tuple, set)):
+            df = self._select(species, index)
+        else:
+            df = self.copy()
         if sample_ids is not None:
             if isinstance(species, str):
                 df = df.loc[df[sample_id].str.contains(sample_ids)]
@@ -422,16 +702,22 @@ class ExperimentalData(object):
         ----------
         data_file : str, pandas.DataFrame
             Name of file, generally csv.
-            If provided a str, the file will be read in as a pandas.DataFrame
+            If provided a str, the file will be read in as a pandas.DataFrame.
+            Parquet, feather and arrow files are read with read_typed.
 
 
         """
         if isinstance(data_file, pd.DataFrame):
             df = data_file.copy()
+        elif str(data_file).endswith(_parquet_extensions +
+                                     _feather_extensions):
+            df = read_typed(data_file)
         else:
             df = pd.read_csv(data_file, parse_dates=False, low_memory=False)
         df.reset_index(drop=True, inplace=True)
-        df.drop_duplicates(inplace=True)
+        unique = _unique_rows(df)
+        if not unique.all():
+            df = df.loc[unique]
         for i in valid_cols:
             if i not in df.dtypes:
                 print("{} not in columns.".format(i))
@@ -443,19 +729,48 @@ class ExperimentalData(object):
         self.__species = None
         self.__rna = None
         self.__compounds = None
-        for i in self.exp_methods:
-            self.__setattr__(i, Sample(
-                self.data.loc[self.data[exp_method] == i]))
-        for i in self.sample_ids:
-            self.__setattr__(i, Sample(
-                self.data.loc[self.data[sample_id] == i]))
+        # rows of each source and sample_id, Samples are built on first use
+        self._rows = None
+        self._samples = dict()
+        self._counts = dict()
 
     def __setattr__(self, name, value):
         super(ExperimentalData, self).__setattr__(name, value)
 
+    def __getattr__(self, name):
+        # only called for names that are not set, such as sources and
+        # sample_ids
+        if name.startswith('__') or '_rows' not in self.__dict__:
+            raise AttributeError(name)
+        rows = self._sample_rows()
+        if name not in rows:
+            raise AttributeError(name)
+        if name not in self._samples:
+            self._samples[name] = Sample(self.data.iloc[rows[name]])
+        return self._samples[name]
+
     def __getitem__(self, name):
+        if name in self._sample_rows():
+            return self.__getattr__(name)
         return super(ExperimentalData, self).__getattribute__(name)
 
+    def _sample_rows(self):
+        # rows of each source and sample_id, found again with their Samples
+        # when data is replaced or changed
+        version = self.data.__dict__.get('_version', 0)
+        cached = self._rows
+        if cached is None or cached[0] is not self.data or \
+                cached[1] != version:
+            rows = dict()
+            for i in (exp_method, sample_id):
+                # unused categories are not sources or samples
+                rows.update(self.data.groupby(i, sort=False,
+                                              observed=True).indices)
+            cached = (self.data, version, rows)
+            self._rows = cached
+            self._samples = dict()
+        return cached[2]
+
     @property
     def genes(self):
         """ All data tagged with gene
@@ -467,8 +782,7 @@ class ExperimentalData(object):
 
         """
         if self.__genes is None:
-            tmp = self.data.copy()
-            tmp = tmp.loc[tmp[species_type] == protein]
+            tmp = self.data.loc[self.data[species_type] == protein]
             self.__genes = Sample(tmp)
         return self.__genes
 
@@ -483,9 +797,8 @@ class ExperimentalData(object):
 
         """
         if self.__proteins is None:
-            tmp = self.data.copy()
-            tmp = tmp.loc[(self.data[species_type] == protein) &
-                          ~(tmp[exp_method] == rna)]
+            tmp = self.data.loc[(self.data[species_type] == protein) &
+                                ~(self.data[exp_method] == rna)]
             self.__proteins = Sample(tmp)
         return self.__proteins
 
@@ -500,8 +813,7 @@ class ExperimentalData(object):
 
         """
         if self.__rna is None:
-            tmp = self.data.copy()
-            tmp = tmp.loc[tmp[exp_method] == rna]
+            tmp = self.data.loc[self.data[exp_method] == rna]
             self.__rna = Sample(tmp)
         return self.__rna
 
@@ -515,8 +827,7 @@ class ExperimentalData(object):
 
         """
         if self.__compounds is None:
-            tmp = self.data.copy()
-            tmp = tmp.loc[tmp[species_type] == metabolites]
+            tmp = self.data.loc[self.data[species_type] == metabolites]
             self.__compounds = Sample(tmp)
         return self.__compounds
 
@@ -549,20 +860,17 @@ class ExperimentalData(object):
         Parameters
         ----------
         species : list, str
-            List of species to create subset dataframe from
+            List of species to create subset dataframe from, or a pattern
+            that the index contains
         index : str
-            Index to filter based on provided 'species' list
+            Index to filter based on provided 'species' list. Its rows are
+            looked up in row_index(index), built on the first call
 
         Returns
         -------
         magine.data.experimental_data.Species
         """
-        df = self.species.copy()
-        if isinstance(species, str):
-            df = df.loc[df[index].str.contains(species)]
-        else:
-            df = df.loc[df[index].isin(species)]
-        return df
+        return self.data._select(species, index)
 
     def get_measured_by_datatype(self):
         """
@@ -583,8 +891,9 @@ class ExperimentalData(object):
 
         Parameters
         ----------
-        sig: bool
-            Flag to summarize significant species only
+        sig: bool or 'both'
+            Flag to summarize significant species only. 'both' returns the
+            tables of all and of significant species side by side
         save_name: str
             Name to save csv and .tex file
         index: str
@@ -604,6 +913,16 @@ class ExperimentalData(object):
                                     save_name=save_name, plot=plot,
                                     write_latex=write_latex)
 
+    def _species_counts(self, index):
+        # species_counts of data, kept until data is replaced or changed
+        version = self.data.__dict__.get('_version', 0)
+        cached = self._counts.get(index)
+        if cached is None or cached[0] is not self.data or \
+                cached[1] != version:
+            cached = (self.data, version, species_counts(self.data, index))
+            self._counts[index] = cached
+        return cached[2]
+
     def volcano_analysis(self, out_dir, use_sig_flag=True,
                          p_value=0.1, fold_change_cutoff=1.5):
         """
@@ -683,8 +1002,10 @@ def create_table_of_data(data, sig=False, index='identifier', save_name=None,
     Parameters
     ----------
     data : ExperimentalData
-    sig: bool
-        Flag to summarize significant species only
+    sig: bool or 'both'
+        Flag to summarize significant species only. 'both' returns the
+        tables of all and of significant species side by side, with column
+        levels 'measured' and 'significant'
     save_name: None, str
         Name to save csv and .tex file
     index: str
@@ -701,26 +1022,122 @@ def create_table_of_data(data, sig=False, index='identifier', save_name=None,
 
     """
 
-    if sig:
-        data_copy = data.species.sig.copy()
+    counts = data._species_counts(index)
+    if sig == 'both':
+        count_table = pd.concat(
+            [_format_counts(*counts[i]) for i in ('measured', 'significant')],
+            axis=1, keys=['measured', 'significant']
+        )
     else:
-        data_copy = data.species.copy()
+        count_table = _format_counts(
+            *counts['significant' if sig else 'measured']
+        )
+    return _save_table(count_table, save_name=save_name, plot=plot,
+                       write_latex=write_latex)
+
 
-    count_table = data_copy.pivot_table(values=index, index=exp_method,
-                                        columns=sample_id, fill_value=np.nan,
-                                        aggfunc=lambda x: x.dropna().nunique())
+def species_counts(df, index=identifier):
+    """ Counts of unique index per source and sample_id
 
+    Computed from integer codes in one pass, for all and for significantly
+    flagged rows.
+
+    Parameters
+    ----------
+    df : pandas.DataFrame
+    index: str
+        Column of species to count
+
+    Returns
+    -------
+    dict
+        'measured' and 'significant' (if df has a significant column) to
+        count_table, unique_col: the number of unique species of each
+        source x sample_id, nan if there are no rows, and the number of
+        unique species of each source
+    """
+    source_codes, sources = pd.factorize(df[exp_method], sort=True)
+    sample_codes, samples = pd.factorize(df[sample_id], sort=True)
+    # categoricals give a CategoricalIndex, which sorts by category order
+    sources = np.asarray(sources, dtype=object)
+    samples = np.asarray(samples, dtype=object)
+    id_codes, ids = pd.factorize(df[index])
+    n_sources, n_samples, n_ids = len(sources), len(samples), len(ids) + 1
+    cells = source_codes * n_samples + sample_codes
+    in_cell = (source_codes >= 0) & (sample_codes >= 0)
+    has_id = id_codes >= 0
+
+    def _counts(rows):
+        # cells with rows, as pivot_table, and unique ids in each cell
+        present = np.bincount(cells[rows & in_cell],
+                              minlength=n_sources * n_samples) > 0
+        pairs = np.unique(cells[rows & in_cell & has_id] * n_ids +
+                          id_codes[rows & in_cell & has_id])
+        counts = np.bincount(pairs // n_ids,
+                             minlength=n_sources * n_samples).astype(float)
+        counts[~present] = np.nan
+        present = present.reshape(n_sources, n_samples)
+        count_table = pd.DataFrame(
+            counts.reshape(n_sources, n_samples),
+            index=pd.Index(sources, name=exp_method),
+            columns=pd.Index(samples, name=sample_id)
+        ).loc[present.any(axis=1), present.any(axis=0)]
+
+        # a set of the rows of a source, which counts missing ids once
+        in_source = rows & (source_codes >= 0)
+        pairs = np.unique(source_codes[in_source] * n_ids +
+                          id_codes[in_source] + 1)
+        unique = np.bincount(pairs // n_ids, minlength=n_sources)
+        return count_table, dict(zip(sources, unique))
+
+    counts = {'measured': _counts(np.ones(df.shape[0], dtype=bool))}
+    if flag in df.columns:
+        counts['significant'] = _counts(
+            df[flag].fillna(False).astype(bool).values
+        )
+    return counts
+
+
+def _format_counts(count_table, unique_col):
+    """ Counts as ints, '-' if not measured, with the total of each source """
+    # sorted by value, whatever the order of the sources and samples read
+    count_table = count_table.sort_index(axis=0).sort_index(axis=1)
     # This just makes sure things are printed as ints, not floats
     for i in count_table.columns:
         count_table[i] = count_table[i].fillna(-1).astype(int).replace(-1, '-')
-    unique_col = {}
-    for i in data.exp_methods:
-        if sig:
-            unique_col[i] = len(set(data[i].sig[index].values))
-        else:
-            unique_col[i] = len(set(data[i][index].values))
     count_table['Total Unique Across'] = pd.Series(unique_col,
                                                    index=count_table.index)
+    return count_table
+
+
+def _summary_table(count_table, unique_col, save_name=None, plot=False,
+                   write_latex=False):
+    """
+    Formats, plots and saves counts of create_table_of_data
+
+    Parameters
+    ----------
+    count_table : pandas.DataFrame
+        Counts of species of source x sample_id, nan if not measured
+    unique_col : dict
+        Number of unique species of each source
+    save_name: None, str
+        Name to save csv and .tex file
+    plot: bool
+        If you want to create a plot of the table
+    write_latex: bool
+        Create latex file of table
+
+    Returns
+    -------
+    pandas.DataFrame
+    """
+    return _save_table(_format_counts(count_table, unique_col),
+                       save_name=save_name, plot=plot,
+                       write_latex=write_latex)
+
+
+def _save_table(count_table, save_name=None, plot=False, write_latex=False):
     if plot:
         ax = plt.subplot(111, frame_on=False)
 
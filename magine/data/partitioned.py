@@ -0,0 +1,346 @@
+"""
+Experimental data stored as a directory of parquet files.
+
+Files are partitioned by source and sample_id, such as
+path/source=label_free/sample_id=Time_1/part-0.parquet. PartitionedData
+streams the summaries of ExperimentalData one partition at a time and loads
+a Sample from only the partitions it needs, so data larger than memory can
+still be summarized.
+"""
+import os
+from collections import OrderedDict
+
+import pandas as pd
+
+from magine.data.experimental_data import ExperimentalData, Sample, \
+    _csv_convert_options, _summary_table, _typed_frame, _unique_rows, \
+    exp_method, flag, fold_change, identifier, metabolites, protein, rna, \
+    sample_id, species_type
+
+partition_cols = [exp_method, sample_id]
+
+
+def csv_to_partitioned(csv_file, path, block_size=1 << 24):
+    """ Convert a csv file of data to a partitioned parquet dataset
+
+    The csv is streamed, so it does not have to fit in memory.
+
+    Parameters
+    ----------
+    csv_file : str
+    path : str
+        New directory of the dataset
+    block_size : int
+        Bytes of csv converted at a time
+
+    Returns
+    -------
+    PartitionedData
+    """
+    try:
+        import pyarrow.csv as pa_csv
+        import pyarrow.dataset as ds
+    except ImportError:
+        raise ImportError('csv_to_partitioned requires pyarrow')
+    source = ds.dataset(csv_file, format=ds.CsvFileFormat(
+        read_options=pa_csv.ReadOptions(block_size=block_size),
+        convert_options=_csv_convert_options()
+    ))
+    _write_dataset(source, path)
+    return PartitionedData(path)
+
+
+def write_partitioned(data, path):
+    """ Write data as a partitioned parquet dataset
+
+    Parameters
+    ----------
+    data : ExperimentalData or pandas.DataFrame
+    path : str
+        New directory of the dataset
+
+    Returns
+    -------
+    PartitionedData
+    """
+    try:
+        import pyarrow as pa
+    except ImportError:
+        raise ImportError('write_partitioned requires pyarrow')
+    if isinstance(data, ExperimentalData):
+        data = data.data
+    _write_dataset(pa.Table.from_pandas(pd.DataFrame(data),
+                                        preserve_index=False), path)
+    return PartitionedData(path)
+
+
+def _write_dataset(data, path):
+    import pyarrow.dataset as ds
+    ds.write_dataset(data, path, format='parquet',
+                     partitioning=partition_cols, partitioning_flavor='hive',
+                     max_partitions=1 << 16)
+
+
+class PartitionedData(object):
+    """
+    ExperimentalData stored as parquet files partitioned by source and
+    sample_id
+
+    Summaries are computed one partition at a time, reading only the columns
+    they need. Sources and sample_ids are indexed as in ExperimentalData,
+    which loads a Sample from their partitions only. genes, proteins, rna,
+    compounds and species load all matching rows. Requires pyarrow.
+
+    PartitionedData is not an ExperimentalData: it has no data frame or
+    subset, create_summary_table has no sig='both', and the species views
+    are read again on each use rather than kept.
+
+    Parameters
+    ----------
+    path : str
+        Directory written by write_partitioned or csv_to_partitioned
+    """
+
+    def __init__(self, path):
+        try:
+            import pyarrow.dataset as ds
+        except ImportError:
+            raise ImportError('PartitionedData requires pyarrow')
+        self.path = path
+        self.dataset = ds.dataset(
+            path, format='parquet',
+            partitioning=ds.HivePartitioning.discover(infer_dictionary=True)
+        )
+        # files of each (source, sample_id), read only when needed
+        self._partitions = OrderedDict()
+        for fragment in self.dataset.get_fragments():
+            keys = ds.get_partition_keys(fragment.partition_expression)
+            key = (keys.get(exp_method), keys.get(sample_id))
+            self._partitions.setdefault(key, []).append(fragment)
+
+    def __getattr__(self, name):
+        # sources and sample_ids, as for ExperimentalData
+        if '_partitions' not in self.__dict__ or (
+                name not in self.exp_methods and name not in self.sample_ids):
+            raise AttributeError(name)
+        return self[name]
+
+    def __getitem__(self, name):
+        import pyarrow.dataset as ds
+        if name in self.exp_methods:
+            return self._load(ds.field(exp_method) == name)
+        if name in self.sample_ids:
+            return self._load(ds.field(sample_id) == name)
+        raise KeyError(name)
+
+    @property
+    def exp_methods(self):
+        """ List of source columns """
+        return list(OrderedDict.fromkeys(
+            i[0] for i in self._partitions if pd.notnull(i[0])))
+
+    @property
+    def sample_ids(self):
+        """ List of sample_ids """
+        # rows without a sample_id are in no sample, as in memory
+        return sorted(set(i[1] for i in self._partitions if pd.notnull(i[1])))
+
+    @property
+    def genes(self):
+        """ All data tagged with gene, loaded from every partition """
+        import pyarrow.dataset as ds
+        return self._load(ds.field(species_type) == protein)
+
+    @property
+    def proteins(self):
+        """ Protein level data, loaded from every partition """
+        import pyarrow.dataset as ds
+        return self._load((ds.field(species_type) == protein) &
+                          (ds.field(exp_method) != rna))
+
+    @property
+    def rna(self):
+        """ RNA level data, loaded from its partitions """
+        import pyarrow.dataset as ds
+        return self._load(ds.field(exp_method) == rna)
+
+    @property
+    def compounds(self):
+        """ Only compounds in data, loaded from every partition """
+        import pyarrow.dataset as ds
+        return self._load(ds.field(species_type) == metabolites)
+
+    @property
+    def species(self):
+        """ All data as a Sample, which loads the full dataset """
+        return self._load()
+
+    def _load(self, expression=None):
+        import pyarrow.dataset as ds
+        valid = ds.field(fold_change).is_valid()
+        if expression is not None:
+            valid = valid & expression
+        df = _typed_frame(self.dataset.to_table(filter=valid))
+        return Sample(df.loc[_unique_rows(df)])
+
+    def _scan(self, columns, sig=False, direction=None):
+        """ Yield (source, sample_id), table of each partition
+
+        Only columns are read, from rows with a fold change that are
+        significant if sig, or significant in direction 'up' or 'down'.
+        """
+        import pyarrow as pa
+        import pyarrow.dataset as ds
+        expression = ds.field(fold_change).is_valid()
+        if sig or direction is not None:
+            expression = expression & ds.field(flag)
+        if direction == 'up':
+            expression = expression & (ds.field(fold_change) > 0)
+        elif direction == 'down':
+            expression = expression & (ds.field(fold_change) < 0)
+        for key, fragments in self._partitions.items():
+            yield key, pa.concat_tables([
+                i.to_table(columns=columns, filter=expression)
+                for i in fragments
+            ])
+
+    def id_list(self, sig=False):
+        """ Set of species identifiers, as species.id_list
+
+        Parameters
+        ----------
+        sig : bool
+            Only significantly flagged species, as species.sig.id_list
+
+        Returns
+        -------
+        set
+        """
+        ids = set()
+        for _, table in self._scan([identifier], sig=sig):
+            ids.update(_unique(table[identifier]))
+        return ids
+
+    def by_sample(self, direction='both', sig=False):
+        """ Species of each sample, as Sample.by_sample
+
+        Parameters
+        ----------
+        direction : {'both', 'up', 'down'}
+            'up' and 'down' are significantly flagged species with a
+            positive or negative fold change, as Sample.up_by_sample and
+            Sample.down_by_sample
+        sig : bool
+            Only significantly flagged species
+
+        Returns
+        -------
+        list of set
+            One set per sample_id in sample_ids
+        """
+        if direction not in ('both', 'up', 'down'):
+            raise ValueError("direction must be 'both', 'up' or 'down'")
+        by_sample = dict((i, set()) for i in self.sample_ids)
+        direction = None if direction == 'both' else direction
+        for key, table in self._scan([identifier], sig=sig,
+                                     direction=direction):
+            if key[1] in by_sample:
+                by_sample[key[1]].update(_unique(table[identifier]))
+        return [by_sample[i] for i in self.sample_ids]
+
+    def get_measured_by_datatype(self):
+        """
+        Returns dict of species per data type
+
+        Returns
+        -------
+        measured, sig_measured : dict, dict
+            Dictionaries where keys are 'source' and values are sets of ids.
+        """
+        measured = dict((i, set()) for i in self.exp_methods)
+        sig_measured = dict((i, set()) for i in self.exp_methods)
+        for key, table in self._scan([identifier, flag]):
+            if key[0] not in measured:
+                continue
+            measured[key[0]].update(_unique(table[identifier]))
+            sig_ids = table.filter(table[flag])[identifier]
+            sig_measured[key[0]].update(_unique(sig_ids))
+        return measured, sig_measured
+
+    def create_summary_table(self, sig=False, index=identifier,
+                             save_name=None, plot=False, write_latex=False):
+        """
+        Creates a summary table of data, as ExperimentalData does.
+
+        Parameters
+        ----------
+        sig: bool
+            Flag to summarize significant species only
+        save_name: str
+            Name to save csv and .tex file
+        index: str
+           Index for counts
+        plot: bool
+            If you want to create a plot of the table
+        write_latex: bool
+            Create latex file of table
+
+        Returns
+        -------
+        pandas.DataFrame
+        """
+        counts = dict()
+        unique = dict((i, set()) for i in self.exp_methods)
+        sample_ids = set(self.sample_ids)
+        for key, table in self._scan([index], sig=sig):
+            if not table.num_rows or key[0] not in unique:
+                continue
+            ids = _unique(table[index])
+            if key[1] in sample_ids:
+                counts[key] = len(ids)
+            unique[key[0]].update(ids)
+            # missing ids are counted once in the total, as in memory
+            if table[index].null_count:
+                unique[key[0]].add(None)
+        if counts:
+            count_table = pd.Series(counts, dtype=float).unstack()
+        else:
+            count_table = pd.DataFrame()
+        count_table.index.name = exp_method
+        count_table.columns.name = sample_id
+        unique_col = dict((i, len(j)) for i, j in unique.items())
+        return _summary_table(count_table, unique_col, save_name=save_name,
+                              plot=plot, write_latex=write_latex)
+
+    def volcano_analysis(self, out_dir, use_sig_flag=True,
+                         p_value=0.1, fold_change_cutoff=1.5):
+        """
+        Creates a volcano plot for each experimental method
+
+        Sources are loaded one at a time.
+
+        Parameters
+        ----------
+        out_dir: str, path
+            Path to where the output figures will be saved
+        use_sig_flag: bool
+            Use significant flag of data
+        p_value: float, optional
+            p value criteria for significant
+            Will not be used if use_sig_flag
+        fold_change_cutoff: float, optional
+            fold change criteria for significant
+            Will not be used if use_sig_flag
+        """
+        if not os.path.exists(out_dir):
+            os.mkdir(out_dir)
+        for i in self.exp_methods:
+            self[i].volcano_plot(
+                i, out_dir=out_dir, sig_column=use_sig_flag,
+                p_value=p_value, fold_change_cutoff=fold_change_cutoff
+            )
+
+
+def _unique(column):
+    # unique values of an arrow column, without missing values
+    return [i for i in column.unique().to_pylist() if i is not None]
@@ -0,0 +1,146 @@
+"""
+Hash index of the rows of each value of a column.
+
+Values are factorized once and the row positions of each value are stored
+contiguously, so selecting the rows of a list of species is a hash lookup
+and a gather instead of a scan of the column. The words of each distinct
+value are indexed too, so a substring search scans the token vocabulary
+instead of running a regular expression over every row. TokenIndex is
+also used for the term names of enrichment results.
+"""
+import re
+
+import numpy as np
+import pandas as pd
+
+# a plain word can only be found inside one token of a string
+_token = re.compile(r'\w+')
+
+
+class TokenIndex(object):
+    """ Tokens of distinct strings, for substring searches
+
+    Parameters
+    ----------
+    strings : array_like
+        Distinct strings, anything else has no tokens
+
+    Examples
+    --------
+    >>> index = TokenIndex(['apoptosis', 'p53 signaling', None])
+    >>> index.contains('sig').tolist()
+    [False, True, False]
+    """
+
+    def __init__(self, strings):
+        self.strings = pd.Series(np.asarray(strings, dtype=object),
+                                 dtype=object)
+        tokens = [_token.findall(i) if isinstance(i, str) else []
+                  for i in self.strings]
+        lengths = np.fromiter((len(i) for i in tokens), dtype=np.int64,
+                              count=len(tokens))
+        flat = np.fromiter((t for i in tokens for t in i), dtype=object,
+                           count=lengths.sum())
+        self.token_codes, tokens = pd.factorize(flat)
+        self.tokens = pd.Series(np.asarray(tokens, dtype=object),
+                                dtype=object)
+        # string of each token code
+        self.string_codes = np.repeat(np.arange(len(lengths)), lengths)
+
+    def contains(self, pattern):
+        """ If each string contains pattern, as str.contains
+
+        Plain words are looked up in the tokens, other regular expressions
+        are matched against each string.
+
+        Parameters
+        ----------
+        pattern : str
+
+        Returns
+        -------
+        np.ndarray of bool
+        """
+        if _token.fullmatch(pattern):
+            hits = self.tokens.str.contains(pattern, regex=False).values
+            hits = hits.astype(bool)[self.token_codes]
+            found = np.zeros(len(self.strings), dtype=bool)
+            found[self.string_codes[hits]] = True
+            return found
+        return self.strings.str.contains(pattern).fillna(
+            False).values.astype(bool)
+
+
+class RowIndex(object):
+    """ Row positions of each value of a column
+
+    Parameters
+    ----------
+    values : array_like
+        Column to index, such as identifier or label
+
+    Examples
+    --------
+    >>> index = RowIndex(['AKT1', 'TP53', 'AKT1', 'AKT2'])
+    >>> index.rows(['AKT1', 'BAX']).tolist()
+    [0, 2]
+    >>> index.contains('AKT').tolist()
+    [0, 2, 3]
+    """
+
+    def __init__(self, values):
+        codes, uniques = pd.factorize(np.asarray(values, dtype=object))
+        self.values = pd.Index(np.asarray(uniques, dtype=object),
+                               dtype=object)
+        # rows sorted by value, missing values first
+        self._order = np.argsort(codes, kind='stable')
+        self._n_missing = int((codes < 0).sum())
+        counts = np.bincount(codes[codes >= 0], minlength=len(uniques))
+        self._starts = self._n_missing + np.r_[0, np.cumsum(counts)]
+        self._tokens = None
+
+    def __len__(self):
+        return len(self._order)
+
+    def rows(self, values):
+        """ Sorted positions of rows with any of values, as isin
+
+        Parameters
+        ----------
+        values : list, tuple or set
+
+        Returns
+        -------
+        np.ndarray
+        """
+        values = np.asarray(list(values), dtype=object)
+        codes = self.values.get_indexer(values)
+        rows = self._gather(np.unique(codes[codes >= 0]))
+        if self._n_missing and pd.isnull(values).any():
+            rows = np.sort(np.r_[rows, self._order[:self._n_missing]])
+        return rows
+
+    def contains(self, pattern):
+        """ Sorted positions of rows whose value matches pattern
+
+        Matches are those of pandas.Series.str.contains, found with the
+        TokenIndex of the distinct values.
+
+        Parameters
+        ----------
+        pattern : str
+
+        Returns
+        -------
+        np.ndarray
+        """
+        if self._tokens is None:
+            self._tokens = TokenIndex(self.values)
+        return self._gather(np.flatnonzero(self._tokens.contains(pattern)))
+
+    def _gather(self, codes):
+        # positions of the rows of value codes, in row order
+        lo = self._starts[codes]
+        n = self._starts[codes + 1] - lo
+        offsets = np.repeat(lo - (np.cumsum(n) - n), n)
+        return np.sort(self._order[offsets + np.arange(n.sum())])
@@ -9,6 +9,8 @@ dir_name = os.getenv('MAGINE_DATA', dir_name)
 
 network_data_dir = os.path.join(dir_name, 'network_data')
 id_mapping_dir = os.path.join(dir_name, 'id_data')
+enrichr_cache_dir = os.path.join(dir_name, 'enrichr_cache')
+gene_set_lib_dir = os.path.join(dir_name, 'gene_set_libraries')
 
 
 def create_storage_structure():
@@ -24,6 +26,14 @@ def create_storage_structure():
     if not os.path.exists(network_data_dir):
         os.makedirs(network_data_dir)
 
+    # check or create the enrichR response cache directory
+    if not os.path.exists(enrichr_cache_dir):
+        os.makedirs(enrichr_cache_dir)
+
+    # check or create the local gene set library directory
+    if not os.path.exists(gene_set_lib_dir):
+        os.makedirs(gene_set_lib_dir)
+
 
 def clear_cached_dbs():
     """Remove old database cached downloads"""
@@ -1,4 +1,7 @@
-from magine.enrichment.enrichment_result import load_enrichment_csv
+from magine.enrichment.enrichment_result import load_enrichment_csv, \
+    load_enrichment_feather, load_enrichment_parquet
 from magine.enrichment.enrichr import Enrichr
+from magine.enrichment.local_enrichment import LocalEnrichr
 
-__all__ = ['load_enrichment_csv', 'Enrichr']
+__all__ = ['load_enrichment_csv', 'load_enrichment_feather',
+           'load_enrichment_parquet', 'Enrichr', 'LocalEnrichr']
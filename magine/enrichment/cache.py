@@ -0,0 +1,252 @@
+import gzip
+import hashlib
+import json
+import os
+import tempfile
+import threading
+import time
+
+from magine.data.storage import enrichr_cache_dir
+from magine.logging import get_logger
+
+logger = get_logger(__name__)
+
+
+class EnrichrCache(object):
+    """ On-disk cache of enrichR responses
+
+    Entries are keyed by a hash of the sorted gene list, the gene set library
+    and the version of the library, so the same list submitted from different
+    projects or sample orders shares one entry.
+
+    The version of a library is its number of terms, gene coverage and genes
+    per term, as listed by enrichR's datasetStatistics. Enrichr stores them
+    with update_libraries before it uses the cache, so responses cached
+    before enrichR updated a library are no longer used. Offline runs use
+    the versions stored by the last online run. Libraries without a stored
+    version share entries until one is stored.
+
+    Parameters
+    ----------
+    cache_dir : str, optional
+        Directory to store responses, defaults to the MAGINE data directory
+    version : str, optional
+        Label used as the version of every library instead of its
+        statistics. Library versions are then not requested from enrichR.
+    max_bytes : int, optional
+        Maximum size of the cache on disk. Least recently used entries are
+        removed first.
+    ttl : float, optional
+        Seconds an entry stays valid after it is written
+
+    Examples
+    --------
+    >>> from magine.enrichment.cache import EnrichrCache
+    >>> from magine.enrichment.enrichr import Enrichr
+    >>> e = Enrichr(cache=EnrichrCache(ttl=30 * 24 * 3600))
+    """
+
+    def __init__(self, cache_dir=None, version=None, max_bytes=None,
+                 ttl=None):
+        if cache_dir is None:
+            cache_dir = enrichr_cache_dir
+        if not os.path.exists(cache_dir):
+            os.makedirs(cache_dir)
+        self.cache_dir = cache_dir
+        self.version = version
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        self._libraries_file = os.path.join(cache_dir, 'libraries.json')
+        self._libraries = dict()
+        try:
+            with open(self._libraries_file) as f:
+                self._libraries = json.load(f)
+        except (IOError, OSError, ValueError):
+            pass
+
+    def library_version(self, gene_set_lib):
+        """ Version that responses of gene_set_lib are cached under
+
+        Parameters
+        ----------
+        gene_set_lib : str
+
+        Returns
+        -------
+        str or None
+            None if the library has no stored version
+        """
+        if self.version is not None:
+            return self.version
+        return self._libraries.get(gene_set_lib)
+
+    def update_libraries(self, statistics):
+        """ Store the versions of gene set libraries
+
+        Responses of libraries whose version changed are no longer used.
+
+        Parameters
+        ----------
+        statistics : list of dict
+            'statistics' of enrichR's datasetStatistics
+        """
+        versions = dict(
+            (i['libraryName'], json.dumps([i.get('numTerms'),
+                                           i.get('geneCoverage'),
+                                           i.get('genesPerTerm')]))
+            for i in statistics if 'libraryName' in i
+        )
+        with self._lock:
+            self._libraries.update(versions)
+            fd, tmp_path = tempfile.mkstemp(dir=self.cache_dir,
+                                            suffix='.tmp')
+            with os.fdopen(fd, 'w') as f:
+                json.dump(self._libraries, f)
+            os.replace(tmp_path, self._libraries_file)
+
+    def key(self, genes, gene_set_lib):
+        """ Hash of the gene list, library and library version
+
+        Parameters
+        ----------
+        genes : list_like
+        gene_set_lib : str
+
+        Returns
+        -------
+        str
+        """
+        content = json.dumps([sorted(set(genes)), gene_set_lib,
+                              self.library_version(gene_set_lib)])
+        return hashlib.sha256(content.encode('utf-8')).hexdigest()
+
+    def _path(self, key):
+        return os.path.join(self.cache_dir, key + '.json.gz')
+
+    def get(self, genes, gene_set_lib):
+        """ Cached enrichR entries of a gene list
+
+        Parameters
+        ----------
+        genes : list_like
+        gene_set_lib : str
+
+        Returns
+        -------
+        list or None
+            None if the response is not cached or has expired
+        """
+        path = self._path(self.key(genes, gene_set_lib))
+        entries = None
+        try:
+            if self.ttl is not None and \
+                    time.time() - os.path.getmtime(path) > self.ttl:
+                os.remove(path)
+            else:
+                with gzip.open(path, 'rt', encoding='utf-8') as f:
+                    entries = json.load(f)
+                # last access time is used for least recently used eviction
+                os.utime(path, (time.time(), os.path.getmtime(path)))
+        except (IOError, OSError, ValueError):
+            entries = None
+        with self._lock:
+            if entries is None:
+                self.misses += 1
+            else:
+                self.hits += 1
+        return entries
+
+    def set(self, genes, gene_set_lib, entries):
+        """ Save enrichR entries of a gene list
+
+        Parameters
+        ----------
+        genes : list_like
+        gene_set_lib : str
+        entries : list
+            Results returned by enrichR for gene_set_lib
+        """
+        path = self._path(self.key(genes, gene_set_lib))
+        # write to a temporary file first so readers never see partial files
+        fd, tmp_path = tempfile.mkstemp(dir=self.cache_dir, suffix='.tmp')
+        with os.fdopen(fd, 'wb') as raw, \
+                gzip.GzipFile(fileobj=raw, mode='wb') as f:
+            f.write(json.dumps(entries).encode('utf-8'))
+        os.replace(tmp_path, path)
+        if self.max_bytes is not None:
+            self.evict()
+
+    def _entries(self):
+        entries = []
+        for name in os.listdir(self.cache_dir):
+            if not name.endswith('.json.gz'):
+                continue
+            path = os.path.join(self.cache_dir, name)
+            try:
+                stat = os.stat(path)
+            except OSError:
+                continue
+            entries.append((path, stat))
+        return entries
+
+    def evict(self):
+        """ Remove expired entries and shrink the cache below max_bytes
+
+        Returns
+        -------
+        int
+            Number of entries removed
+        """
+        entries = self._entries()
+        now = time.time()
+        removed = 0
+        if self.ttl is not None:
+            expired = [i for i in entries if now - i[1].st_mtime > self.ttl]
+            for path, _ in expired:
+                _remove(path)
+            removed += len(expired)
+            entries = [i for i in entries if now - i[1].st_mtime <= self.ttl]
+        if self.max_bytes is not None:
+            total = sum(stat.st_size for _, stat in entries)
+            for path, stat in sorted(entries, key=lambda i: i[1].st_atime):
+                if total <= self.max_bytes:
+                    break
+                _remove(path)
+                total -= stat.st_size
+                removed += 1
+        if removed:
+            logger.debug("Removed {} entries from enrichR cache".format(
+                removed))
+        return removed
+
+    def clear(self):
+        """ Remove all cached responses """
+        for path, _ in self._entries():
+            _remove(path)
+        self.hits = 0
+        self.misses = 0
+
+    @property
+    def size(self):
+        """ Size of the cache on disk in bytes """
+        return sum(stat.st_size for _, stat in self._entries())
+
+    def stats(self):
+        """ Hit and miss counts of this cache
+
+        Returns
+        -------
+        dict
+        """
+        return dict(hits=self.hits, misses=self.misses,
+                    n_entries=len(self._entries()), size=self.size)
+
+
+def _remove(path):
+    try:
+        os.remove(path)
+    except OSError:
+        pass
@@ -4,22 +4,25 @@ import os
 import networkx as nx
 import pandas as pd
 from goatools import obo_parser
-from goatools.semantic import TermCounts, ic, resnik_sim, semantic_similarity
-from magine.enrichment.ontology_analysis import MagineGO
+from goatools.semantic import TermCounts, ic
 
 from magine.data.storage import id_mapping_dir
+from magine.enrichment.deprecated.ontology_analysis import MagineGO
+from magine.enrichment.go_index import GOIndex
 
 obo_file = os.path.join(id_mapping_dir, 'go.obo')
 
 if not os.path.exists(obo_file):
     print("Using ontology for first time")
     print("Downloading files")
-    from magine.enrichment.databases.gene_ontology import \
+    from magine.enrichment.deprecated.databases.gene_ontology import \
         download_and_process_go
     download_and_process_go()
     assert os.path.exists(obo_file)
 
 go = obo_parser.GODag(obo_file)
+# ancestor closure of every term, rebuilt when go.obo is a new release
+index = GOIndex.load_or_build(obo_file)
 
 mg = MagineGO()
 print("Loading termcounts")
@@ -45,14 +48,11 @@ def path_to_root(go_term):
     """
 
     graph = nx.DiGraph()
-    paths = go.paths_to_top(go_term)
-    all_terms = set()
-    for i in paths:
-        for j in i:
-            all_terms.add(j.id)
-    for i in paths:
-        for j in i:
-            add_children(j.id, graph, all_terms)
+    for i in index.ancestors_of(go_term):
+        pos = index.position[i]
+        graph.add_node(i, depth=index.depth[pos], level=index.level[pos],
+                       GOname=index.names[pos], ic=ic(i, termcounts))
+    graph.add_edges_from(index.edges_to_root(go_term))
     return graph
 
 
@@ -79,22 +79,7 @@ def common_parent_go_ids(terms):
     ----------
     terms: list
     """
-    # Find candidates from first
-    terms = list(terms)
-    path_parents = go[terms[0]]
-    candidates = path_parents.get_all_parents()
-    candidates.update({terms[0]})
-
-    # Find intersection with second to nth term
-    for term in terms[1:]:
-        path_parents = go[term]
-        parents = path_parents.get_all_parents()
-        parents.update({term})
-
-        # Find the intersection with the candidates, and update.
-        candidates.intersection_update(parents)
-
-    return candidates
+    return index.common_ancestors(terms)
 
 
 def deepest_common_ancestor(terms):
@@ -103,25 +88,14 @@ def deepest_common_ancestor(terms):
         using the above function.
         Only returns single most specific - assumes unique exists.
     """
-    # Take the element at maximum depth.
-    return max(common_parent_go_ids(terms), key=lambda t: go[t].depth)
+    return index.deepest_common_ancestor(terms)
 
 
 def min_branch_length(go_id1, go_id2):
     """
         Finds the minimum branch length between two terms in the GO DAG.
     """
-    # First get the deepest common ancestor
-    dca = deepest_common_ancestor([go_id1, go_id2])
-
-    # Then get the distance from the DCA to each term
-    dca_depth = go[dca].depth
-    d1 = go[go_id1].depth - dca_depth
-    d2 = go[go_id2].depth - dca_depth
-    # print(d1, d2)
-    # Return the distance from one term to the deepest common ancestor and
-    # back to the other term.
-    return d1 + d2
+    return int(index.min_branch_lengths([go_id1], [go_id2])[0])
 
 
 def add_children(go_term, graph, gene_set_of_interest):
@@ -174,19 +148,19 @@ def check_if_children(list_of_terms, verbose=False):
     -------
 
     """
-    list_of_terms = set(list_of_terms)
+    list_of_terms = sorted(set(list_of_terms))
+    has_parent = index.has_ancestor_in(list_of_terms)
     to_remove = set()
-    for i in list_of_terms:
-        g = path_to_root(i)
-        nodes = set(g.nodes())
-        for j in list_of_terms:
-            if not i == j:
-                if j in nodes:
-                    if verbose:
-                        print("{} is a parent of {}, "
-                              "removing from list".format(i, j))
-                    to_remove.add(i)
-    return list_of_terms.difference(to_remove)
+    for i, remove in zip(list_of_terms, has_parent):
+        if not remove:
+            continue
+        if verbose:
+            for j in list_of_terms:
+                if i != j and index.is_ancestor(j, i):
+                    print("{} is a parent of {}, "
+                          "removing from list".format(i, j))
+        to_remove.add(i)
+    return set(list_of_terms).difference(to_remove)
 
 
 def check_depth_level(list_of_terms, verbose=False):
@@ -207,8 +181,9 @@ def check_depth_level(list_of_terms, verbose=False):
     list_of_terms = set(list_of_terms)
     to_remove = set()
 
-    for i in list_of_terms:
-        if go[i].depth > 11:
+    depths = index.depth[index.codes(list_of_terms)]
+    for i, depth in zip(list_of_terms, depths):
+        if depth > 11:
             if verbose:
                 print("Depth of {} is greater than 11.".format(i),
                       "Removing from list for now as path to root is VAST")
@@ -277,21 +252,29 @@ def check_term_list(list_of_terms, verbose=False):
 
     """
     list_of_terms = check_depth_and_children(list_of_terms)
-    combos = itertools.combinations(list_of_terms, 2)
+    combos = list(itertools.combinations(list_of_terms, 2))
     to_remove = set()
-    for i, j in combos:
-
-        sim2 = semantic_similarity(i, j, go)
-        dca = deepest_common_ancestor([i, j])
-
-        sim = resnik_sim(i, j, go, termcounts)
-        ic_i = ic(i, termcounts)
-        ic_j = ic(j, termcounts)
+    if not combos:
+        return list_of_terms
+    # deepest common ancestor of every pair at once
+    terms_1, terms_2 = zip(*combos)
+    dcas = index.ids[index.deepest_common_ancestors(terms_1, terms_2)]
+    branch_lengths = index.min_branch_lengths(terms_1, terms_2)
+    for (i, j), dca, branch_length in zip(combos, dcas, branch_lengths):
+        # terms of different aspects have no common ancestor
+        if branch_length < 0:
+            continue
+
+        # goatools semantic similarity and resnik similarity
+        sim2 = 1. / branch_length if branch_length else 1.
         ic_dca = ic(dca, termcounts)
+        sim = ic_dca
 
         if verbose:
+            ic_i = ic(i, termcounts)
+            ic_j = ic(j, termcounts)
             print("\nGO 1\t\t GO 2\t\t GO3")
-            print("Min branch length = {}".format(min_branch_length(i, j)))
+            print("Min branch length = {}".format(branch_length))
             print("{}\t{}\t{}".format(go[i].name, go[j].name, go[dca].name))
             print("{}\t{}\t{}".format(i, j, dca))
             print("{}\t{}\t{}".format(go[i].depth, go[j].depth, go[dca].depth))
@@ -348,14 +331,7 @@ def find_disjunction_common_ancestor(list_of_terms):
     # dca = deepest_common_ancestor(list(list_of_terms))
 
     # find the nodes that are in all terms
-    n_terms = len(list_of_terms)
-    # print("N terms", n_terms)
-    term_counter = nx.get_node_attributes(combined_graph, 'counter')
-    common_nodes = set()
-    for i in term_counter:
-        # print(i, term_counter[i], go[i.replace('"', '')].depth)
-        if term_counter[i] == n_terms:
-            common_nodes.add(i)
+    common_nodes = index.common_ancestors(list_of_terms)
 
     if len(common_nodes) == 1:
         node_0 = combined_graph.nodes()[0]
@@ -1,12 +1,18 @@
-import itertools
+import hashlib
 import operator
+import os
 from collections import OrderedDict
-from itertools import combinations
 
 import numpy as np
 import pandas as pd
 
 from magine.data.base import BaseData
+from magine.enrichment.export import LazyPivot, export_partitioned
+from magine.enrichment.gene_list_array import GeneListArray, GeneListDtype
+from magine.enrichment.gene_set_index import GeneSetIndex
+from magine.enrichment.term_similarity import TermSimilarityGraph, \
+    greedy_unique, similarity_matrix, similarity_to
+from magine.enrichment.word_index import TermWordIndex
 from magine.plotting.heatmaps import cluster_distance_mat
 
 # Will be OK in Python 2
@@ -17,22 +23,85 @@ except:
     basestring = str
 
 sig = 'significant'
+_categorical_columns = ('term_name', 'db', 'sample_id', 'category')
 
 
-def load_enrichment_csv(file_name, **args):
+def load_enrichment_csv(file_name, compact=False, **args):
     """ Load data into EnrichmentResult data class
 
     Parameters
     ----------
     file_name : str
+    compact : bool
+        Return the memory compact form, see EnrichmentResult.compact
 
     Returns
     -------
     EnrichmentResult
 
     """
-    d = pd.read_csv(file_name, **args)
-    return EnrichmentResult(d)
+    d = EnrichmentResult(pd.read_csv(file_name, **args))
+    if compact:
+        return d.compact()
+    return d
+
+
+def load_enrichment_parquet(file_name, compact=False, columns=None):
+    """ Load a parquet file saved with EnrichmentResult.to_parquet
+
+    Requires pyarrow. Compact frames are restored in the compact form.
+
+    Parameters
+    ----------
+    file_name : str
+    compact : bool
+        Return the memory compact form, see EnrichmentResult.compact
+    columns : list, optional
+        Only load these columns
+
+    Returns
+    -------
+    EnrichmentResult
+
+    """
+    try:
+        import pyarrow  # noqa: F401
+    except ImportError:
+        raise ImportError('load_enrichment_parquet requires pyarrow')
+    d = EnrichmentResult(pd.read_parquet(file_name, columns=columns))
+    if compact:
+        return d.compact()
+    return d
+
+
+def load_enrichment_feather(file_name, compact=False, columns=None):
+    """ Load a feather file, or a dataset written by to_partitioned
+
+    Requires pyarrow.
+
+    Parameters
+    ----------
+    file_name : str
+        File or directory of a partitioned dataset
+    compact : bool
+        Return the memory compact form, see EnrichmentResult.compact
+    columns : list, optional
+        Only load these columns
+
+    Returns
+    -------
+    EnrichmentResult
+
+    """
+    try:
+        import pyarrow.dataset as ds
+    except ImportError:
+        raise ImportError('load_enrichment_feather requires pyarrow')
+    dataset = ds.dataset(file_name, format='feather', partitioning='hive')
+    d = EnrichmentResult(dataset.to_table(columns=columns).to_pandas())
+    if compact:
+        return d.compact()
+    return d
 
 
 class EnrichmentResult(BaseData):
@@ -43,12 +112,130 @@ class EnrichmentResult(BaseData):
         self._identifier = 'term_name'
         self._value_name = 'combined_score'
         self._sample_id_name = 'sample_id'
+        object.__setattr__(self, '_gene_index', None)
+        object.__setattr__(self, '_word_index', None)
 
     @property
     def _constructor(self):
         return EnrichmentResult
 
-    def filter_rows(self, column, options, inplace=False):
+    def _clear_item_cache(self):
+        # pandas calls this whenever values are set through __setitem__,
+        # loc/iloc or inplace operations, so the indexes must be rebuilt
+        super(EnrichmentResult, self)._clear_item_cache()
+        object.__setattr__(self, '_gene_index', None)
+        object.__setattr__(self, '_word_index', None)
+
+    def copy(self, deep=True):
+        """ pandas.DataFrame.copy, keeping the indexes of this frame """
+        # pandas clears the item cache of the frame that is copied
+        gene_index = self.__dict__.get('_gene_index')
+        word_index = self.__dict__.get('_word_index')
+        new_data = super(EnrichmentResult, self).copy(deep=deep)
+        object.__setattr__(self, '_gene_index', gene_index)
+        object.__setattr__(self, '_word_index', word_index)
+        return new_data
+
+    @property
+    def gene_index(self):
+        """ Index of term_name and sample_id to integer encoded gene sets
+
+        Built on first use and rebuilt after the data is changed.
+
+        Returns
+        -------
+        magine.enrichment.gene_set_index.GeneSetIndex
+        """
+        cached = self.__dict__.get('_gene_index')
+        if cached is None or cached.n_rows != self.shape[0]:
+            sample_ids = None
+            if 'sample_id' in self.columns:
+                sample_ids = self['sample_id'].values
+            cached = GeneSetIndex(self['term_name'].values,
+                                  self['genes'].values, sample_ids)
+            object.__setattr__(self, '_gene_index', cached)
+        return cached
+
+    @property
+    def word_index(self):
+        """ Inverted index of the words in term_name
+
+        Built on first use and rebuilt after the data is changed.
+
+        Returns
+        -------
+        magine.enrichment.word_index.TermWordIndex
+        """
+        cached = self.__dict__.get('_word_index')
+        if cached is None or cached.n_rows != self.shape[0]:
+            cached = TermWordIndex(self['term_name'].values)
+            object.__setattr__(self, '_word_index', cached)
+        return cached
+
+    def to_partitioned(self, path, partition_cols=('db', 'sample_id'),
+                       file_format='parquet'):
+        """ Write one Parquet or Feather file per db and sample_id
+
+        See magine.enrichment.export.export_partitioned. Read the output
+        with load_enrichment_parquet or load_enrichment_feather.
+
+        Parameters
+        ----------
+        path : str
+            Directory of the dataset
+        partition_cols : list
+        file_format : {'parquet', 'feather'}
+
+        Returns
+        -------
+        list of str
+            Files written
+        """
+        return export_partitioned(self, path, partition_cols, file_format)
+
+    def lazy_pivot(self, index=('term_name', 'db'), columns='sample_id',
+                   values=None):
+        """ Pivoted view of the table that is built in blocks of terms
+
+        Returns
+        -------
+        magine.enrichment.export.LazyPivot
+        """
+        return LazyPivot(self, index=index, columns=columns, values=values)
+
+    def compact(self, inplace=False):
+        """ Memory compact form of the table
+
+        String columns term_name, db, sample_id and category are stored as
+        categoricals and genes as a GeneListArray, which stores each gene name
+        once and every row as integer codes into it. Values, and so csv and
+        parquet output, are unchanged.
+
+        Parameters
+        ----------
+        inplace : bool
+
+        Returns
+        -------
+        EnrichmentResult
+        """
+        new_data = self.copy(deep=False)
+        for column in _categorical_columns:
+            # numeric sample_ids are already compact
+            if column in new_data.columns and \
+                    new_data[column].dtype == object:
+                new_data[column] = new_data[column].astype('category')
+        if 'genes' in new_data.columns and \
+                not isinstance(new_data['genes'].dtype, GeneListDtype):
+            new_data['genes'] = GeneListArray.from_strings(
+                new_data['genes'].values
+            )
+        if inplace:
+            self._update_inplace(new_data)
+        else:
+            return new_data
+
+    def filter_rows(self, column, options, inplace=False, as_mask=False):
         """
         Filters a pandas dataframe provides a column and filter selection.
 
@@ -59,31 +246,65 @@ class EnrichmentResult(BaseData):
             Can be a single entry or a list
         inplace : bool
             Filter inplace
+        as_mask : bool
+            Return a boolean Series of the rows to keep instead of a copy
         Returns
         -------
         pd.DataFrame
         """
+        if column == 'term_name' and 'genes' in self.columns and \
+                isinstance(options, (str, list)):
+            mask = self._term_mask(options)
+        else:
+            mask = self._option_mask(column, options)
+        if as_mask:
+            return pd.Series(mask, index=self.index)
+        new_data = self[mask]
+        if inplace:
+            self._update_inplace(new_data)
+        else:
+            return new_data
 
-        new_data = self.copy()
-        valid_opts = sorted(new_data[column].unique())
+    def _option_mask(self, column, options, rows=None):
+        # options are checked against the rows that are kept so far
+        values = self[column]
+        keep = np.ones(self.shape[0], dtype=bool)
+        if rows is None:
+            valid_opts = sorted(values.unique())
+        else:
+            valid_opts = sorted(values[rows].unique())
         if isinstance(options, str):
             if options not in valid_opts:
                 print('{} not in {}'.format(options, valid_opts))
             else:
-                new_data = new_data[new_data[column] == options]
+                keep = (values == options).values
         elif isinstance(options, list):
             for i in options:
                 if i not in valid_opts:
                     print('{} not in {}'.format(i, valid_opts))
-            new_data = new_data[new_data[column].isin(options)]
-
-        if inplace:
-            self._update_inplace(new_data)
-        else:
-            return new_data
+            keep = values.isin(options).values
+        return keep
+
+    def _term_mask(self, terms):
+        index = self.gene_index
+        keep = np.ones(self.shape[0], dtype=bool)
+        if isinstance(terms, str) and terms not in index.term_position:
+            # same as other columns, an invalid option does not filter
+            print('{} not in {}'.format(terms, sorted(index.terms)))
+            return keep
+        if isinstance(terms, str):
+            terms = [terms]
+        for i in terms:
+            if i not in index.term_position:
+                print('{} not in {}'.format(i, sorted(index.terms)))
+        keep[:] = False
+        for i in set(terms):
+            keep[index.rows_of_term(i)] = True
+        return keep
 
     def filter_multi(self, p_value=None, combined_score=None, db=None,
-                     sample_id=None, category=None, rank=None, inplace=False):
+                     sample_id=None, category=None, rank=None, inplace=False,
+                     as_mask=False):
         """
         Filters an enrichment array.
 
@@ -102,28 +323,32 @@ class EnrichmentResult(BaseData):
         rank : int
         inplace : bool
             Filter inplace
+        as_mask : bool
+            Return a boolean Series of the rows to keep instead of a copy
 
         Returns
         -------
         new_data : EnrichmentResult
         """
-        new_data = self.copy()
+        # combine all filters into one mask so the table is copied once
+        keep = np.ones(self.shape[0], dtype=bool)
         if p_value is not None:
             if not isinstance(p_value, (int, float)):
                 raise AssertionError("p_value must be a float or int")
-            new_data = new_data[new_data['adj_p_value'] <= p_value]
+            keep &= (self['adj_p_value'] <= p_value).values
         if combined_score is not None:
             if not isinstance(combined_score, (int, float)):
                 raise AssertionError("combined_score must be a float or int")
-            new_data = new_data[new_data['combined_score'] >= combined_score]
+            keep &= (self['combined_score'] >= combined_score).values
         if isinstance(rank, (int, float)):
-            new_data = new_data[new_data['rank'] <= rank]
-        if db is not None:
-            new_data.filter_rows('db', db, inplace=True)
-        if sample_id is not None:
-            new_data.filter_rows('sample_id', sample_id, inplace=True)
-        if category is not None:
-            new_data.filter_rows('category', category, inplace=True)
+            keep &= (self['rank'] <= rank).values
+        for column, options in (('db', db), ('sample_id', sample_id),
+                                ('category', category)):
+            if options is not None:
+                keep &= self._option_mask(column, options, keep)
+        if as_mask:
+            return pd.Series(keep, index=self.index)
+        new_data = self[keep]
         if inplace:
             self._update_inplace(new_data)
         else:
@@ -141,11 +366,7 @@ class EnrichmentResult(BaseData):
         set
 
         """
-        if isinstance(term, basestring):
-            genes = self[self['term_name'].isin([term])]['genes']
-        else:
-            genes = self[self['term_name'].isin(term)]['genes']
-        return set(itertools.chain.from_iterable(genes.str.split(',').values))
+        return self.gene_index.term_genes(term)
 
     def term_to_genes_dict(self, term_list=None):
         """
@@ -159,14 +380,14 @@ class EnrichmentResult(BaseData):
         OrderedDict
 
         """
+        index = self.gene_index
         if term_list is None:
             term_list = set(self['term_name'].values)
         elif isinstance(term_list, basestring):
             term_list = [term_list]
         gene_to_term = {}
         for term in term_list:
-            gene_list = self.term_to_genes(term)
-            for g in gene_list:
+            for g in index.term_codes(term):
                 if g not in gene_to_term:
                     gene_to_term[g] = set()
                 gene_to_term[g].add(term)
@@ -175,7 +396,7 @@ class EnrichmentResult(BaseData):
             name = ','.join(sorted(j))
             if name not in term_to_gene:
                 term_to_gene[name] = set()
-            term_to_gene[name].add(i)
+            term_to_gene[name].add(index.vocabulary[i])
         return OrderedDict(
             sorted(term_to_gene.items(), key=operator.itemgetter(0))
         )
@@ -187,13 +408,16 @@ class EnrichmentResult(BaseData):
         -------
         set
         """
-        return set(
-            itertools.chain.from_iterable(self['genes'].str.split(',').values)
-        )
+        index = self.gene_index
+        return index.decode(np.unique(index.row_matrix.indices))
 
     def filter_based_on_words(self, words, inplace=False):
         """ Filter term_name based on key terms
 
+        Rows are kept if their lower case term_name contains any of words.
+        Plain words are looked up in word_index, anything else is matched
+        as a regular expression.
+
         Parameters
         ----------
         words : list, str
@@ -206,16 +430,14 @@ class EnrichmentResult(BaseData):
         pandas.DataFrame
 
         """
-        if isinstance(words, str):
-            words = [words]
-        df = self.copy()
-        df = df[df['term_name'].str.lower().str.contains('|'.join(words))]
+        df = self[self.word_index.row_mask(words)]
         if inplace:
             self._update_inplace(df)
         else:
             return df
 
-    def find_similar_terms(self, term, level='sample', remove_subset=True):
+    def find_similar_terms(self, term, level='sample', remove_subset=True,
+                           threshold=None):
         """ Calculates similarity of all other terms to given term
 
         Parameters
@@ -226,29 +448,119 @@ class EnrichmentResult(BaseData):
         remove_subset : bool
             If any term is a subset of the other term, a score of 1 will be
             used instead of jaccard index.
+        threshold : float, optional
+            Only return terms with a score at or above threshold. At the
+            'dataframe' level this is answered from the graph built by
+            similarity_graph if its floor is at or below threshold.
 
 
         Returns
         -------
         pd.DataFrame
         """
+        graph = None
+        if level == 'dataframe' and remove_subset and threshold is not None:
+            graph = self._cached_graph(level, threshold)
+        if graph is not None and term in graph.position:
+            names, scores = graph.neighbors(term)
+        else:
+            index = self.gene_index
+            first_genes = index.term_codes(term)
+            if level == 'dataframe':
+                other = index.terms != term
+                names = index.terms[other]
+                matrix = index.term_matrix[np.flatnonzero(other)]
+            else:
+                rows = np.flatnonzero(self['term_name'].values != term)
+                names = self['term_name'].values[rows]
+                matrix = index.row_matrix[rows]
+            scores = similarity_to(first_genes, matrix, remove_subset)
+
+        df = pd.DataFrame({'term_name': names, 'similarity_score': scores},
+                          columns=['term_name', 'similarity_score'])
+        if threshold is not None:
+            df = df.loc[df['similarity_score'] >= threshold]
+        df.sort_values('similarity_score', inplace=True, ascending=False)
+        return df
 
-        rest_of_df = self[~(self['term_name'] == term)].copy()
-        first_genes = self.term_to_genes(term)
+    def similarity_graph(self, level='dataframe', floor=0.5, file_name=None):
+        """ Build, or load, the cached graph of similar terms
 
-        if level == 'dataframe':
-            vals = [[i, self.term_to_genes(i)] for i in
-                    rest_of_df['term_name'].unique()]
-        else:
-            vals = [[i, j.split(',')] for i, j in
-                    rest_of_df[['term_name', 'genes']].values]
+        Pairs of terms with a jaccard index at or above floor are stored.
+        Afterwards find_similar_terms, show_terms_below, remove_redundant and
+        unique_terms answer any threshold at or above floor from this graph.
+        The graph is dropped when the terms or genes change.
 
-        dist_m = [[i, jaccard_index(first_genes, j, remove_subset)]
-                  for i, j in vals]
+        Parameters
+        ----------
+        level : {'dataframe', 'sample'}
+            'dataframe' merges all genes that share the same 'term_name',
+            'sample' compares terms within each 'sample_id'.
+        floor : float
+            Lowest threshold that can be answered
+        file_name : str, optional
+            .npz file to load the graph from, if it matches the data and
+            floor, or to save it to otherwise. Saving it next to the
+            enrichment csv allows reuse across sessions.
 
-        df = pd.DataFrame(dist_m, columns=['term_name', 'similarity_score'])
-        df.sort_values('similarity_score', inplace=True, ascending=False)
-        return df
+        Returns
+        -------
+        magine.enrichment.term_similarity.TermSimilarityGraph
+        """
+        level = 'dataframe' if level == 'dataframe' else 'sample'
+        digest = self._similarity_digest(level)
+
+        def _valid(g):
+            return g is not None and g.digest == digest and g.covers(floor)
+
+        graph = self._similarity_graphs.get(level)
+        if not _valid(graph) and file_name is not None and \
+                os.path.exists(file_name):
+            graph = TermSimilarityGraph.load(file_name)
+        if not _valid(graph):
+            index = self.gene_index
+            if level == 'dataframe':
+                graph = TermSimilarityGraph.build(
+                    index.term_matrix, index.terms, floor, digest=digest
+                )
+            else:
+                if self.duplicated(['term_name', 'sample_id']).any():
+                    raise ValueError("term_name must be unique within each "
+                                     "sample_id to build a sample graph")
+                keys = list(zip(self['term_name'], self['sample_id']))
+                graph = TermSimilarityGraph.build(
+                    index.row_matrix, keys, floor,
+                    groups=self['sample_id'].values, digest=digest
+                )
+            if file_name is not None:
+                graph.save(file_name)
+        self._similarity_graphs[level] = graph
+        return graph
+
+    @property
+    def _similarity_graphs(self):
+        graphs = self.__dict__.get('_similarity_graph_cache')
+        if graphs is None:
+            graphs = dict()
+            object.__setattr__(self, '_similarity_graph_cache', graphs)
+        return graphs
+
+    def _similarity_digest(self, level):
+        # order independent, so sorting rows keeps the graph valid
+        columns = ['term_name', 'genes']
+        if level != 'dataframe':
+            columns.append('sample_id')
+        hashed = pd.util.hash_pandas_object(self[columns], index=False)
+        return hashlib.sha1(np.sort(hashed.values).tobytes()).hexdigest()
+
+    def _cached_graph(self, level, threshold):
+        level = 'dataframe' if level == 'dataframe' else 'sample'
+        graph = self._similarity_graphs.get(level)
+        if graph is None or not graph.covers(threshold):
+            return None
+        if graph.digest != self._similarity_digest(level):
+            return None
+        return graph
 
     def show_terms_below(self, term, level='dataframe', threshold=.7,
                          remove_subset=True):
@@ -267,12 +579,15 @@ class EnrichmentResult(BaseData):
         EnrichmentResult
         """
         temp_df = self.copy()
+        # share cached similarity graphs, they are checked against the data
+        object.__setattr__(temp_df, '_similarity_graph_cache',
+                           self._similarity_graphs)
         # calculate similarity of term to all terms
         sim_terms = temp_df.find_similar_terms(term,
                                                remove_subset=remove_subset,
-                                               level=level)
+                                               level=level,
+                                               threshold=threshold)
         # gather terms that are highly similar
-        sim_terms = sim_terms.loc[sim_terms.similarity_score >= threshold]
         high_similar_terms = set(sim_terms.term_name.values)
 
         # this shows all terms that remained after filtering
@@ -291,7 +606,8 @@ class EnrichmentResult(BaseData):
         return temp_df.loc[temp_df.term_name.isin(terms_removed)]
 
     def remove_redundant(self, threshold=0.75, verbose=False, level='sample',
-                         sort_by='combined_score', inplace=False):
+                         sort_by='combined_score', inplace=False,
+                         method='exact'):
         """
         Calculate similarity between all term sets and removes redundant terms.
 
@@ -310,6 +626,10 @@ class EnrichmentResult(BaseData):
             compares to all the lower terms. Options are
         inplace : bool
             Filter the dataframe in place or return filtered copy
+        method : {'exact', 'minhash'}, default 'exact'
+            'minhash' approximates the comparisons using locality sensitive
+            hashing for tables with a very large number of terms. Not used if
+            a graph built by similarity_graph covers threshold.
 
         Returns
         -------
@@ -323,15 +643,18 @@ class EnrichmentResult(BaseData):
             ascending = False
 
         self.sort_values(sort_by, inplace=True, ascending=ascending)
+        graph = self._cached_graph(level, threshold)
         data_copy = self.copy()
         if 'sample_id' not in data_copy.columns or level == 'dataframe':
-            to_keep = data_copy.unique_terms(threshold, verbose, level=level)
+            to_keep = data_copy.unique_terms(threshold, verbose, level=level,
+                                             method=method, graph=graph)
         else:
             to_keep = set()
             for i in sorted(data_copy['sample_id'].unique()):
                 tmp = data_copy[data_copy['sample_id'] == i]
                 to_keep.update(
-                    tmp.unique_terms(threshold, verbose, level=level)
+                    tmp.unique_terms(threshold, verbose, level=level,
+                                     method=method, graph=graph)
                 )
 
         data_copy = data_copy[(data_copy['term_name'].isin(to_keep))]
@@ -344,7 +667,8 @@ class EnrichmentResult(BaseData):
         else:
             return data_copy
 
-    def unique_terms(self, threshold=0.75, verbose=False, level='dataframe'):
+    def unique_terms(self, threshold=0.75, verbose=False, level='dataframe',
+                     method='exact', graph=None):
         """
 
         Parameters
@@ -352,47 +676,42 @@ class EnrichmentResult(BaseData):
         threshold : float
         verbose : bool
         level : str, {'dataframe', 'each'}
+        method : str, {'exact', 'minhash'}
+            'exact' compares each kept term to all remaining terms.
+            'minhash' only compares terms that share a MinHash bucket, which
+            scales to very large tables but can miss similar terms.
+        graph : magine.enrichment.term_similarity.TermSimilarityGraph
+            Precomputed similarities of these terms, defaults to the graph
+            cached by similarity_graph. Only used if it covers threshold.
 
         Returns
         -------
-
+        set
         """
+        if graph is None:
+            graph = self._cached_graph(level, threshold)
+        index = self.gene_index
         if level == 'dataframe':
-            names = self['term_name'].unique()
-            scores = self._get_distance_all()
+            names = index.terms
+            matrix = index.term_matrix
+            keys = names
         else:
             names = self['term_name'].values
-            scores = self._get_distance_each()
-        to_remove, to_keep = set(), set()
-
-        n_dim = len(names)
-        ind = 0
-        for i, term_1 in enumerate(names):
-            if term_1 not in to_remove:
-                to_keep.add(term_1)
-            else:
-                for j in range(n_dim):
-                    if i >= j:
-                        continue
-                    ind += 1
-                continue
-            if verbose:
-                print("Finding matches for {}".format(term_1))
-            for j, term_2 in enumerate(names):
-                if i >= j:
-                    continue
-                score = scores[ind]
-                ind += 1
-                if score > threshold:
-                    to_remove.add(term_2)
-                if verbose:
-                    print("\tScore for {} is {:.3f}".format(term_2, score))
-                    if verbose:
-                        print("\t\tRemoving {}".format(term_2))
-
-        return to_keep
-
-    def dist_matrix(self, figsize=(8, 8), level='dataframe'):
+            matrix = index.row_matrix
+            keys = None
+            # sample graphs only compare terms within a sample_id
+            if 'sample_id' in self.columns and \
+                    self['sample_id'].nunique() == 1:
+                keys = list(zip(names, self['sample_id']))
+        scores = None
+        if graph is not None and keys is not None and \
+                graph.covers(threshold):
+            scores = graph.subgraph(keys)
+        return greedy_unique(matrix, names, threshold, verbose=verbose,
+                             method=method, scores=scores)
+
+    def dist_matrix(self, figsize=(8, 8), level='dataframe',
+                    dtype=np.float64):
         """ Create a distance matrix of all term similarity
 
         Parameters
@@ -403,47 +722,46 @@ class EnrichmentResult(BaseData):
             How to treats term_name to genes. Dataframe compresses all genes
             from all sample_ids into same term. 'each' treats each term_name
             individually.
+        dtype : np.dtype
+            dtype of the similarity matrix, np.float32 halves its memory
 
         Returns
         -------
         matplotlib.Figure
 
         """
-        mat, names = self.calc_dist(level)
+        mat, names = self.calc_dist(level, dtype=dtype)
         return cluster_distance_mat(mat, names, figsize)
 
-    def calc_dist(self, level='datafame'):
+    def calc_dist(self, level='datafame', dtype=np.float64, threshold=None):
+        """ Jaccard index of all pairs of terms
+
+        Parameters
+        ----------
+        level : str, {'dataframe', 'each'}
+            'each' compares the genes of every row, otherwise the genes of
+            all rows of a term are merged.
+        dtype : np.dtype
+            Use np.float32 to halve memory for large numbers of terms
+        threshold : float, optional
+            Return a scipy.sparse matrix that only stores scores at or above
+            this value
+
+        Returns
+        -------
+        np.ndarray or scipy.sparse.csr_matrix, np.ndarray
+            similarity matrix and term names of its rows
+        """
+        index = self.gene_index
         if level == 'each':
             names = self['term_name'].values
-            scores = self._get_distance_each()
+            matrix = index.row_matrix
         else:
-            names = self['term_name'].unique()
-            scores = self._get_distance_all()
-        n_dim = len(names)
-
-        mat = np.ones((n_dim, n_dim), dtype=float)
-        ind = 0
-        for i in range(n_dim):
-            for j in range(n_dim):
-                if i >= j:
-                    continue
-                mat[i, j] = scores[ind]
-                mat[j, i] = scores[ind]
-                ind += 1
+            names = index.terms
+            matrix = index.term_matrix
+        mat = similarity_matrix(matrix, dtype=dtype, threshold=threshold)
         return mat, names
 
-    def _get_distance_each(self):
-        vals = [set(i.split(',')) for i in self['genes'].values]
-        return list(map(_score, combinations(vals, 2)))
-
-    def _get_distance_all(self):
-        vals = [self.term_to_genes(i) for i in self['term_name'].unique()]
-        return list(map(_score, combinations(vals, 2)))
-
-
-def _score(vals):
-    return jaccard_index(vals[0], vals[1])
-
 
 def jaccard_index(set1, set2, remove_subset=True):
     """
@@ -1,13 +1,23 @@
+import hashlib
 import json
 import logging
 import os
 import re
+import shutil
+import threading
+import time
+from collections import Counter, OrderedDict
+from concurrent.futures import Future, ThreadPoolExecutor
 
 import numpy as np
 import pandas as pd
 import requests
 
+from magine.enrichment.cache import EnrichrCache
 from magine.enrichment.enrichment_result import EnrichmentResult
+from magine.enrichment.export import LazyPivot, atomic_write, \
+    partition_path, write_pivot_xlsx
+from magine.enrichment.manifest import RunManifest, done, failed
 from magine.logging import get_logger
 from magine.plotting.species_plotting import write_table_to_html
 
@@ -124,13 +134,96 @@ def get_libraries():
     return [lib['libraryName'] for lib in libs_json['statistics']]
 
 
+# status codes that are worth retrying, enrichR returns these when overloaded
+_retry_status = {429, 500, 502, 503, 504}
+
+
+def _create_session(pool_size):
+    """ Create a keep-alive session limited to pool_size connections per host
+
+    Parameters
+    ----------
+    pool_size : int
+        Maximum number of simultaneous connections to a single host. Requests
+        beyond this block until a connection is returned to the pool.
+
+    Returns
+    -------
+    requests.Session
+    """
+    session = requests.Session()
+    adapter = requests.adapters.HTTPAdapter(
+        pool_connections=1, pool_maxsize=pool_size, pool_block=True
+    )
+    session.mount('http://', adapter)
+    session.mount('https://', adapter)
+    return session
+
+
 class Enrichr(object):
     _query = '{url}/enrich?userListId={list_id}&backgroundType={lib}'
 
-    def __init__(self, verbose=False):
-        self._url = 'http://maayanlab.cloud/Enrichr/'
+    def __init__(self, verbose=False, max_workers=1, max_retries=3,
+                 backoff_factor=0.5, url=None, cache=None, offline=False):
+        """
+
+        Parameters
+        ----------
+        verbose : bool
+        max_workers : int
+            Number of gene set libraries to query at the same time. This is
+            also the maximum number of open connections to enrichR.
+        max_retries : int
+            Number of times to retry a request that failed to connect or was
+            rejected by an overloaded server.
+        backoff_factor : float
+            Seconds to wait before the first retry, doubled for each retry.
+        url : str, optional
+            Base url of enrichR. Defaults to the public server.
+        cache : magine.enrichment.cache.EnrichrCache or bool, optional
+            Cache of enrichR responses. If True, uses the default cache in
+            the MAGINE data directory. Library versions are requested from
+            enrichR once, before the cache is first used, so responses of
+            updated libraries are queried again.
+        offline : bool
+            Only use responses from cache, never contact enrichR. Libraries
+            that are not cached return no terms.
+        """
+        if url is None:
+            url = 'http://maayanlab.cloud/Enrichr/'
+        if max_workers < 1:
+            raise AssertionError("max_workers must be at least 1")
+        if cache is True:
+            cache = EnrichrCache()
+        if offline and not cache:
+            raise AssertionError("offline mode requires a cache")
+        self._url = url
         self._valid_libs = _valid_libs
         self.verbose = verbose
+        self.max_workers = max_workers
+        self.max_retries = max_retries
+        self.backoff_factor = backoff_factor
+        self._session = _create_session(max_workers)
+        self.cache = cache or None
+        self.offline = offline
+        self._shared = _SharedCalls()
+        self._libraries_checked = False
+        self._libraries_lock = threading.Lock()
+
+    @property
+    def saved_calls(self):
+        """ Number of enrichR calls avoided by sharing identical gene lists
+
+        Gene lists that only differ in order or duplicates are uploaded once,
+        and a query that is already running is shared by identical requests.
+
+        Returns
+        -------
+        dict
+            'addList' uploads and 'enrich' queries that were saved
+        """
+        return dict(addList=self._shared.saved['addList'],
+                    enrich=self._shared.saved['enrich'])
 
     def print_valid_libs(self):
         """
@@ -179,11 +272,10 @@ class Enrichr(object):
         if not isinstance(list_of_genes, (list, set)):
             raise AssertionError("list_of_genes must be list like")
         logger.debug("Running Enrichr with gene set {}".format(gene_set_lib))
-        user_list_id = self._add_gene_list(list_of_genes)
         if isinstance(gene_set_lib, str):
-            df = self._run_id(user_list_id, gene_set_lib)
+            df = self._run_list_of_dbs(list_of_genes, [gene_set_lib])
         else:
-            df = self._run_list_of_dbs(user_list_id, gene_set_lib)
+            df = self._run_list_of_dbs(list_of_genes, gene_set_lib)
 
         init_size = len(df)
         if init_size == 0:
@@ -205,7 +297,7 @@ class Enrichr(object):
     def run_samples(self, sample_lists, sample_ids,
                     gene_set_lib='GO_Biological_Process_2017', save_name=None,
                     create_html=False, out_dir=None, run_parallel=False,
-                    exp_data=None, pivot=False):
+                    exp_data=None, pivot=False, stream_to=None):
         """ Run enrichment analysis on a list of samples.
 
         Parameters
@@ -228,6 +320,12 @@ class Enrichr(object):
         exp_data : magine.data.ExperimentalData
             Must be provided if create_html=True
         pivot : bool
+        stream_to : str, optional
+            csv file name. If provided, the result of each sample is appended
+            to this file as soon as it is finished instead of being kept in
+            memory. Terms are not filtered with require_n_sig, save_name and
+            create_html are ignored and the file name is returned. Use
+            load_enrichment_csv to load the output.
 
         Examples
         --------
@@ -258,18 +356,33 @@ gene_set_lib='Reactome_2016')
 
         Returns
         -------
-        EnrichmentResult
+        EnrichmentResult or str
         """
         if not isinstance(sample_lists, list):
             raise AssertionError("List required")
         if not isinstance(sample_lists[0], (list, set)):
             raise AssertionError("List of lists required")
-        df_final = self.run(sample_lists[0], gene_set_lib)
-        df_final['sample_id'] = sample_ids[0]
-        for count, (i, j) in enumerate(zip(sample_lists[1:], sample_ids[1:])):
+
+        if stream_to is not None and os.path.exists(stream_to):
+            os.remove(stream_to)
+        all_df = []
+        for i, j in zip(sample_lists, sample_ids):
             df = self.run(i, gene_set_lib)
             df['sample_id'] = j
-            df_final = df_final.append(df, ignore_index=True)
+            if stream_to is None:
+                all_df.append(df)
+            elif df.shape[0]:
+                df.to_csv(stream_to, mode='a', index=False,
+                          header=not os.path.exists(stream_to))
+        if stream_to is not None:
+            return stream_to
+
+        # concatenate once, appending in the loop copies all previous samples
+        df_final = EnrichmentResult(pd.concat(all_df, ignore_index=True,
+                                              sort=False))
+        df_final['sample_id'] = pd.Categorical(
+            df_final['sample_id'], categories=_unique(sample_ids)
+        )
 
         # removes terms that do not have at least 1 signficant term across any
         # of the samples list provided
@@ -278,19 +391,12 @@ gene_set_lib='Reactome_2016')
         if save_name:
             s_name = '{}_enrichr'.format(save_name)
             if pivot:
-                # pivot output
-                p_df = pd.pivot_table(
-                    df_final, index=['term_name', 'db'],
-                    columns='sample_id',
-                    aggfunc='first',
-                    fill_value=np.nan,
-                    values=['term_name', 'rank', 'p_value', 'z_score',
-                            'combined_score', 'adj_p_value', 'genes',
-                            'significant'],
-                )
-                # save files
-                p_df.to_excel('{}.xlsx'.format(s_name), merge_cells=True)
+                # term_name x sample_id of every other column, streamed
+                write_pivot_xlsx(LazyPivot(df_final), '{}.xlsx'.format(s_name))
+            start = time.time()
             df_final.to_csv('{}.csv'.format(s_name), index=False)
+            logger.info("Saved {}.csv in {:.2f} s".format(
+                s_name, time.time() - start))
 
         if create_html:
             if exp_data is None:
@@ -301,24 +407,25 @@ gene_set_lib='Reactome_2016')
                                 exp_data=exp_data)
         return df_final
 
-    def _run_id(self, list_id, gene_set_lib):
-        if gene_set_lib not in _valid_libs:
-            raise AssertionError("{} not in valid ids {}".format(gene_set_lib,
-                                                                 _valid_libs))
-
+    def _query_id(self, list_id, gene_set_lib):
+        """ Raw enrichR entries of an uploaded list, None if the query failed
+        """
         q = self._query.format(url=self._url, list_id=list_id,
                                lib=gene_set_lib)
-        response = requests.get(q, timeout=300)
+        response = self._request('get', q, timeout=300)
 
         if not response.ok:
             logger.warn("{} library failed to run on enrichRs side. "
                         "View their response for more info {}"
                         "".format(gene_set_lib, q))
-            return EnrichmentResult()
+            return None
         data = json.loads(response.text)
         if gene_set_lib not in data:
             raise Exception("{} not in enrichR".format(gene_set_lib))
-        if len(data[gene_set_lib]) == 0:
+        return data[gene_set_lib]
+
+    def _parse_entries(self, entries, gene_set_lib):
+        if not entries:
             return EnrichmentResult()
         #####
         # ENRICHR return a list of entries with each entry having these terms
@@ -327,7 +434,7 @@ gene_set_lib='Reactome_2016')
         #####
 
         df = EnrichmentResult(
-            data[gene_set_lib],
+            entries,
             columns=['rank', 'term_name', 'p_value', 'z_score',
                      'combined_score', 'gene_hits', 'adj_p_value', '_', '_']
         )
@@ -367,14 +474,122 @@ gene_set_lib='Reactome_2016')
                            "Returning as default output.")
         return df
 
-    def _run_list_of_dbs(self, gene_list_id, databases):
-        data = self._run_id(gene_list_id, databases[0])
-        for db in databases[1:]:
-            data = data.append(self._run_id(gene_list_id, db),
-                               ignore_index=True)
-            logger.debug('\t\t{}/{} databases'.format(db, len(databases)))
+    def _run_list_of_dbs(self, list_of_genes, databases):
+        responses = self._fetch_entries(list_of_genes, databases)
+        # results are returned in the order of databases
+        results = [self._parse_entries(responses.get(db), db)
+                   for db in databases]
+        data = EnrichmentResult(pd.concat(results, ignore_index=True,
+                                          sort=False))
+        if data.shape[0]:
+            data['db'] = pd.Categorical(data['db'],
+                                        categories=_unique(databases))
         return data
 
+    def _fetch_entries(self, list_of_genes, databases):
+        """ Raw enrichR entries of each database, from cache or enrichR
+
+        Returns
+        -------
+        dict
+            database to entries, None if the query failed or was skipped
+        """
+        for db in databases:
+            if db not in _valid_libs:
+                raise AssertionError("{} not in valid ids {}".format(
+                    db, _valid_libs))
+
+        responses = dict()
+        if self.cache is not None:
+            self._update_library_versions()
+            for db in databases:
+                entries = self.cache.get(list_of_genes, db)
+                if entries is not None:
+                    responses[db] = entries
+        missing = [db for db in databases if db not in responses]
+
+        if missing and self.offline:
+            logger.warning("{} not in cache, skipping in offline mode"
+                           "".format(', '.join(missing)))
+        elif missing:
+            list_key = _gene_list_key(list_of_genes)
+            gene_list_id = self._shared.run(
+                ('addList', list_key),
+                lambda: self._add_gene_list(list_of_genes), keep=True
+            )
+
+            def _query_db(db):
+                def _query():
+                    entries = self._query_id(gene_list_id, db)
+                    if entries is not None and self.cache is not None:
+                        self.cache.set(list_of_genes, db, entries)
+                    return entries
+
+                entries = self._shared.run(('enrich', list_key, db), _query)
+                logger.debug('\t\t{}/{} databases'.format(db, len(databases)))
+                return entries
+
+            responses.update(zip(missing, self._map(_query_db, missing)))
+        return responses
+
+    def _map(self, func, items):
+        """ Apply func to items, using a thread pool if max_workers > 1 """
+        items = list(items)
+        if self.max_workers == 1 or len(items) < 2:
+            return [func(i) for i in items]
+        with ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+            return list(executor.map(func, items))
+
+    def _update_library_versions(self):
+        """ Store enrichR library versions in the cache, once """
+        if self.offline or self.cache.version is not None:
+            return
+        with self._libraries_lock:
+            if self._libraries_checked:
+                return
+            self._libraries_checked = True
+            try:
+                response = self._request('get',
+                                         self._url + '/datasetStatistics',
+                                         timeout=60)
+                response.raise_for_status()
+                self.cache.update_libraries(response.json()['statistics'])
+            except (requests.RequestException, ValueError, KeyError) as err:
+                logger.warning("Could not get enrichR library versions, "
+                               "cached responses are used as stored "
+                               "({})".format(err))
+
+    def _request(self, method, url, **kwargs):
+        """ Send request using the shared session, retrying with backoff
+
+        Parameters
+        ----------
+        method : str
+        url : str
+        kwargs :
+            Passed to requests.Session.request
+
+        Returns
+        -------
+        requests.Response
+        """
+        for attempt in range(self.max_retries + 1):
+            try:
+                response = self._session.request(method, url, **kwargs)
+            except (requests.ConnectionError, requests.Timeout) as err:
+                if attempt == self.max_retries:
+                    raise
+                reason = err
+            else:
+                if response.status_code not in _retry_status or \
+                        attempt == self.max_retries:
+                    return response
+                reason = response.status_code
+            wait = self.backoff_factor * 2 ** attempt
+            logger.debug("Retrying {} in {:.2f}s ({})".format(
+                url, wait, reason))
+            time.sleep(wait)
+
     def _add_gene_list(self, gene_list):
         """ Upload to enrichr
 
@@ -394,7 +609,8 @@ gene_set_lib='Reactome_2016')
             'list': (None, genes_str),
             'description': (None, 'MAGINE analysis')
         }
-        response = requests.post(self._url + '/addList', files=payload)
+        response = self._request('post', self._url + '/addList',
+                                 files=payload)
         if not response.ok:
             raise Exception('Error analyzing gene list', response.ok)
 
@@ -402,8 +618,72 @@ gene_set_lib='Reactome_2016')
         return data['userListId']
 
 
+class _SharedCalls(object):
+    """ Runs identical calls once
+
+    Callers that ask for a key that is in flight wait for its result instead
+    of calling again. Results of keys run with keep=True are stored, failures
+    and None results never are.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._in_flight = dict()
+        self._results = dict()
+        self.saved = Counter()
+
+    def run(self, key, func, keep=False):
+        """ Result of func, shared by identical keys
+
+        Parameters
+        ----------
+        key : tuple
+            First item names the kind of call, used to count saved calls
+        func : callable
+        keep : bool
+            Store the result for later calls with the same key
+        """
+        with self._lock:
+            if key in self._results:
+                self.saved[key[0]] += 1
+                return self._results[key]
+            future = self._in_flight.get(key)
+            owner = future is None
+            if owner:
+                future = Future()
+                self._in_flight[key] = future
+            else:
+                self.saved[key[0]] += 1
+        if not owner:
+            return future.result()
+        try:
+            result = func()
+        except Exception as err:
+            with self._lock:
+                del self._in_flight[key]
+            future.set_exception(err)
+            raise
+        with self._lock:
+            del self._in_flight[key]
+            if keep and result is not None:
+                self._results[key] = result
+        future.set_result(result)
+        return result
+
+
+def _gene_list_key(genes):
+    """ Hash of a gene list that ignores order and duplicates """
+    content = json.dumps(sorted(set(genes)))
+    return hashlib.sha256(content.encode('utf-8')).hexdigest()
+
+
+def _unique(values):
+    """ Unique values in order of first appearance """
+    return list(OrderedDict.fromkeys(values))
+
+
 def _prepare_output(df):
-    df['term_name'] = df.apply(clean_term_names, axis=1)
+    df['term_name'] = normalize_term_names(df)
 
     return df
 
@@ -415,14 +695,7 @@ def clean_term_names(row):
 
     db = row['db']
 
-    if db in [
-        'GO_Biological_Process_2018', 'GO_Molecular_Function_2018',
-        'GO_Cellular_Component_2018',
-        'GO_Biological_Process_2017', 'GO_Molecular_Function_2017',
-        'GO_Cellular_Component_2017',
-        'GO_Biological_Process_2017b', 'GO_Molecular_Function_2017b',
-        'GO_Cellular_Component_2017b'
-    ]:
+    if db in _go_dbs:
 
         if 'GO:' in term_name:
             term_name = term_name.split('(GO:', 1)[0]
@@ -460,6 +733,134 @@ def clean_term_names(row):
     return term_name
 
 
+_go_dbs = [
+    'GO_Biological_Process_2018', 'GO_Molecular_Function_2018',
+    'GO_Cellular_Component_2018',
+    'GO_Biological_Process_2017', 'GO_Molecular_Function_2017',
+    'GO_Cellular_Component_2017',
+    'GO_Biological_Process_2017b', 'GO_Molecular_Function_2017b',
+    'GO_Cellular_Component_2017b'
+]
+
+
+def _split_first(sep):
+    # pandas treats multi-character patterns as regular expressions
+    pattern = re.escape(sep)
+
+    def _split(names):
+        return names.str.split(pattern, n=1).str[0]
+
+    return _split
+
+
+def _rsplit_first(sep):
+    def _split(names):
+        return names.str.rsplit(sep, n=1).str[0]
+
+    return _split
+
+
+def _clean_go(names):
+    upper = names.str.split(re.escape('(GO:'), n=1).str[0]
+    lower = names.str.split(re.escape('(go:'), n=1).str[0]
+    return upper.where(names.str.contains('GO:', regex=False), lower)
+
+
+def _clean_mgi(names):
+    is_mp = names.str.startswith('MP:')
+    after_id = names.str.split(' ', n=1).str[1]
+    if (is_mp & after_id.isnull()).any():
+        raise IndexError("MP term without a name")
+    return after_id.where(is_mp, names)
+
+
+def _clean_drug_matrix(names):
+    drug_name = names.str.extract(r'^(.*)(-\d*.*\d_)', expand=True)[0]
+    direction = names.str.extract(r'(-.{2})$', expand=True)[0]
+    found = drug_name.notnull() & direction.notnull()
+    return (drug_name + direction).where(found, names)
+
+
+# database specific rules used by normalize_term_names, these must produce the
+# same output as clean_term_names
+_term_name_rules = dict(
+    [(db, _clean_go) for db in _go_dbs] +
+    [('Human_Phenotype_Ontology', _split_first('(HP:')),
+     ('MGI_Mammalian_Phenotype_2017', _clean_mgi),
+     ('DrugMatrix', _clean_drug_matrix),
+     ('Old_CMAP_down', _rsplit_first('-')),
+     ('Old_CMAP_up', _rsplit_first('-')),
+     ('Ligand_Perturbations_from_GEO_down', _split_first('_')),
+     ('Ligand_Perturbations_from_GEO_up', _split_first('_'))]
+)
+
+# (db, raw term name) -> cleaned name, shared by all calls and threads
+_term_name_memo = dict()
+_term_name_lock = threading.Lock()
+_max_memo_size = 2000000
+
+
+def _memo_size():
+    # number of cleaned names over all dbs, call with _term_name_lock held
+    return sum(len(i) for i in _term_name_memo.values())
+
+
+def _clean_names(names, db):
+    rule = _term_name_rules.get(db)
+    if rule is not None:
+        names = rule(names)
+    names = names.str.strip().str.lower()
+    for i, j in replace_pairs:
+        names = names.str.replace(i, j, regex=False)
+    return names
+
+
+def normalize_term_names(df):
+    """ Clean enrichR term names of all rows at once
+
+    Gives the same output as applying :func:`clean_term_names` to each row,
+    using vectorized string operations for each database. Cleaned names
+    are remembered, so names seen in earlier calls are not processed again.
+
+    Parameters
+    ----------
+    df : pandas.DataFrame
+        Must have 'term_name' and 'db' columns
+
+    Returns
+    -------
+    pandas.Series
+    """
+    dbs = df['db'].values.astype(object)
+    cleaned = df['term_name'].values.astype(object)
+    for db in pd.unique(dbs):
+        if pd.isnull(db):
+            mask = pd.isnull(dbs)
+            db = None
+        else:
+            mask = dbs == db
+        raw = pd.Series(cleaned[mask])
+        names = [i for i in pd.unique(raw.values) if isinstance(i, str)]
+        with _term_name_lock:
+            memo = _term_name_memo.get(db, dict())
+            known = dict((i, memo[i]) for i in names if i in memo)
+        todo = [i for i in names if i not in known]
+        if todo:
+            # cleaned outside of the lock, other threads can use the memo
+            new = dict(zip(todo, _clean_names(pd.Series(todo), db)))
+            with _term_name_lock:
+                if _memo_size() + len(new) > _max_memo_size:
+                    # start again, keeping only the names of this call
+                    _term_name_memo.clear()
+                    new.update(known)
+                _term_name_memo.setdefault(db, dict()).update(new)
+            known.update(new)
+        # only str are in the memo, anything else is kept as is
+        new = raw.map(known).values
+        cleaned[mask] = np.where(pd.isnull(new), raw.values, new)
+    return pd.Series(cleaned, index=df.index, name='term_name')
+
+
 def clean_lincs(df):
     """ Cleans the lincs databases term_names from enrichR.
 
@@ -474,41 +875,33 @@ def clean_lincs(df):
     pattern = re.compile(
         r'(?P<id>\w+) (?P<cell>\w+) (?P<time>\w+)-(?P<drug>.*)-(\S*)')
 
-    def get_drug(row):
-        db = row['db']
-        term_name = row['term_name']
-        if db not in ['LINCS_L1000_Chem_Pert_up',
-                      'LINCS_L1000_Chem_Pert_down']:
-            return term_name
-        try:
-            drug_name = pattern.search(term_name).group('drug')
-            return drug_name
-        except:
-            # If the string doesnt have the pattern above, there is no way
-            # to properly parse it. Ran into a few examples where they used
-            # spaces instead of "_". Hard to parse since the names of the drugs
-            # can also have spaces ("sulfide salts")
-            # ex. cpc006 snuc5 6h-quinine hemisulfate salt monohydrate-10.0
-            return term_name
-
-    df['term_name'] = df.apply(get_drug, axis=1)
+    is_lincs = df['db'].isin(['LINCS_L1000_Chem_Pert_up',
+                              'LINCS_L1000_Chem_Pert_down']).values
+    term_names = df['term_name'].values.astype(object)
+    lincs_names = term_names[is_lincs]
+    drug_names = pd.Series(lincs_names).str.extract(pattern)['drug'].values
+    # If the string doesnt have the pattern above, there is no way
+    # to properly parse it. Ran into a few examples where they used
+    # spaces instead of "_". Hard to parse since the names of the drugs
+    # can also have spaces ("sulfide salts")
+    # ex. cpc006 snuc5 6h-quinine hemisulfate salt monohydrate-10.0
+    term_names[is_lincs] = np.where(pd.isnull(drug_names), lincs_names,
+                                    drug_names)
+    df['term_name'] = term_names
     return df
 
 
 def clean_drug_pert_geo(df):
-    def get_drug(row):
-        db = row['db']
-        term_name = row['term_name']
-        if db != 'Drug_Perturbations_from_GEO_2014':
-            return term_name
-        try:
-            segs = term_name.split('_')
-            drug_name = segs[0] + '_' + segs[-1][0] + segs[-1][-1]
-        except NameError:
-            drug_name = term_name
-        return drug_name
-
-    df['term_name'] = df.apply(get_drug, axis=1)
+    is_geo = (df['db'] == 'Drug_Perturbations_from_GEO_2014').values
+    term_names = df['term_name'].values.astype(object)
+    segs = pd.Series(term_names[is_geo]).str.split('_')
+    last = segs.str[-1]
+    if (last.str.len() == 0).any():
+        raise IndexError("Drug_Perturbations_from_GEO_2014 term ending "
+                         "with '_'")
+    term_names[is_geo] = (segs.str[0] + '_' + last.str[0] +
+                          last.str[-1]).values
+    df['term_name'] = term_names
     return df
 
 
@@ -535,15 +928,6 @@ def clean_tf_names(data):
 
     """
 
-    def return_single_tf(row):
-        """
-        Gets TF name only
-        """
-        tf = row['term_name']
-        if '_' in tf:
-            tf = tf.split('_')[0]
-        return tf.upper()
-
     tf_dbs = ['ARCHS4_TFs_Coexp',
               'ChEA_2016',
               'ENCODE_and_ChEA_Consensus_TFs_from_ChIP-X',
@@ -553,7 +937,8 @@ def clean_tf_names(data):
               'TF-LOF_Expression_from_GEO',
               'Transcription_Factor_PPIs']
     tfs = data[data['db'].isin(tf_dbs)].copy()
-    tfs['term_name'] = tfs.apply(return_single_tf, axis=1)
+    # TF name only
+    tfs['term_name'] = tfs['term_name'].str.split('_').str[0].str.upper()
     return tfs
 
 
@@ -627,9 +1012,14 @@ def get_background_list(lib_name):
 
 
 def run_enrichment_for_project(exp_data, project_name, databases=None,
-                               output_path=None):
+                               output_path=None, max_workers=1, cache=None,
+                               partitioned=False, url=None):
     """
 
+    Identical gene lists, such as the up regulated genes of a sample with
+    only up regulated genes, are sent to enrichR once and their output is
+    reused. The number of enrichR calls this saved is logged.
+
     Parameters
     ----------
     exp_data : magine.data.experimental_data.ExprerimentalData
@@ -637,6 +1027,20 @@ def run_enrichment_for_project(exp_data, project_name, databases=None,
     databases : list
     output_path : str
         Location to save all individual enrichment output files created.
+    max_workers : int
+        Number of databases to query enrichR with at the same time. With
+        partitioned=True, also the number of samples run at the same time.
+    cache : magine.enrichment.cache.EnrichrCache or bool, optional
+        Cache of enrichR responses shared across projects.
+    partitioned : bool
+        Save each (category, sample_id, database) unit as soon as it finishes
+        to a Parquet dataset, {project_name}_enrichment in output_path,
+        partitioned by category and sample_id. The status and timing of each
+        unit is kept in {project_name}_manifest.json, so running again after
+        an interruption only runs the units that did not finish.
+        Requires pyarrow.
+    url : str, optional
+        Base url of enrichR. Defaults to the public server.
 
     """
 
@@ -646,8 +1050,7 @@ def run_enrichment_for_project(exp_data, project_name, databases=None,
     logger.info("Running enrichment on project")
     logger.info("Running {} databases".format(len(databases)))
 
-    e = Enrichr(verbose=True)
-    all_df = []
+    e = Enrichr(verbose=True, max_workers=max_workers, cache=cache, url=url)
     if output_path is None:
         _dir = os.path.join(os.getcwd(), 'enrichment_output')
     else:
@@ -657,25 +1060,13 @@ def run_enrichment_for_project(exp_data, project_name, databases=None,
         logger.info("Creating output directory: {}".format(_dir))
         os.mkdir(_dir)
 
+    jobs = []
+
     def _run_new(samples, timepoints, category):
-        logger.info("Running {}".format(category))
         for genes, sample_id in zip(samples, timepoints):
             if not len(genes):
                 continue
-            logger.info('sample_id = {}'.format(sample_id))
-            current = "{}_{}_{}".format(category, sample_id, project_name)
-            name = os.path.join(_dir, current + '.csv.gz')
-            try:
-                df = pd.read_csv(name, index_col=None, encoding='utf-8')
-            except:
-                df = e.run(genes, databases)
-                df['sample_id'] = sample_id
-                df['category'] = category
-                df.to_csv(name, index=False, encoding='utf-8',
-                          compression='gzip')
-            df['sample_id'] = sample_id
-            df['category'] = category
-            all_df.append(df)
+            jobs.append((category, sample_id, genes))
 
     #  run each experimental 'source' by time point
     #  ( label-free, ph-silac, etc are all separate)
@@ -710,6 +1101,41 @@ def run_enrichment_for_project(exp_data, project_name, databases=None,
         _run_new(sample.down_by_sample, sample.sample_ids, 'rna_down')
         _run_new(sample.up_by_sample, sample.sample_ids, 'rna_up')
 
+    if partitioned:
+        all_df, n_saved = _run_partitioned(e, jobs, databases, _dir,
+                                           project_name)
+    else:
+        all_df = []
+        n_saved = 0
+        # identical gene lists are only sent to enrichR once
+        shared = dict()
+        for category, sample_id, genes in jobs:
+            logger.info("Running {} sample_id = {}".format(category,
+                                                           sample_id))
+            current = "{}_{}_{}".format(category, sample_id, project_name)
+            name = os.path.join(_dir, current + '.csv.gz')
+            try:
+                df = pd.read_csv(name, index_col=None, encoding='utf-8')
+            except (IOError, OSError, EOFError, ValueError):
+                # missing or truncated output of an interrupted run
+                key = _gene_list_key(genes)
+                if key in shared:
+                    df = shared[key].copy()
+                    n_saved += 1 + len(databases)
+                else:
+                    df = e.run(genes, databases)
+                    shared[key] = df
+                df['sample_id'] = sample_id
+                df['category'] = category
+                df.to_csv(name, index=False, encoding='utf-8',
+                          compression='gzip')
+            df['sample_id'] = sample_id
+            df['category'] = category
+            all_df.append(df)
+    n_saved += sum(e.saved_calls.values())
+    logger.info("Sharing identical gene lists saved {} enrichR calls".format(
+        n_saved))
+
     # merge all outputs
     final_df = pd.concat(all_df, ignore_index=True)
 
@@ -737,3 +1163,148 @@ def run_enrichment_for_project(exp_data, project_name, databases=None,
     logger.info("Saving output: {}_enrichment.csv.gz".format(project_name))
     final_df.to_csv('{}_enrichment.csv.gz'.format(project_name),
                     encoding='utf-8', compression='gzip', index=False)
+
+
+def _partition_dir(category, sample_id):
+    # hive style directories, readable with pd.read_parquet on the dataset
+    return partition_path([('category', category), ('sample_id', sample_id)])
+
+
+def _run_partitioned(e, jobs, databases, out_dir, project_name):
+    """ Run each (category, sample_id, database) unit tracked by a manifest
+
+    Parameters
+    ----------
+    e : Enrichr
+    jobs : list of tuple
+        (category, sample_id, genes)
+    databases : list
+    out_dir : str
+    project_name : str
+
+    Returns
+    -------
+    list of pd.DataFrame, int
+        Output of each (category, sample_id), number of enrichR calls saved
+        by reusing the output of identical gene lists
+    """
+    try:
+        import pyarrow  # noqa: F401
+    except ImportError:
+        raise ImportError('partitioned=True requires pyarrow')
+
+    dataset = '{}_enrichment'.format(project_name)
+    manifest = RunManifest(
+        os.path.join(out_dir, '{}_manifest.json'.format(project_name))
+    )
+
+    def _pending(job):
+        category, sample_id, _ = job
+        return [db for db in databases
+                if not manifest.is_done(category, sample_id, db, out_dir)]
+
+    # identical gene lists are run once, the others reuse their output
+    first_job = OrderedDict()
+    copies = []
+    for job in jobs:
+        key = _gene_list_key(job[2])
+        if key in first_job:
+            copies.append((job, first_job[key]))
+        else:
+            first_job[key] = job
+
+    todo = [(job, _pending(job)) for job in first_job.values()]
+    todo = [(job, dbs) for job, dbs in todo if dbs]
+    n_units = len(jobs) * len(databases)
+    n_todo = sum(len(dbs) for _, dbs in todo)
+    n_todo += sum(len(_pending(job)) for job, _ in copies)
+    logger.info("{} of {} units already finished".format(n_units - n_todo,
+                                                         n_units))
+
+    def _run_job(item):
+        (category, sample_id, genes), dbs = item
+        logger.info("Running {} sample_id = {}".format(category, sample_id))
+        manifest.start([(category, sample_id, db) for db in dbs])
+        try:
+            responses = e._fetch_entries(genes, dbs)
+        except Exception as err:
+            for db in dbs:
+                manifest.fail(category, sample_id, db, err, save=False)
+            manifest.save()
+            logger.warning("{} sample_id = {} failed: {}".format(
+                category, sample_id, err))
+            return
+        partition = os.path.join(dataset, _partition_dir(category, sample_id))
+        for db in dbs:
+            entries = responses.get(db)
+            if entries is None:
+                manifest.fail(category, sample_id, db,
+                              'no response from enrichR', save=False)
+                continue
+            df = e._parse_entries(entries, db)
+            path = None
+            if df.shape[0]:
+                path = os.path.join(partition, '{}.parquet'.format(db))
+                _write_parquet(pd.DataFrame(df), os.path.join(out_dir, path))
+            manifest.finish(category, sample_id, db, n_rows=df.shape[0],
+                            path=path, save=False)
+        manifest.save()
+
+    start = time.time()
+    e._map(_run_job, todo)
+
+    n_saved = 0
+    for job, source in copies:
+        category, sample_id, _ = job
+        dbs = _pending(job)
+        if not dbs:
+            continue
+        manifest.start([(category, sample_id, db) for db in dbs])
+        partition = os.path.join(dataset, _partition_dir(category, sample_id))
+        for db in dbs:
+            unit = manifest.get(source[0], source[1], db)
+            if unit['status'] == done:
+                path = None
+                if unit['path'] is not None:
+                    path = os.path.join(partition, '{}.parquet'.format(db))
+                    _copy_file(os.path.join(out_dir, unit['path']),
+                               os.path.join(out_dir, path))
+                manifest.finish(category, sample_id, db, n_rows=unit['n_rows'],
+                                path=path, save=False)
+            else:
+                manifest.fail(category, sample_id, db, unit['error'],
+                              save=False)
+        n_saved += 1 + len(dbs)
+        manifest.save()
+
+    counts = manifest.counts()
+    manifest.summary = dict(n_units=n_units, n_resumed=n_units - n_todo,
+                            n_failed=counts.get(failed, 0),
+                            saved_calls=n_saved + sum(e.saved_calls.values()),
+                            seconds=time.time() - start)
+    manifest.save()
+    if counts.get(failed, 0):
+        logger.warning("{} units failed, run again to retry them".format(
+            counts[failed]))
+
+    all_df = []
+    for category, sample_id, _ in jobs:
+        for db in databases:
+            unit = manifest.get(category, sample_id, db)
+            if unit is None or unit['status'] != done or unit['path'] is None:
+                continue
+            df = pd.read_parquet(os.path.join(out_dir, unit['path']))
+            df['sample_id'] = sample_id
+            df['category'] = category
+            all_df.append(df)
+    return all_df, n_saved
+
+
+def _write_parquet(df, file_name):
+    atomic_write(file_name, lambda tmp_path: df.to_parquet(tmp_path,
+                                                           index=False))
+
+
+def _copy_file(source, file_name):
+    atomic_write(file_name, lambda tmp_path: shutil.copyfile(source,
+                                                             tmp_path))
@@ -0,0 +1,299 @@
+"""
+Export of enrichment results without building wide tables in memory.
+
+LazyPivot describes the pivoted view of a table, terms by sample_id, and
+builds it a block of terms at a time. write_pivot_xlsx streams those blocks
+to an xlsx file, and export_partitioned writes one Parquet or Feather file
+per db and sample_id.
+"""
+import os
+import tempfile
+import time
+from urllib.parse import quote
+
+import numpy as np
+import pandas as pd
+
+from magine.logging import get_logger
+
+logger = get_logger(__name__)
+
+
+class LazyPivot(object):
+    """ Pivoted view of an enrichment table, built in blocks of rows
+
+    Blocks are the output of pandas.pivot_table with aggfunc='first' on the
+    rows of their terms, with the columns of the full pivot.
+
+    Parameters
+    ----------
+    data : pandas.DataFrame
+    index : list
+        Columns that identify a row of the pivot
+    columns : str
+        Column whose values become columns of the pivot
+    values : list, optional
+        Columns to pivot, defaults to all other columns
+
+    Examples
+    --------
+    >>> df = pd.DataFrame({'term_name': ['a', 'a', 'b'], 'db': 'x',
+    ...                    'sample_id': [1, 2, 1], 'rank': [1, 2, 3]})
+    >>> LazyPivot(df).to_frame()['rank'].values.tolist()
+    [[1.0, 2.0], [3.0, nan]]
+    """
+
+    def __init__(self, data, index=('term_name', 'db'), columns='sample_id',
+                 values=None):
+        self.data = data
+        self.index_names = list(index)
+        self.columns_name = columns
+        if values is None:
+            values = [i for i in data.columns
+                      if i not in self.index_names and i != columns]
+        self.values = sorted(values)
+
+        # rows sorted by term, so each block of terms is a slice of rows
+        key = np.zeros(data.shape[0], dtype=np.int64)
+        for name in self.index_names:
+            codes, uniques = pd.factorize(data[name], sort=True)
+            key = key * (len(uniques) + 1) + codes + 1
+        self._order = np.argsort(key, kind='stable')
+        sorted_key = key[self._order]
+        self._starts = np.r_[
+            0, np.flatnonzero(np.diff(sorted_key)) + 1, len(sorted_key)
+        ]
+        self._columns = None
+
+    @property
+    def n_rows(self):
+        """ Number of terms, before terms without values are dropped """
+        return len(self._starts) - 1
+
+    @property
+    def columns(self):
+        """ (value, sample) columns that have at least one value """
+        if self._columns is None:
+            samples = self.data[self.columns_name]
+            if hasattr(samples, 'cat'):
+                order = [i for i in samples.cat.categories
+                         if (samples == i).any()]
+            else:
+                order = sorted(samples.dropna().unique())
+            pairs = []
+            for value in self.values:
+                present = set(samples[self.data[value].notnull()].unique())
+                pairs.extend((value, i) for i in order if i in present)
+            names = [i[0] for i in pairs]
+            ids = [i[1] for i in pairs]
+            if hasattr(samples, 'cat'):
+                ids = pd.Categorical(ids, categories=samples.cat.categories)
+            self._columns = pd.MultiIndex.from_arrays(
+                [names, ids], names=[None, self.columns_name]
+            )
+        return self._columns
+
+    def blocks(self, block_size=10000):
+        """ Yield the pivot block_size terms at a time
+
+        Returns
+        -------
+        generator of pandas.DataFrame
+        """
+        for start in range(0, self.n_rows, block_size):
+            end = min(start + block_size, self.n_rows)
+            rows = self._order[self._starts[start]:self._starts[end]]
+            chunk = pd.DataFrame(self.data).iloc[rows]
+            table = pd.pivot_table(chunk, index=self.index_names,
+                                   columns=self.columns_name,
+                                   values=self.values, aggfunc='first')
+            if table.shape[0]:
+                yield table.reindex(columns=self.columns)
+
+    def to_frame(self):
+        """ The full pivot, only for tables that fit in memory """
+        blocks = list(self.blocks())
+        if not blocks:
+            return pd.DataFrame(columns=self.columns)
+        return pd.concat(blocks)
+
+
+def write_pivot_xlsx(pivot, file_name, block_size=10000):
+    """ Write a LazyPivot to xlsx one block at a time
+
+    The layout is that of pandas.DataFrame.to_excel with merge_cells=True.
+
+    Parameters
+    ----------
+    pivot : LazyPivot
+    file_name : str
+    block_size : int
+        Number of terms held in memory
+    """
+    try:
+        from openpyxl import Workbook
+        from openpyxl.utils import get_column_letter
+    except ImportError:
+        raise ImportError('write_pivot_xlsx requires openpyxl')
+    start = time.time()
+    n_index = len(pivot.index_names)
+    columns = pivot.columns
+    wb = Workbook(write_only=True)
+    ws = wb.create_sheet()
+
+    values = columns.get_level_values(0)
+    ws.append([None] * n_index + [
+        v if i == 0 or values[i - 1] != v else None
+        for i, v in enumerate(values)
+    ])
+    first = 0
+    for i in range(1, len(values) + 1):
+        if i == len(values) or values[i] != values[first]:
+            if i - first > 1:
+                ws.merged_cells.add('{}1:{}1'.format(
+                    get_column_letter(n_index + first + 1),
+                    get_column_letter(n_index + i)
+                ))
+            first = i
+    ws.append([None] * (n_index - 1) + [pivot.columns_name] +
+              [_cell(i) for i in columns.get_level_values(1)])
+    ws.append(pivot.index_names)
+
+    # outer index values are merged over the rows that repeat them
+    header = 3
+    n_rows = 0
+    previous = None
+    run_start = [header + 1] * (n_index - 1)
+
+    def _merge_runs(levels, last_row):
+        for level in levels:
+            if last_row > run_start[level]:
+                column = get_column_letter(level + 1)
+                ws.merged_cells.add('{0}{1}:{0}{2}'.format(
+                    column, run_start[level], last_row))
+
+    for block in pivot.blocks(block_size):
+        for key, row in zip(block.index.tolist(), block.values):
+            if n_index == 1:
+                key = (key,)
+            row_number = header + n_rows + 1
+            index_cells = [_cell(i) for i in key]
+            if previous is not None:
+                same = 0
+                while same < n_index - 1 and key[same] == previous[same]:
+                    same += 1
+                _merge_runs(range(same, n_index - 1), row_number - 1)
+                for level in range(same, n_index - 1):
+                    run_start[level] = row_number
+                for level in range(same):
+                    index_cells[level] = None
+            ws.append(index_cells + [_cell(i) for i in row])
+            previous = key
+            n_rows += 1
+    _merge_runs(range(n_index - 1), header + n_rows)
+    wb.save(file_name)
+    logger.info("Saved {} ({} rows) in {:.2f} s".format(
+        file_name, n_rows, time.time() - start))
+
+
+def _cell(value):
+    # openpyxl does not accept numpy scalars or NaN
+    if value is None:
+        return None
+    if isinstance(value, np.generic):
+        value = value.item()
+    if isinstance(value, float) and np.isnan(value):
+        return None
+    return value
+
+
+def partition_path(pairs):
+    """ Hive style directory of (column, value) pairs """
+    return os.path.join(*['{}={}'.format(name, quote(str(value), safe=''))
+                          for name, value in pairs])
+
+
+def export_partitioned(data, path, partition_cols=('db', 'sample_id'),
+                       file_format='parquet'):
+    """ Write one file per combination of partition_cols
+
+    Files are written to hive style directories, such as
+    path/db=KEGG_2016/sample_id=1/part-0.parquet, without the partition
+    columns, which readers restore from the directory names. Parquet output
+    can be read with load_enrichment_parquet(path) and Feather output with
+    load_enrichment_feather(path). Requires pyarrow.
+
+    Parameters
+    ----------
+    data : pandas.DataFrame
+    path : str
+        Directory of the dataset
+    partition_cols : list
+    file_format : {'parquet', 'feather'}
+
+    Returns
+    -------
+    list of str
+        Files written
+
+    Raises
+    ------
+    ValueError
+        If a partition column has missing values
+    """
+    try:
+        import pyarrow  # noqa: F401
+    except ImportError:
+        raise ImportError('export_partitioned requires pyarrow')
+    if file_format not in ('parquet', 'feather'):
+        raise ValueError("file_format must be 'parquet' or 'feather'")
+    start = time.time()
+    partition_cols = list(partition_cols)
+    data = pd.DataFrame(data)
+
+    key = np.zeros(data.shape[0], dtype=np.int64)
+    for name in partition_cols:
+        codes, values = pd.factorize(data[name])
+        # rows would be dropped, or the dataset could not be read back
+        if (codes < 0).any():
+            raise ValueError("{} has missing values".format(name))
+        key = key * len(values) + codes
+    order = np.argsort(key, kind='stable')
+    bounds = np.r_[0, np.flatnonzero(np.diff(key[order])) + 1, len(order)]
+
+    body = data.drop(columns=partition_cols)
+    written = []
+    for lo, hi in zip(bounds[:-1], bounds[1:]):
+        rows = order[lo:hi]
+        pairs = [(name, data[name].iloc[rows[0]]) for name in partition_cols]
+        file_name = os.path.join(
+            path, partition_path(pairs), 'part-0.{}'.format(file_format)
+        )
+        _write(body.iloc[rows].reset_index(drop=True), file_name,
+               file_format)
+        written.append(file_name)
+    logger.info("Saved {} files to {} in {:.2f} s".format(
+        len(written), path, time.time() - start))
+    return written
+
+
+def _write(df, file_name, file_format):
+    if file_format == 'parquet':
+        atomic_write(file_name,
+                     lambda tmp_path: df.to_parquet(tmp_path, index=False))
+    else:
+        atomic_write(file_name, lambda tmp_path: df.to_feather(tmp_path))
+
+
+def atomic_write(file_name, write):
+    """ Call write(tmp_path), then move the file into place
+
+    Readers never see a partially written file_name.
+    """
+    directory = os.path.dirname(file_name)
+    if not os.path.exists(directory):
+        os.makedirs(directory, exist_ok=True)
+    fd, tmp_path = tempfile.mkstemp(dir=directory, suffix='.tmp')
+    os.close(fd)
+    write(tmp_path)
+    os.replace(tmp_path, file_name)
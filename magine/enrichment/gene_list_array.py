@@ -0,0 +1,254 @@
+"""
+Compact storage of the comma separated 'genes' column of enrichment tables.
+
+Every row is stored as a slice of one integer array of gene codes, so a
+gene name is stored once no matter how many terms or samples contain it.
+"""
+import itertools
+
+import numpy as np
+import pandas as pd
+from pandas.api.extensions import ExtensionArray, ExtensionDtype, \
+    register_extension_dtype
+from pandas.api.indexers import check_array_indexer
+
+
+@register_extension_dtype
+class GeneListDtype(ExtensionDtype):
+    """ dtype of :class:`GeneListArray` """
+    name = 'genelist'
+    type = str
+    kind = 'O'
+    na_value = np.nan
+
+    @classmethod
+    def construct_array_type(cls):
+        return GeneListArray
+
+    @classmethod
+    def construct_from_string(cls, string):
+        if string == cls.name:
+            return cls()
+        raise TypeError("Cannot construct a '{}' from '{}'".format(
+            cls.__name__, string))
+
+    def __from_arrow__(self, array):
+        # pyarrow restores columns saved from a GeneListArray with this
+        return GeneListArray.from_strings(np.asarray(array.to_pandas()))
+
+
+class GeneListArray(ExtensionArray):
+    """ Comma separated gene lists stored as codes into a gene vocabulary
+
+    Row i holds the genes vocabulary[codes[offsets[i]:offsets[i + 1]]], in
+    their original order, so converting back to str is lossless. Use
+    astype(object) for pandas string methods.
+
+    Parameters
+    ----------
+    codes : np.ndarray
+        int32 gene codes of all rows
+    offsets : np.ndarray
+        int64, start of each row in codes, length n_rows + 1
+    vocabulary : np.ndarray
+        Gene names, shared by arrays taken from this one
+    missing : np.ndarray, optional
+        bool, rows that are missing
+
+    Examples
+    --------
+    >>> genes = GeneListArray.from_strings(['BAX,BCL2', 'BAX', 'CASP3'])
+    >>> genes[0]
+    'BAX,BCL2'
+    >>> len(genes.vocabulary)
+    3
+    """
+
+    def __init__(self, codes, offsets, vocabulary, missing=None):
+        self._codes = np.asarray(codes, dtype=np.int32)
+        self._offsets = np.asarray(offsets, dtype=np.int64)
+        self._vocabulary = np.asarray(vocabulary, dtype=object)
+        if missing is None:
+            missing = np.zeros(len(self._offsets) - 1, dtype=bool)
+        self._missing = np.asarray(missing, dtype=bool)
+
+    @classmethod
+    def from_strings(cls, values, vocabulary=None):
+        """ Encode comma separated gene lists
+
+        Parameters
+        ----------
+        values : array_like
+            str or missing values
+        vocabulary : array_like, optional
+            Known genes, new genes are appended
+
+        Returns
+        -------
+        GeneListArray
+        """
+        values = np.asarray(values, dtype=object)
+        missing = pd.isnull(values)
+        split = [() if m else str(v).split(',')
+                 for v, m in zip(values, missing)]
+        lengths = np.fromiter((len(i) for i in split), dtype=np.int64,
+                              count=len(split))
+        flat = np.fromiter(itertools.chain.from_iterable(split),
+                           dtype=object, count=lengths.sum())
+        if vocabulary is None:
+            vocabulary = np.array([], dtype=object)
+        vocabulary = pd.Index(np.asarray(vocabulary, dtype=object))
+        codes = vocabulary.get_indexer(flat)
+        new = codes < 0
+        if new.any():
+            added, inverse = np.unique(flat[new], return_inverse=True)
+            codes[new] = len(vocabulary) + inverse
+            vocabulary = vocabulary.append(pd.Index(added))
+        return cls(codes, np.r_[0, np.cumsum(lengths)],
+                   vocabulary.values, missing)
+
+    @classmethod
+    def _from_sequence(cls, scalars, dtype=None, copy=False):
+        if isinstance(scalars, cls):
+            return scalars.copy() if copy else scalars
+        return cls.from_strings(scalars)
+
+    @classmethod
+    def _from_factorized(cls, values, original):
+        return cls.from_strings(values, original.vocabulary)
+
+    @property
+    def dtype(self):
+        return GeneListDtype()
+
+    @property
+    def codes(self):
+        """ Gene codes of all rows """
+        return self._codes
+
+    @property
+    def offsets(self):
+        """ Start of each row in codes, length n_rows + 1 """
+        return self._offsets
+
+    @property
+    def vocabulary(self):
+        """ Gene names of the codes """
+        return self._vocabulary
+
+    @property
+    def lengths(self):
+        """ Number of genes of each row """
+        return np.diff(self._offsets)
+
+    @property
+    def nbytes(self):
+        return (self._codes.nbytes + self._offsets.nbytes +
+                self._missing.nbytes + self._vocabulary.nbytes)
+
+    def __len__(self):
+        return len(self._missing)
+
+    def _decode(self, i):
+        if self._missing[i]:
+            return np.nan
+        codes = self._codes[self._offsets[i]:self._offsets[i + 1]]
+        return ','.join(self._vocabulary[codes])
+
+    def __getitem__(self, item):
+        if isinstance(item, (int, np.integer)):
+            if item < 0:
+                item += len(self)
+            if not 0 <= item < len(self):
+                raise IndexError("index out of bounds")
+            return self._decode(item)
+        item = check_array_indexer(self, item)
+        return self.take(np.arange(len(self))[item])
+
+    def __setitem__(self, key, value):
+        values = np.asarray(self, dtype=object)
+        values[key] = value
+        new = self.from_strings(values, self._vocabulary)
+        self._codes, self._offsets = new._codes, new._offsets
+        self._vocabulary, self._missing = new._vocabulary, new._missing
+
+    def __iter__(self):
+        for i in range(len(self)):
+            yield self._decode(i)
+
+    def __array__(self, dtype=None):
+        values = np.empty(len(self), dtype=object)
+        values[:] = list(self)
+        if dtype is not None and dtype != object:
+            return values.astype(dtype)
+        return values
+
+    def __arrow_array__(self, type=None):
+        # stored as str so other tools can read it
+        import pyarrow
+        return pyarrow.array(np.asarray(self), type=pyarrow.string(),
+                             from_pandas=True)
+
+    def __eq__(self, other):
+        if isinstance(other, (pd.Series, pd.Index, pd.DataFrame)):
+            return NotImplemented
+        return np.asarray(self) == np.asarray(other, dtype=object)
+
+    def isna(self):
+        return self._missing.copy()
+
+    def take(self, indices, allow_fill=False, fill_value=None):
+        indices = np.asarray(indices, dtype=np.int64)
+        fill = np.zeros(len(indices), dtype=bool)
+        if allow_fill:
+            fill = indices == -1
+            if (indices < -1).any():
+                raise ValueError("invalid value in indices")
+            if fill_value is not None and not pd.isnull(fill_value):
+                raise ValueError("only missing values can be filled")
+        elif len(indices) and (indices < 0).any():
+            indices = np.where(indices < 0, indices + len(self), indices)
+        if len(indices) and (indices[~fill] >= len(self)).any():
+            raise IndexError("index out of bounds")
+        positions = np.where(fill, 0, indices)
+        lengths = np.where(fill, 0, self.lengths[positions] if len(self)
+                           else 0)
+        offsets = np.r_[0, np.cumsum(lengths)]
+        starts = self._offsets[positions] if len(self) else positions
+        gather = np.repeat(starts - offsets[:-1], lengths) + \
+            np.arange(offsets[-1])
+        missing = fill | (self._missing[positions] if len(self) else fill)
+        return GeneListArray(self._codes[gather], offsets, self._vocabulary,
+                             missing)
+
+    def copy(self):
+        return GeneListArray(self._codes.copy(), self._offsets.copy(),
+                             self._vocabulary, self._missing.copy())
+
+    @classmethod
+    def _concat_same_type(cls, to_concat):
+        to_concat = list(to_concat)
+        if not to_concat:
+            return cls.from_strings([])
+        vocabulary = to_concat[0].vocabulary
+        if any(i.vocabulary is not vocabulary for i in to_concat):
+            vocabulary = pd.Index(np.concatenate(
+                [i.vocabulary for i in to_concat])).unique()
+            codes = [vocabulary.get_indexer(i.vocabulary)[i.codes]
+                     for i in to_concat]
+            vocabulary = vocabulary.values
+        else:
+            codes = [i.codes for i in to_concat]
+        lengths = [i.lengths for i in to_concat]
+        return cls(np.concatenate(codes),
+                   np.r_[0, np.cumsum(np.concatenate(lengths))],
+                   vocabulary,
+                   np.concatenate([i._missing for i in to_concat]))
+
+    def _values_for_factorize(self):
+        return np.asarray(self), np.nan
+
+    def astype(self, dtype, copy=True):
+        if isinstance(dtype, GeneListDtype) or dtype == GeneListDtype.name:
+            return self.copy() if copy else self
+        return super(GeneListArray, self).astype(dtype, copy=copy)
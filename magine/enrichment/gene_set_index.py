@@ -0,0 +1,158 @@
+import itertools
+
+import numpy as np
+import pandas as pd
+import scipy.sparse as sparse
+
+from magine.enrichment.gene_list_array import GeneListArray
+
+
+class GeneSetIndex(object):
+    """ Integer encoded gene sets of an enrichment table
+
+    The comma separated 'genes' column is split once and every gene is
+    replaced by its position in a shared, sorted vocabulary. Gene sets of
+    each row, each term and each (term, sample_id) pair are stored as rows of
+    sparse boolean matrices, so looking up a term is a dictionary access.
+
+    Parameters
+    ----------
+    term_names : array_like
+        term_name of each row
+    genes : array_like
+        Comma separated genes of each row
+    sample_ids : array_like, optional
+        sample_id of each row
+
+    Examples
+    --------
+    >>> index = GeneSetIndex(['a', 'b', 'a'], ['BAX,BID', 'BAX', 'CASP3'])
+    >>> sorted(index.term_genes('a'))
+    ['BAX', 'BID', 'CASP3']
+    """
+
+    def __init__(self, term_names, genes, sample_ids=None):
+        genes = getattr(genes, 'array', genes)
+        if isinstance(genes, GeneListArray) and not genes.isna().any():
+            # already encoded, only the vocabulary has to be sorted
+            order = np.argsort(genes.vocabulary)
+            remap = np.empty(len(order), dtype=np.int64)
+            remap[order] = np.arange(len(order))
+            codes = remap[genes.codes]
+            vocabulary = genes.vocabulary[order]
+            lengths = genes.lengths
+        else:
+            genes = pd.Series(np.asarray(genes, dtype=object)).fillna('')
+            split = genes.str.split(',').values
+            lengths = np.fromiter((len(i) for i in split), dtype=np.int64,
+                                  count=len(split))
+            flat = np.fromiter(itertools.chain.from_iterable(split),
+                               dtype=object, count=lengths.sum())
+            codes, vocabulary = pd.factorize(flat, sort=True)
+        n_rows = len(lengths)
+        self.vocabulary = np.asarray(vocabulary, dtype=object)
+        self.gene_codes = {g: i for i, g in enumerate(self.vocabulary)}
+        self.row_matrix = _binary_csr(
+            (np.ones(len(codes), dtype=np.int8), codes,
+             np.r_[0, np.cumsum(lengths)]),
+            shape=(n_rows, len(self.vocabulary))
+        )
+
+        self._term_names = np.asarray(term_names, dtype=object)
+        term_codes, terms = pd.factorize(self._term_names)
+        self.terms = np.asarray(terms, dtype=object)
+        self.term_position = {t: i for i, t in enumerate(self.terms)}
+        self.term_rows = _group_matrix(term_codes, len(self.terms))
+        self.term_matrix = _binary_csr(self.term_rows @ self.row_matrix)
+        self._sample_ids = None
+        if sample_ids is not None:
+            self._sample_ids = np.asarray(sample_ids, dtype=object)
+        self._pair_position = None
+        self._pair_matrix = None
+
+    @property
+    def n_rows(self):
+        return self.row_matrix.shape[0]
+
+    def _codes(self, matrix, position):
+        return matrix.indices[matrix.indptr[position]:
+                              matrix.indptr[position + 1]]
+
+    def term_codes(self, term):
+        """ Sorted gene codes of all rows of a term """
+        position = self.term_position.get(term)
+        if position is None:
+            return np.array([], dtype=self.term_matrix.indices.dtype)
+        return self._codes(self.term_matrix, position)
+
+    def row_codes(self, row):
+        """ Sorted gene codes of a row, by position """
+        return self._codes(self.row_matrix, row)
+
+    def rows_of_term(self, term):
+        """ Sorted row positions of a term """
+        position = self.term_position.get(term)
+        if position is None:
+            return np.array([], dtype=np.int64)
+        return self._codes(self.term_rows, position)
+
+    def _build_pairs(self):
+        if self._sample_ids is None:
+            raise AssertionError("Index was built without sample_ids")
+        pairs = pd.MultiIndex.from_arrays([self._term_names,
+                                           self._sample_ids])
+        pair_codes, uniques = pairs.factorize()
+        self._pair_position = {p: i for i, p in enumerate(uniques)}
+        self._pair_matrix = _binary_csr(
+            _group_matrix(pair_codes, len(uniques)) @ self.row_matrix
+        )
+
+    def term_sample_codes(self, term, sample_id):
+        """ Sorted gene codes of a term within a single sample_id """
+        if self._pair_position is None:
+            self._build_pairs()
+        position = self._pair_position.get((term, sample_id))
+        if position is None:
+            return np.array([], dtype=self._pair_matrix.indices.dtype)
+        return self._codes(self._pair_matrix, position)
+
+    def decode(self, codes):
+        """ Set of gene names from gene codes """
+        return set(self.vocabulary[codes])
+
+    def term_genes(self, term):
+        """ Set of genes of a term, or of a list of terms """
+        if isinstance(term, str):
+            return self.decode(self.term_codes(term))
+        positions = [self.term_position[i] for i in term
+                     if i in self.term_position]
+        if not positions:
+            return set()
+        used = self.term_matrix[positions].indices
+        return self.decode(np.unique(used))
+
+    def term_gene_sets(self, terms=None):
+        """ dict of term to set of genes """
+        if terms is None:
+            terms = self.terms
+        return {t: self.term_genes(t) for t in terms}
+
+
+def _binary_csr(*args, **kwargs):
+    matrix = sparse.csr_matrix(*args, **kwargs)
+    matrix.sum_duplicates()
+    matrix.data[:] = 1
+    matrix.sort_indices()
+    return matrix
+
+
+def _group_matrix(group_codes, n_groups):
+    """ n_groups x rows indicator matrix of factorized group codes """
+    rows = np.arange(len(group_codes))
+    valid = group_codes >= 0
+    # int32 so that counts of large groups can not overflow to 0
+    return sparse.csr_matrix(
+        (np.ones(valid.sum(), dtype=np.int32),
+         (group_codes[valid], rows[valid])),
+        shape=(n_groups, len(group_codes))
+    )
@@ -0,0 +1,383 @@
+"""
+Index of the Gene Ontology DAG for ancestor and common ancestor queries.
+
+Terms are encoded as integers in topological order, parents before children.
+The transitive closure of each term's ancestors, including the term itself,
+is a row of a sparse boolean matrix. Ancestor checks, common ancestors and
+deepest common ancestors of many terms or term pairs are then row products
+of that matrix instead of walks of the graph. The index is built from go.obo
+once per GO release and saved in the MAGINE data directory.
+"""
+import os
+
+import numpy as np
+import scipy.sparse as sparse
+
+from magine.data.storage import id_mapping_dir
+from magine.logging import get_logger
+
+logger = get_logger(__name__)
+
+_index_file = os.path.join(id_mapping_dir, 'go_index.npz')
+
+
+def obo_release(obo_file):
+    """ data-version of an obo file, or None if it has none """
+    with open(obo_file, 'r') as f:
+        for line in f:
+            if line.startswith('['):
+                break
+            if line.startswith('data-version:'):
+                return line.split(':', 1)[1].strip()
+    return None
+
+
+def parse_obo(obo_file, relationships=()):
+    """ Terms of an obo file that are not obsolete
+
+    Parameters
+    ----------
+    obo_file : str
+    relationships : tuple of str
+        Relationships other than is_a to treat as parents, such as 'part_of'
+
+    Returns
+    -------
+    list of dict
+        id, name, namespace, alt_ids and parents of each term
+    """
+    terms = []
+    term = None
+    with open(obo_file, 'r') as f:
+        for line in f:
+            line = line.strip()
+            if line.startswith('['):
+                term = None
+                if line == '[Term]':
+                    term = dict(id=None, name='', namespace='', alt_ids=[],
+                                parents=[], obsolete=False)
+                    terms.append(term)
+                continue
+            if term is None or ':' not in line:
+                continue
+            key, value = line.split(':', 1)
+            # drop trailing comments, 'GO:0000001 ! name'
+            value = value.split(' ! ', 1)[0].strip()
+            if key == 'id':
+                term['id'] = value
+            elif key == 'name':
+                term['name'] = value
+            elif key == 'namespace':
+                term['namespace'] = value
+            elif key == 'alt_id':
+                term['alt_ids'].append(value)
+            elif key == 'is_a':
+                term['parents'].append(value.split()[0])
+            elif key == 'relationship':
+                kind, parent = value.split()[:2]
+                if kind in relationships:
+                    term['parents'].append(parent)
+            elif key == 'is_obsolete':
+                term['obsolete'] = value == 'true'
+    return [i for i in terms if not i['obsolete'] and i['id'] is not None]
+
+
+class GOIndex(object):
+    """ Integer encoded GO DAG with ancestor closure
+
+    Parameters
+    ----------
+    ids : array_like
+        GO ids in topological order, parents before children
+    names : array_like
+    namespaces : array_like
+    parents : scipy.sparse.csr_matrix
+        parents[i, j] is 1 if ids[j] is a direct parent of ids[i]
+    alt_ids : dict, optional
+        Alternative GO id to GO id
+    release : str, optional
+        data-version of the obo file the index was built from
+    ancestors : scipy.sparse.csr_matrix, optional
+        Precomputed closure, see :meth:`save`
+    """
+
+    def __init__(self, ids, names, namespaces, parents, alt_ids=None,
+                 release=None, ancestors=None):
+        self.ids = np.asarray(ids, dtype=object)
+        self.names = np.asarray(names, dtype=object)
+        self.namespaces = np.asarray(namespaces, dtype=object)
+        self.parents = sparse.csr_matrix(parents, dtype=np.int8)
+        self.parents.sort_indices()
+        self.release = release
+        self.position = {k: i for i, k in enumerate(self.ids)}
+        for alt, main in (alt_ids or {}).items():
+            if main in self.position:
+                self.position.setdefault(alt, self.position[main])
+        self.alt_ids = dict(alt_ids or {})
+        self.depth, self.level = self._depth_and_level()
+        if ancestors is None:
+            ancestors = self._closure()
+        self.ancestors = sparse.csr_matrix(ancestors, dtype=np.int8)
+
+    def __len__(self):
+        return len(self.ids)
+
+    def __contains__(self, go_id):
+        return go_id in self.position
+
+    def _depth_and_level(self):
+        # longest and shortest path to a root, parents come first
+        # relaxed over all edges at once, one round per level of the DAG
+        n = len(self.ids)
+        edges = self.parents.tocoo()
+        child, parent = edges.row, edges.col
+        depth = np.zeros(n, dtype=np.int32)
+        level = np.zeros(n, dtype=np.int32)
+        level[np.unique(child)] = n
+        for _ in range(n):
+            new_depth = depth.copy()
+            new_level = level.copy()
+            np.maximum.at(new_depth, child, depth[parent] + 1)
+            np.minimum.at(new_level, child, level[parent] + 1)
+            if (new_depth == depth).all() and (new_level == level).all():
+                break
+            depth, level = new_depth, new_level
+        return depth, level
+
+    def _closure(self):
+        n = len(self.ids)
+        indptr, indices = self.parents.indptr, self.parents.indices
+        rows = []
+        for i in range(n):
+            closure = {i}
+            for p in indices[indptr[i]:indptr[i + 1]]:
+                closure.update(rows[p])
+            rows.append(closure)
+        lengths = np.fromiter((len(i) for i in rows), dtype=np.int64, count=n)
+        columns = np.fromiter((j for i in rows for j in sorted(i)),
+                              dtype=np.int32, count=lengths.sum())
+        return sparse.csr_matrix(
+            (np.ones(len(columns), dtype=np.int8), columns,
+             np.r_[0, np.cumsum(lengths)]), shape=(n, n)
+        )
+
+    @classmethod
+    def from_obo(cls, obo_file, relationships=()):
+        """ Build index from an obo file
+
+        Parameters
+        ----------
+        obo_file : str
+        relationships : tuple of str
+            Relationships other than is_a to treat as parents
+
+        Returns
+        -------
+        GOIndex
+        """
+        terms = parse_obo(obo_file, relationships)
+        by_id = dict((i['id'], i) for i in terms)
+        # Kahn's algorithm, ids sorted so the order is reproducible
+        children = dict((i, []) for i in by_id)
+        n_parents = dict()
+        for go_id in sorted(by_id):
+            parents = [p for p in set(by_id[go_id]['parents']) if p in by_id]
+            n_parents[go_id] = len(parents)
+            for p in parents:
+                children[p].append(go_id)
+        ready = sorted(i for i, n in n_parents.items() if n == 0)
+        order = []
+        while ready:
+            order.extend(ready)
+            next_ready = []
+            for go_id in ready:
+                for child in children[go_id]:
+                    n_parents[child] -= 1
+                    if n_parents[child] == 0:
+                        next_ready.append(child)
+            ready = sorted(next_ready)
+        if len(order) != len(by_id):
+            raise ValueError("{} contains a cycle".format(obo_file))
+
+        position = dict((k, i) for i, k in enumerate(order))
+        rows, cols = [], []
+        for go_id in order:
+            for p in set(by_id[go_id]['parents']):
+                if p in position:
+                    rows.append(position[go_id])
+                    cols.append(position[p])
+        n = len(order)
+        parents = sparse.csr_matrix(
+            (np.ones(len(rows), dtype=np.int8), (rows, cols)), shape=(n, n)
+        )
+        alt_ids = dict((alt, i['id']) for i in terms for alt in i['alt_ids'])
+        return cls(order, [by_id[i]['name'] for i in order],
+                   [by_id[i]['namespace'] for i in order], parents,
+                   alt_ids=alt_ids, release=obo_release(obo_file))
+
+    @classmethod
+    def load_or_build(cls, obo_file, file_name=None, relationships=()):
+        """ Load the saved index, building it if the GO release changed
+
+        Parameters
+        ----------
+        obo_file : str
+        file_name : str, optional
+            Defaults to go_index.npz in the MAGINE data directory
+        relationships : tuple of str
+
+        Returns
+        -------
+        GOIndex
+        """
+        if file_name is None:
+            file_name = _index_file
+        release = obo_release(obo_file)
+        if os.path.exists(file_name) and release is not None:
+            index = cls.load(file_name)
+            if index.release == release:
+                return index
+        logger.info("Building GO index from {}".format(obo_file))
+        index = cls.from_obo(obo_file, relationships)
+        index.save(file_name)
+        return index
+
+    def save(self, file_name):
+        """ Save index to a compressed numpy file """
+        alt = sorted(self.alt_ids.items())
+        with open(file_name, 'wb') as f:
+            np.savez_compressed(
+                f, ids=self.ids.astype(str), names=self.names.astype(str),
+                namespaces=self.namespaces.astype(str),
+                parent_indptr=self.parents.indptr,
+                parent_indices=self.parents.indices,
+                ancestor_indptr=self.ancestors.indptr,
+                ancestor_indices=self.ancestors.indices,
+                alt_ids=np.array([i[0] for i in alt], dtype=str),
+                alt_targets=np.array([i[1] for i in alt], dtype=str),
+                release=str(self.release),
+            )
+
+    @classmethod
+    def load(cls, file_name):
+        """ Load index saved with save """
+        with np.load(file_name) as f:
+            n = len(f['ids'])
+
+            def _csr(name):
+                indices = f[name + '_indices']
+                return sparse.csr_matrix(
+                    (np.ones(len(indices), dtype=np.int8), indices,
+                     f[name + '_indptr']), shape=(n, n)
+                )
+
+            release = str(f['release'])
+            return cls(
+                f['ids'], f['names'], f['namespaces'], _csr('parent'),
+                alt_ids=dict(zip(f['alt_ids'], f['alt_targets'])),
+                release=None if release == 'None' else release,
+                ancestors=_csr('ancestor')
+            )
+
+    def codes(self, terms):
+        """ Integer codes of GO ids, alternative ids are accepted """
+        return np.array([self.position[i] for i in terms], dtype=np.int64)
+
+    def ancestors_of(self, go_id, include_self=True):
+        """ GO ids of all ancestors of go_id """
+        i = self.position[go_id]
+        start, end = self.ancestors.indptr[i], self.ancestors.indptr[i + 1]
+        found = set(self.ids[self.ancestors.indices[start:end]])
+        if not include_self:
+            found.discard(self.ids[i])
+        return found
+
+    def is_ancestor(self, ancestor, go_id):
+        """ If ancestor is go_id or one of its ancestors """
+        i = self.position[go_id]
+        start, end = self.ancestors.indptr[i], self.ancestors.indptr[i + 1]
+        cols = self.ancestors.indices[start:end]
+        j = np.searchsorted(cols, self.position[ancestor])
+        return bool(j < len(cols) and cols[j] == self.position[ancestor])
+
+    def common_ancestors(self, terms):
+        """ GO ids that are ancestors of, or equal to, every term """
+        codes = np.unique(self.codes(terms))
+        counts = np.asarray(self.ancestors[codes].sum(axis=0)).ravel()
+        return set(self.ids[counts == len(codes)])
+
+    def deepest_common_ancestor(self, terms):
+        """ Common ancestor of terms with the largest depth
+
+        Raises KeyError if the terms have no common ancestor.
+        """
+        common = self.codes(self.common_ancestors(terms))
+        if not len(common):
+            raise KeyError("terms have no common ancestor")
+        return self.ids[common[np.argmax(self.depth[common])]]
+
+    def deepest_common_ancestors(self, terms_1, terms_2, chunk_size=100000):
+        """ Deepest common ancestor of each pair terms_1[k], terms_2[k]
+
+        Returns
+        -------
+        np.ndarray
+            Integer codes, -1 for pairs without a common ancestor
+        """
+        codes_1 = self.codes(terms_1)
+        codes_2 = self.codes(terms_2)
+        out = np.full(len(codes_1), -1, dtype=np.int64)
+        # depth + 1 so that roots are not mistaken for missing entries
+        weight = sparse.diags((self.depth + 1).astype(np.int64))
+        for start in range(0, len(codes_1), chunk_size):
+            chunk = slice(start, start + chunk_size)
+            common = self.ancestors[codes_1[chunk]].multiply(
+                self.ancestors[codes_2[chunk]]
+            ).tocsr() @ weight
+            common = sparse.csr_matrix(common)
+            found = np.diff(common.indptr) > 0
+            best = np.asarray(common.argmax(axis=1)).ravel()
+            out[chunk] = np.where(found, best, -1)
+        return out
+
+    def min_branch_lengths(self, terms_1, terms_2):
+        """ Edges from each pair to its deepest common ancestor and back
+
+        Depths are longest paths to the root, as in goatools.
+
+        Returns
+        -------
+        np.ndarray
+            -1 for pairs without a common ancestor
+        """
+        dca = self.deepest_common_ancestors(terms_1, terms_2)
+        lengths = self.depth[self.codes(terms_1)] + \
+            self.depth[self.codes(terms_2)] - 2 * self.depth[dca]
+        return np.where(dca < 0, -1, lengths)
+
+    def has_ancestor_in(self, terms):
+        """ If each term has another of terms as an ancestor
+
+        Parameters
+        ----------
+        terms : list
+
+        Returns
+        -------
+        np.ndarray of bool
+        """
+        codes = self.codes(terms)
+        within = self.ancestors[codes][:, codes].tocoo()
+        other = codes[within.row] != codes[within.col]
+        found = np.zeros(len(codes), dtype=bool)
+        found[within.row[other]] = True
+        return found
+
+    def edges_to_root(self, go_id):
+        """ (parent, child) GO id pairs of every path from go_id to a root """
+        i = self.position[go_id]
+        start, end = self.ancestors.indptr[i], self.ancestors.indptr[i + 1]
+        nodes = self.ancestors.indices[start:end]
+        edges = self.parents[nodes].tocoo()
+        return [(self.ids[p], self.ids[nodes[c]])
+                for c, p in zip(edges.row, edges.col)]
@@ -0,0 +1,249 @@
+"""
+Preranked gene set enrichment analysis (GSEA) against local gene set libraries.
+
+Species of each sample are ranked by a signed statistic and each term is
+scored with the weighted running sum of Subramanian et al. (2005). When gene
+labels are permuted, the null distribution of a term depends only on the
+number of its genes in the ranked list. One compiled, multi-threaded kernel
+therefore scores every term size of a sample from the same permutations,
+instead of permuting each term separately.
+"""
+import numpy as np
+import pandas as pd
+import scipy.sparse as sparse
+from numba import njit, prange
+
+from magine.enrichment.local_enrichment import _bh_adjust, _columns, \
+    _rank_within
+from magine.logging import get_logger
+
+logger = get_logger(__name__)
+
+_gsea_columns = _columns + ['es', 'nes', 'set_size']
+
+
+@njit(nogil=True)
+def _running_sum(positions, weights, n_genes):
+    """ Enrichment score and peak of sorted positions of hits
+
+    The running sum only changes direction at hits, so its extremes are
+    found from the hits alone in O(k).
+    """
+    k = positions.shape[0]
+    total = 0.
+    for i in range(k):
+        total += weights[positions[i]]
+    miss = 0.
+    if n_genes > k:
+        miss = 1. / (n_genes - k)
+    cumulative = 0.
+    top, top_at = 0., -1
+    bottom, bottom_at = 0., -1
+    for i in range(k):
+        # value before and after the i-th hit
+        before = cumulative - (positions[i] - i) * miss
+        if total > 0:
+            cumulative += weights[positions[i]] / total
+        else:
+            cumulative += 1. / k
+        after = cumulative - (positions[i] - i) * miss
+        if before < bottom:
+            bottom, bottom_at = before, i
+        if after > top:
+            top, top_at = after, i
+    if top >= -bottom:
+        return top, top_at
+    return bottom, bottom_at
+
+
+@njit(parallel=True, nogil=True)
+def _observed(indptr, positions, weights, n_genes):
+    """ Enrichment score and peak of each row of a csr of sorted positions """
+    n_terms = indptr.shape[0] - 1
+    scores = np.empty(n_terms)
+    peaks = np.empty(n_terms, dtype=np.int64)
+    for t in prange(n_terms):
+        scores[t], peaks[t] = _running_sum(
+            positions[indptr[t]:indptr[t + 1]], weights, n_genes
+        )
+    return scores, peaks
+
+
+@njit(nogil=True)
+def _next(state):
+    # splitmix64, so each permutation has its own reproducible stream
+    state = state + np.uint64(0x9E3779B97F4A7C15)
+    z = state
+    z = (z ^ (z >> np.uint64(30))) * np.uint64(0xBF58476D1CE4E5B9)
+    z = (z ^ (z >> np.uint64(27))) * np.uint64(0x94D049BB133111EB)
+    return state, z ^ (z >> np.uint64(31))
+
+
+@njit(parallel=True, nogil=True)
+def _null_scores(sizes, weights, n_genes, n_perm, seed):
+    """ Enrichment scores of random gene sets, len(sizes) x n_perm
+
+    sizes must be sorted ascending. Each permutation draws one random
+    ordering of the ranked list and takes its first k genes as the gene set
+    of size k, so the sorted positions of a set grow by insertion.
+    """
+    scores = np.empty((sizes.shape[0], n_perm))
+    max_size = sizes[-1]
+    for p in prange(n_perm):
+        order = np.arange(n_genes)
+        state = np.uint64(seed) ^ (np.uint64(p) *
+                                   np.uint64(0xD1B54A32D192ED03))
+        # partial Fisher-Yates shuffle of the first max_size genes
+        for i in range(max_size):
+            state, r = _next(state)
+            j = i + np.int64(r % np.uint64(n_genes - i))
+            tmp = order[i]
+            order[i] = order[j]
+            order[j] = tmp
+        positions = np.empty(max_size, dtype=np.int64)
+        n_sorted = 0
+        for s in range(sizes.shape[0]):
+            while n_sorted < sizes[s]:
+                value = order[n_sorted]
+                j = n_sorted
+                while j > 0 and positions[j - 1] > value:
+                    positions[j] = positions[j - 1]
+                    j -= 1
+                positions[j] = value
+                n_sorted += 1
+            scores[s, p] = _running_sum(positions[:n_sorted], weights,
+                                        n_genes)[0]
+    return scores
+
+
+def _normalize(scores, null):
+    """ Normalized scores and permutation p-values of terms of one size
+
+    Scores are divided by the mean of the null scores of the same sign, and
+    p-values are the fraction of null scores of the same sign that are at
+    least as extreme.
+    """
+    positive = np.sort(null[null >= 0])
+    negative = np.sort(-null[null < 0])
+    nes = np.zeros(len(scores))
+    p_values = np.ones(len(scores))
+    for same_sign, keep, sign in ((positive, scores >= 0, 1.),
+                                  (negative, scores < 0, -1.)):
+        if not keep.any() or not len(same_sign):
+            continue
+        magnitude = sign * scores[keep]
+        n_extreme = len(same_sign) - np.searchsorted(same_sign, magnitude,
+                                                     side='left')
+        p_values[keep] = (n_extreme + 1.) / (len(same_sign) + 1.)
+        mean = same_sign.mean()
+        if mean > 0:
+            nes[keep] = scores[keep] / mean
+    return nes, p_values
+
+
+def score_library_prerank(library, ranked_lists, n_perm=1000, weight=1.,
+                          min_size=15, max_size=500, seed=0):
+    """ Preranked GSEA of ranked species lists against a library
+
+    Parameters
+    ----------
+    library : magine.enrichment.local_enrichment.GeneSetLibrary
+    ranked_lists : list of pandas.Series
+        Statistic of each species, indexed by gene name
+    n_perm : int
+        Number of gene label permutations of each sample
+    weight : float
+        Exponent of the statistic used to weight hits, 0 gives the
+        unweighted Kolmogorov-Smirnov statistic
+    min_size, max_size : int
+        Terms with fewer or more genes in the ranked list are not scored
+    seed : int
+        Seed of the permutations
+
+    Returns
+    -------
+    pandas.DataFrame
+        Enrichment output with '_sample' column giving the position of the
+        sample in ranked_lists
+    """
+    gene_index = library.gene_index
+    matrix = library.matrix
+    frames = []
+    for n, ranked in enumerate(ranked_lists):
+        ranked = ranked[~ranked.index.duplicated()].dropna()
+        ranked = ranked.sort_values(ascending=False)
+        names = np.asarray(ranked.index, dtype=object)
+        n_genes = len(names)
+        weights = np.abs(ranked.values.astype(np.float64)) ** weight
+
+        # library columns to positions in the ranked list, -1 if absent
+        column_position = np.full(library.n_genes, -1, dtype=np.int64)
+        in_lib = np.array([gene_index.get(g, -1) for g in names],
+                          dtype=np.int64)
+        found = in_lib >= 0
+        column_position[in_lib[found]] = np.flatnonzero(found)
+
+        positions = column_position[matrix.indices]
+        present = positions >= 0
+        rows = np.repeat(np.arange(library.n_terms), np.diff(matrix.indptr))
+        hits = sparse.csr_matrix(
+            (np.ones(present.sum(), dtype=np.int8),
+             (rows[present], positions[present])),
+            shape=(library.n_terms, max(n_genes, 1))
+        )
+        hits.sort_indices()
+        sizes = np.diff(hits.indptr)
+        terms = np.flatnonzero((sizes >= max(min_size, 1)) &
+                               (sizes <= max_size) & (sizes < n_genes))
+        if not len(terms):
+            continue
+        hits = hits[terms]
+        hits.sort_indices()
+        indptr = hits.indptr.astype(np.int64)
+        indices = hits.indices.astype(np.int64)
+        es, peaks = _observed(indptr, indices, weights, n_genes)
+
+        term_sizes = sizes[terms]
+        unique_sizes, size_of_term = np.unique(term_sizes,
+                                               return_inverse=True)
+        null = _null_scores(unique_sizes.astype(np.int64), weights, n_genes,
+                            n_perm, seed + n)
+        nes = np.zeros(len(terms))
+        p_values = np.ones(len(terms))
+        for s in range(len(unique_sizes)):
+            same = size_of_term == s
+            nes[same], p_values[same] = _normalize(es[same], null[s])
+
+        leading = np.empty(len(terms), dtype=object)
+        for i in range(len(terms)):
+            hit_positions = indices[indptr[i]:indptr[i + 1]]
+            if es[i] >= 0:
+                hit_positions = hit_positions[:peaks[i] + 1]
+            else:
+                hit_positions = hit_positions[peaks[i]:]
+            leading[i] = ','.join(names[hit_positions])
+        frames.append(pd.DataFrame({
+            'term_name': library.terms[terms].astype(object),
+            'p_value': p_values,
+            'z_score': nes,
+            'combined_score': -np.log(p_values) * nes,
+            'genes': leading,
+            'n_genes': [len(i.split(',')) for i in leading],
+            'es': es,
+            'nes': nes,
+            'set_size': term_sizes,
+            '_sample': n,
+        }))
+    if not frames:
+        return pd.DataFrame(columns=_gsea_columns + ['_sample'])
+    df = pd.concat(frames, ignore_index=True)
+    df['db'] = library.name
+
+    order = np.lexsort((-np.abs(df['nes'].values), df['p_value'].values,
+                        df['_sample'].values))
+    df = df.iloc[order].reset_index(drop=True)
+    sample = df['_sample'].values
+    df['rank'] = _rank_within(sample)
+    df['adj_p_value'] = _bh_adjust(df['p_value'].values, sample,
+                                   df['rank'].values)
+    return df[_gsea_columns + ['_sample']]
@@ -0,0 +1,479 @@
+"""
+Enrichment analysis against gene set libraries stored on disk.
+
+Each library is a sparse term x gene incidence matrix saved as numpy arrays,
+which are memory-mapped when loaded. Overlaps of all samples with all terms
+come from a single sparse matrix product, so no network access is needed
+after a library has been downloaded once.
+"""
+import functools
+import json
+import os
+
+import numpy as np
+import pandas as pd
+import scipy.sparse as sparse
+from scipy.stats import hypergeom
+
+from magine.data.storage import gene_set_lib_dir
+from magine.enrichment.enrichment_result import EnrichmentResult
+from magine.enrichment.enrichr import _prepare_output, get_background_list
+from magine.logging import get_logger
+
+logger = get_logger(__name__)
+
+_columns = ['term_name', 'rank', 'p_value', 'z_score', 'combined_score',
+            'adj_p_value', 'genes', 'n_genes', 'db']
+
+
+class GeneSetLibrary(object):
+    """ Term x gene incidence matrix of a gene set library
+
+    Parameters
+    ----------
+    name : str
+        Name of library, generally the enrichR library name
+    terms : array_like
+        Term names, one per row of matrix
+    genes : array_like
+        Sorted gene names, one per column of matrix
+    matrix : scipy.sparse.csr_matrix
+        matrix[i, j] is 1 if genes[j] belongs to terms[i]
+    """
+
+    def __init__(self, name, terms, genes, matrix):
+        self.name = name
+        self.terms = np.asanyarray(terms)
+        self.genes = np.asanyarray(genes)
+        self.matrix = sparse.csr_matrix(matrix)
+        self.matrix.sort_indices()
+        self._gene_index = None
+
+    @property
+    def n_terms(self):
+        return self.matrix.shape[0]
+
+    @property
+    def n_genes(self):
+        return self.matrix.shape[1]
+
+    @property
+    def gene_index(self):
+        """ dict of gene name to column """
+        if self._gene_index is None:
+            self._gene_index = {g: i for i, g in enumerate(self.genes)}
+        return self._gene_index
+
+    @classmethod
+    def from_dict(cls, name, term_to_genes):
+        """ Create library from a dict of term to genes
+
+        Parameters
+        ----------
+        name : str
+        term_to_genes : dict
+
+        Returns
+        -------
+        GeneSetLibrary
+        """
+        terms = list(term_to_genes)
+        genes = sorted(set().union(*[set(i) for i in term_to_genes.values()]))
+        gene_index = {g: i for i, g in enumerate(genes)}
+        rows, cols = [], []
+        for row, term in enumerate(terms):
+            term_genes = set(term_to_genes[term])
+            rows.extend([row] * len(term_genes))
+            cols.extend(gene_index[g] for g in term_genes)
+        matrix = sparse.csr_matrix(
+            (np.ones(len(rows), dtype=np.int8), (rows, cols)),
+            shape=(len(terms), len(genes))
+        )
+        return cls(name, terms, genes, matrix)
+
+    @classmethod
+    def from_enrichr(cls, name):
+        """ Download library from enrichR
+
+        Parameters
+        ----------
+        name : str
+
+        Returns
+        -------
+        GeneSetLibrary
+        """
+        term_to_gene = get_background_list(name)
+        return cls.from_dict(
+            name, dict((i['term'], i['gene_list']) for i in term_to_gene)
+        )
+
+    def save(self, directory=None):
+        """ Save library as numpy arrays so it can be memory-mapped
+
+        Parameters
+        ----------
+        directory : str, optional
+            Defaults to MAGINE data directory
+        """
+        out_dir = _lib_path(self.name, directory)
+        if not os.path.exists(out_dir):
+            os.makedirs(out_dir)
+        np.save(os.path.join(out_dir, 'indptr.npy'),
+                self.matrix.indptr.astype(np.int32))
+        np.save(os.path.join(out_dir, 'indices.npy'),
+                self.matrix.indices.astype(np.int32))
+        np.save(os.path.join(out_dir, 'terms.npy'), self.terms.astype(str))
+        np.save(os.path.join(out_dir, 'genes.npy'), self.genes.astype(str))
+        with open(os.path.join(out_dir, 'shape.json'), 'w') as f:
+            json.dump(list(self.matrix.shape), f)
+
+    @classmethod
+    def load(cls, name, directory=None, mmap_mode='r'):
+        """ Load library saved with :meth:`save`
+
+        Parameters
+        ----------
+        name : str
+        directory : str, optional
+            Defaults to MAGINE data directory
+        mmap_mode : str, optional
+            Passed to numpy.load. Use None to read into memory.
+
+        Returns
+        -------
+        GeneSetLibrary
+        """
+        in_dir = _lib_path(name, directory)
+        if not os.path.exists(os.path.join(in_dir, 'shape.json')):
+            raise IOError("{} not found in {}".format(name, in_dir))
+
+        def _load(f_name):
+            return np.load(os.path.join(in_dir, f_name), mmap_mode=mmap_mode)
+
+        with open(os.path.join(in_dir, 'shape.json'), 'r') as f:
+            shape = tuple(json.load(f))
+        indices = _load('indices.npy')
+        matrix = sparse.csr_matrix(
+            (np.ones(indices.shape[0], dtype=np.int8), indices,
+             _load('indptr.npy')), shape=shape, copy=False
+        )
+        return cls(name, _load('terms.npy'), _load('genes.npy'), matrix)
+
+    @classmethod
+    def exists(cls, name, directory=None):
+        return os.path.exists(
+            os.path.join(_lib_path(name, directory), 'shape.json')
+        )
+
+
+def _lib_path(name, directory=None):
+    if directory is None:
+        directory = gene_set_lib_dir
+    return os.path.join(directory, name)
+
+
+class LocalEnrichr(object):
+    """ Enrichment analysis without contacting enrichR
+
+    Scores are calculated like enrichR; p-values are from the one-sided
+    Fisher exact (hypergeometric) test and are adjusted with
+    Benjamini-Hochberg within each sample and library. enrichR derives its
+    z-score from permutations that are not public. Here the z-score is the
+    standardized overlap under the hypergeometric null, signed like enrichR
+    so that combined_score = ln(p_value) * z_score is positive for enriched
+    terms.
+
+    Parameters
+    ----------
+    background : list_like, optional
+        Genes that could have been measured, such as all species in the
+        experimental data. Defaults to all genes of each library.
+    library_dir : str, optional
+        Location of saved libraries, defaults to MAGINE data directory
+    download : bool
+        Download and save libraries that are not stored locally
+
+    Examples
+    --------
+    >>> from magine.enrichment.local_enrichment import LocalEnrichr
+    >>> e = LocalEnrichr(background=exp_data.genes.id_list)  # doctest: +SKIP
+    >>> df = e.run_samples(exp_data.genes.sig.up_by_sample,  # doctest: +SKIP
+    ...                    exp_data.genes.sample_ids, 'KEGG_2016')
+    """
+
+    def __init__(self, background=None, library_dir=None, download=True):
+        self.background = background
+        self.library_dir = library_dir
+        self.download = download
+        self._libraries = dict()
+
+    def add_library(self, library):
+        """ Use a library that is not stored on disk
+
+        Parameters
+        ----------
+        library : GeneSetLibrary
+        """
+        self._libraries[library.name] = library
+
+    def get_library(self, name):
+        """ Library of given name, downloading it if needed
+
+        Parameters
+        ----------
+        name : str
+
+        Returns
+        -------
+        GeneSetLibrary
+        """
+        if name not in self._libraries:
+            if GeneSetLibrary.exists(name, self.library_dir):
+                lib = GeneSetLibrary.load(name, self.library_dir)
+            elif self.download:
+                logger.info("Downloading {} from enrichR".format(name))
+                lib = GeneSetLibrary.from_enrichr(name)
+                lib.save(self.library_dir)
+            else:
+                raise IOError("{} is not stored locally".format(name))
+            self._libraries[name] = lib
+        return self._libraries[name]
+
+    def run(self, list_of_genes, gene_set_lib='GO_Biological_Process_2017'):
+        """ Enrichment of a single list of genes
+
+        Parameters
+        ----------
+        list_of_genes : list_like
+            List of genes using HGNC gene names
+        gene_set_lib : str or list
+            Name of gene set library
+
+        Returns
+        -------
+        EnrichmentResult
+        """
+        if not isinstance(list_of_genes, (list, set)):
+            raise AssertionError("list_of_genes must be list like")
+        df = self._run(list_of_genes=[list_of_genes], sample_ids=None,
+                       gene_set_lib=gene_set_lib)
+        return df
+
+    def run_samples(self, sample_lists, sample_ids,
+                    gene_set_lib='GO_Biological_Process_2017'):
+        """ Enrichment of many gene lists using one matrix product per library
+
+        Parameters
+        ----------
+        sample_lists : list_like
+            List of lists of genes for enrichment analysis
+        sample_ids : list
+            list of ids for the provided sample list
+        gene_set_lib : str, list
+            Name of gene set library
+
+        Returns
+        -------
+        EnrichmentResult
+        """
+        if not isinstance(sample_lists, list):
+            raise AssertionError("List required")
+        if not isinstance(sample_lists[0], (list, set)):
+            raise AssertionError("List of lists required")
+        df = self._run(sample_lists, sample_ids, gene_set_lib)
+        # removes terms that do not have at least 1 signficant term across any
+        # of the samples list provided
+        if df.shape[0]:
+            df.require_n_sig(n_sig=1, inplace=True)
+        return df
+
+    def run_prerank(self, ranked_lists, sample_ids,
+                    gene_set_lib='GO_Biological_Process_2017', n_perm=1000,
+                    weight=1., min_size=15, max_size=500, seed=0):
+        """ Preranked GSEA of ranked species of many samples
+
+        Requires numba. Null distributions come from n_perm gene label
+        permutations of each sample. p-values are adjusted with
+        Benjamini-Hochberg within each sample and library. z_score is the
+        normalized enrichment score (NES) and combined_score is
+        -ln(p_value) * NES, so terms enriched in down regulated species
+        have negative scores. genes holds the leading edge of each term.
+
+        Parameters
+        ----------
+        ranked_lists : list of pandas.Series
+            Signed statistic of each species indexed by gene name, such as
+            Sample.ranked_by_sample
+        sample_ids : list
+            list of ids for the provided ranked lists
+        gene_set_lib : str, list
+            Name of gene set library
+        n_perm : int
+        weight : float
+            Exponent of the statistic used to weight hits
+        min_size, max_size : int
+            Range of the number of genes of a term in the ranked list
+        seed : int
+
+        Returns
+        -------
+        EnrichmentResult
+
+        Examples
+        --------
+        >>> e = LocalEnrichr()  # doctest: +SKIP
+        >>> ranked = exp_data.genes.ranked_by_sample()  # doctest: +SKIP
+        >>> ids = exp_data.genes.sample_ids  # doctest: +SKIP
+        >>> df = e.run_prerank(ranked, ids, 'KEGG_2016')  # doctest: +SKIP
+        """
+        from magine.enrichment.gsea import score_library_prerank
+        if len(ranked_lists) != len(sample_ids):
+            raise AssertionError("One sample_id required per ranked list")
+        scorer = functools.partial(
+            score_library_prerank, n_perm=n_perm, weight=weight,
+            min_size=min_size, max_size=max_size, seed=seed
+        )
+        return self._run(ranked_lists, sample_ids, gene_set_lib, scorer)
+
+    def _run(self, list_of_genes, sample_ids, gene_set_lib, scorer=None):
+        if isinstance(gene_set_lib, str):
+            gene_set_lib = [gene_set_lib]
+        if scorer is None:
+            scorer = functools.partial(score_library,
+                                       background=self.background)
+        frames = [scorer(self.get_library(lib), list_of_genes)
+                  for lib in gene_set_lib]
+        df = pd.concat(frames, ignore_index=True)
+        if sample_ids is not None:
+            # empty frames give an object column, which can't index
+            df['sample_id'] = np.asarray(sample_ids, dtype=object)[
+                df.pop('_sample').values.astype(np.int64)]
+        else:
+            del df['_sample']
+        df = EnrichmentResult(df)
+        if df.shape[0]:
+            df = _prepare_output(df)
+        df['significant'] = df['adj_p_value'] <= 0.05
+        return df
+
+
+def score_library(library, sample_lists, background=None):
+    """ Score sample gene lists against all terms of a library
+
+    Parameters
+    ----------
+    library : GeneSetLibrary
+    sample_lists : list
+        List of lists of genes
+    background : list_like, optional
+        Genes to use as background, defaults to all genes in the library
+
+    Returns
+    -------
+    pandas.DataFrame
+        Enrichment output with '_sample' column giving the position of the
+        sample in sample_lists
+    """
+    matrix = library.matrix
+    gene_index = library.gene_index
+    n_total = library.n_genes
+    if background is not None:
+        keep = np.zeros(library.n_genes, dtype=bool)
+        keep[[gene_index[g] for g in set(background) if g in gene_index]] = 1
+        # drop genes not in background from every term
+        matrix = matrix.multiply(keep[np.newaxis, :]).tocsr()
+        matrix.eliminate_zeros()
+        matrix.sort_indices()
+        n_total = len(set(background))
+    else:
+        keep = np.ones(library.n_genes, dtype=bool)
+
+    # samples x genes query matrix, genes outside the library are ignored
+    rows, cols = [], []
+    for n, genes in enumerate(sample_lists):
+        idx = [gene_index[g] for g in set(genes) if g in gene_index]
+        idx = [i for i in idx if keep[i]]
+        rows.extend([n] * len(idx))
+        cols.extend(idx)
+    query = sparse.csr_matrix(
+        (np.ones(len(rows), dtype=np.int32), (rows, cols)),
+        shape=(len(sample_lists), library.n_genes)
+    )
+    query.sort_indices()
+    if background is not None:
+        # genes in background but not library still count towards list size
+        list_sizes = np.array([len(set(genes).intersection(background))
+                               for genes in sample_lists])
+    else:
+        list_sizes = np.asarray(query.sum(axis=1)).ravel()
+
+    overlap = (query @ matrix.T.astype(np.int32)).tocoo()
+    sample, term, k = overlap.row, overlap.col, overlap.data
+    if not len(k):
+        df = pd.DataFrame(columns=_columns + ['_sample'])
+        return df
+    term_sizes = np.diff(matrix.indptr)[term]
+    n = list_sizes[sample]
+
+    p_values = hypergeom.sf(k - 1, n_total, term_sizes, n)
+    expected = n * term_sizes / float(n_total)
+    variance = expected * (n_total - term_sizes) / float(n_total) * \
+        (n_total - n) / max(n_total - 1., 1.)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        z_scores = np.where(variance > 0,
+                            -(k - expected) / np.sqrt(variance), 0.)
+    combined = np.log(np.maximum(p_values, np.finfo(float).tiny)) * z_scores
+
+    order = np.lexsort((p_values, sample))
+    sample, term, k = sample[order], term[order], k[order]
+    p_values, z_scores = p_values[order], z_scores[order]
+    combined = combined[order]
+    rank = _rank_within(sample)
+    adj_p_values = _bh_adjust(p_values, sample, rank)
+
+    genes = np.empty(len(k), dtype=object)
+    starts = np.r_[0, np.flatnonzero(np.diff(sample)) + 1, len(sample)]
+    for start, end in zip(starts[:-1], starts[1:]):
+        q_cols = query.indices[query.indptr[sample[start]]:
+                               query.indptr[sample[start] + 1]]
+        hits = matrix[term[start:end]][:, q_cols]
+        hits.sort_indices()
+        names = library.genes[q_cols][hits.indices]
+        genes[start:end] = [','.join(i) for i in
+                            np.split(names, hits.indptr[1:-1])]
+
+    return pd.DataFrame({
+        'term_name': library.terms[term].astype(object),
+        'rank': rank,
+        'p_value': p_values,
+        'z_score': z_scores,
+        'combined_score': combined,
+        'adj_p_value': adj_p_values,
+        'genes': genes,
+        'n_genes': k.astype(np.int64),
+        'db': library.name,
+        '_sample': sample,
+    }, columns=_columns + ['_sample'])
+
+
+def _rank_within(groups):
+    """ 1 based position of each element within runs of sorted groups """
+    starts = np.r_[0, np.flatnonzero(np.diff(groups)) + 1]
+    counts = np.diff(np.r_[starts, len(groups)])
+    return np.arange(len(groups)) - np.repeat(starts, counts) + 1
+
+
+def _bh_adjust(p_values, groups, rank):
+    """ Benjamini-Hochberg adjustment within groups
+
+    p_values must be sorted ascending within each group and rank is the
+    position of each p-value in its group.
+    """
+    starts = np.r_[0, np.flatnonzero(np.diff(groups)) + 1]
+    counts = np.diff(np.r_[starts, len(groups)])
+    adjusted = p_values * np.repeat(counts, counts) / rank
+    # enforce monotonicity from the largest p-value down
+    adjusted = pd.Series(adjusted[::-1]).groupby(
+        groups[::-1]).cummin().values[::-1]
+    return np.minimum(adjusted, 1.)
@@ -0,0 +1,161 @@
+import json
+import os
+import tempfile
+import threading
+import time
+from collections import OrderedDict
+
+from magine.logging import get_logger
+
+logger = get_logger(__name__)
+
+running = 'running'
+done = 'done'
+failed = 'failed'
+
+
+class RunManifest(object):
+    """ Status and timings of every unit of an enrichment run
+
+    A unit is a (category, sample_id, gene_set_lib) triple. The manifest is
+    saved as json after every update, so a run that is interrupted can skip
+    the units that finished and retry the others.
+
+    Parameters
+    ----------
+    file_name : str
+        json file, loaded if it exists
+
+    Examples
+    --------
+    >>> import os, tempfile
+    >>> m = RunManifest(os.path.join(tempfile.mkdtemp(), 'manifest.json'))
+    >>> m.start([('rna_up', '1hr', 'KEGG_2016')])
+    >>> m.finish('rna_up', '1hr', 'KEGG_2016', n_rows=10)
+    >>> m.is_done('rna_up', '1hr', 'KEGG_2016')
+    True
+    """
+
+    def __init__(self, file_name):
+        self.file_name = file_name
+        self.units = OrderedDict()
+        self.summary = dict()
+        self._lock = threading.RLock()
+        if os.path.exists(file_name):
+            with open(file_name, 'r') as f:
+                data = json.load(f)
+            for unit in data['units']:
+                self.units[self.key(unit['category'], unit['sample_id'],
+                                    unit['gene_set_lib'])] = unit
+            self.summary = data.get('summary', dict())
+
+    @staticmethod
+    def key(category, sample_id, gene_set_lib):
+        # sample_ids are stored as str in json
+        return category, str(sample_id), gene_set_lib
+
+    def get(self, category, sample_id, gene_set_lib):
+        """ Record of a unit, None if it was never started """
+        return self.units.get(self.key(category, sample_id, gene_set_lib))
+
+    def is_done(self, category, sample_id, gene_set_lib, root=None):
+        """ If a unit finished and its output, if any, still exists
+
+        Parameters
+        ----------
+        category : str
+        sample_id : str
+        gene_set_lib : str
+        root : str, optional
+            Directory that output paths are relative to
+
+        Returns
+        -------
+        bool
+        """
+        unit = self.get(category, sample_id, gene_set_lib)
+        if unit is None or unit['status'] != done:
+            return False
+        if unit['path'] is None:
+            return True
+        path = unit['path']
+        if root is not None:
+            path = os.path.join(root, path)
+        return os.path.exists(path)
+
+    def start(self, units):
+        """ Mark units as running
+
+        Parameters
+        ----------
+        units : list of tuple
+            (category, sample_id, gene_set_lib) of each unit
+        """
+        now = time.time()
+        with self._lock:
+            for category, sample_id, gene_set_lib in units:
+                self.units[self.key(category, sample_id, gene_set_lib)] = dict(
+                    category=category, sample_id=str(sample_id),
+                    gene_set_lib=gene_set_lib, status=running, started=now,
+                    finished=None, seconds=None, n_rows=None, path=None,
+                    error=None,
+                )
+            self.save()
+
+    def _end(self, category, sample_id, gene_set_lib, **kwargs):
+        with self._lock:
+            unit = self.units[self.key(category, sample_id, gene_set_lib)]
+            unit.update(kwargs)
+            unit['finished'] = time.time()
+            unit['seconds'] = unit['finished'] - unit['started']
+
+    def finish(self, category, sample_id, gene_set_lib, n_rows, path=None,
+               save=True):
+        """ Mark a unit as done
+
+        Parameters
+        ----------
+        category : str
+        sample_id : str
+        gene_set_lib : str
+        n_rows : int
+            Number of terms returned
+        path : str, optional
+            Location of the output, None if there were no terms
+        save : bool
+            Save the manifest now, set to False when updating many units
+        """
+        self._end(category, sample_id, gene_set_lib, status=done,
+                  n_rows=n_rows, path=path, error=None)
+        if save:
+            self.save()
+
+    def fail(self, category, sample_id, gene_set_lib, error, save=True):
+        """ Mark a unit as failed, it is retried when the run is resumed """
+        self._end(category, sample_id, gene_set_lib, status=failed,
+                  error=str(error))
+        if save:
+            self.save()
+
+    def counts(self):
+        """ Number of units of each status
+
+        Returns
+        -------
+        dict
+        """
+        with self._lock:
+            counts = dict()
+            for unit in self.units.values():
+                counts[unit['status']] = counts.get(unit['status'], 0) + 1
+            return counts
+
+    def save(self):
+        """ Atomically write the manifest to file_name """
+        with self._lock:
+            directory = os.path.dirname(os.path.abspath(self.file_name))
+            fd, tmp_path = tempfile.mkstemp(dir=directory, suffix='.tmp')
+            with os.fdopen(fd, 'w') as f:
+                json.dump(dict(units=list(self.units.values()),
+                               summary=self.summary), f, indent=1)
+            os.replace(tmp_path, self.file_name)
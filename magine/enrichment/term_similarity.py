@@ -0,0 +1,475 @@
+"""
+Similarity of gene sets stored as rows of a sparse gene matrix.
+
+Scores follow :func:`magine.enrichment.enrichment_result.jaccard_index`
+with remove_subset=True; a set that is a subset of the other scores 1.
+"""
+import json
+
+import numpy as np
+import pandas as pd
+import scipy.sparse as sparse
+
+_prime = (1 << 31) - 1
+
+
+def _as_counts(matrix):
+    # int32 so that intersections of large gene sets do not overflow
+    return sparse.csr_matrix(matrix, dtype=np.int32)
+
+
+def set_sizes(matrix):
+    """ Number of genes in each row of a binary csr matrix """
+    return np.diff(matrix.indptr)
+
+
+def jaccard_block(matrix, rows, cols, sizes=None):
+    """ Jaccard index of gene sets in rows against gene sets in cols
+
+    Parameters
+    ----------
+    matrix : scipy.sparse.csr_matrix
+        Binary sets x genes matrix, int32
+    rows : array_like
+    cols : array_like
+    sizes : np.ndarray, optional
+        Precomputed set_sizes(matrix)
+
+    Returns
+    -------
+    np.ndarray
+        len(rows) x len(cols)
+    """
+    if sizes is None:
+        sizes = set_sizes(matrix)
+    inter = (matrix[rows] @ matrix[cols].T).toarray()
+    size_r = sizes[rows][:, np.newaxis]
+    size_c = sizes[cols][np.newaxis, :]
+    union = size_r + size_c - inter
+    with np.errstate(divide='ignore', invalid='ignore'):
+        scores = inter / union.astype(float)
+    scores[inter == np.minimum(size_r, size_c)] = 1.
+    return scores
+
+
+def jaccard_pairs(matrix, rows, cols, sizes=None):
+    """ Jaccard index of the gene sets rows[k] and cols[k] for each k
+
+    Parameters
+    ----------
+    matrix : scipy.sparse.csr_matrix
+        Binary sets x genes matrix, int32
+    rows : np.ndarray
+    cols : np.ndarray
+    sizes : np.ndarray, optional
+        Precomputed set_sizes(matrix)
+
+    Returns
+    -------
+    np.ndarray
+    """
+    if sizes is None:
+        sizes = set_sizes(matrix)
+    if not len(rows):
+        return np.zeros(0)
+    inter = np.asarray(
+        matrix[rows].multiply(matrix[cols]).sum(axis=1)
+    ).ravel()
+    size_r = sizes[rows]
+    size_c = sizes[cols]
+    with np.errstate(divide='ignore', invalid='ignore'):
+        scores = inter / (size_r + size_c - inter).astype(float)
+    scores[inter == np.minimum(size_r, size_c)] = 1.
+    return scores
+
+
+def similarity_matrix(matrix, remove_subset=True, dtype=np.float64,
+                      threshold=None):
+    """ Jaccard index of every pair of gene sets
+
+    Parameters
+    ----------
+    matrix : scipy.sparse.csr_matrix
+        Binary sets x genes matrix
+    remove_subset : bool
+        If a set is a subset of the other, score 1.
+    dtype : np.dtype
+        np.float32 halves the memory of the output
+    threshold : float, optional
+        Return a scipy.sparse.csr_matrix that only stores scores at or above
+        threshold. Only pairs that share a gene are scored, so this scales to
+        many thousands of sets. Scores of sets without genes are dropped.
+
+    Returns
+    -------
+    np.ndarray or scipy.sparse.csr_matrix
+        sets x sets
+    """
+    matrix = _as_counts(matrix)
+    sizes = set_sizes(matrix)
+    inter = matrix @ matrix.T
+    if threshold is None:
+        inter = inter.toarray()
+        size_r = sizes[:, np.newaxis]
+        size_c = sizes[np.newaxis, :]
+        union = size_r + size_c - inter
+        with np.errstate(divide='ignore', invalid='ignore'):
+            scores = (inter / union.astype(float)).astype(dtype)
+        if remove_subset:
+            scores[inter == np.minimum(size_r, size_c)] = 1.
+        else:
+            scores[union == 0] = 1.
+        return scores
+
+    inter = inter.tocoo()
+    size_r = sizes[inter.row]
+    size_c = sizes[inter.col]
+    scores = inter.data / (size_r + size_c - inter.data).astype(float)
+    if remove_subset:
+        scores[inter.data == np.minimum(size_r, size_c)] = 1.
+    keep = scores >= threshold
+    return sparse.csr_matrix(
+        (scores[keep].astype(dtype), (inter.row[keep], inter.col[keep])),
+        shape=inter.shape
+    )
+
+
+def similarity_to(codes, matrix, remove_subset=True):
+    """ Jaccard index of one gene set against every row of matrix
+
+    Parameters
+    ----------
+    codes : array_like
+        Unique gene codes of the gene set
+    matrix : scipy.sparse.csr_matrix
+        Binary sets x genes matrix
+    remove_subset : bool
+        If a set is a subset of the other, score 1.
+
+    Returns
+    -------
+    np.ndarray
+    """
+    matrix = _as_counts(matrix)
+    sizes = set_sizes(matrix)
+    size = len(codes)
+    inter = np.asarray(matrix[:, codes].sum(axis=1)).ravel()
+    union = size + sizes - inter
+    with np.errstate(divide='ignore', invalid='ignore'):
+        scores = inter / union.astype(float)
+    if remove_subset:
+        scores[inter == np.minimum(size, sizes)] = 1.
+    return scores
+
+
+def greedy_unique(matrix, names, threshold=0.75, verbose=False,
+                  method='exact', block_size=256, num_perm=128, seed=0,
+                  scores=None):
+    """ Greedy removal of similar gene sets
+
+    Sets are visited in order. A set that has not been removed is kept and
+    every later set with a similarity above threshold is removed. Removal is
+    by name, so all sets sharing a removed name are skipped.
+
+    Parameters
+    ----------
+    matrix : scipy.sparse.csr_matrix
+        Binary sets x genes matrix
+    names : array_like
+        Name of each set
+    threshold : float
+    verbose : bool
+    method : {'exact', 'minhash'}
+        'exact' compares each kept set to every remaining set, 'minhash' only
+        compares sets sharing a locality sensitive hashing bucket. 'minhash'
+        estimates the jaccard index, so sets that are only similar because
+        one is a small subset of the other can be missed.
+    block_size : int
+        Number of sets compared with one matrix product
+    num_perm : int
+        Number of hash functions in 'minhash' mode
+    seed : int
+        Random seed of the hash functions
+    scores : scipy.sparse.csr_matrix, optional
+        Precomputed sets x sets scores, such as a subgraph of a
+        TermSimilarityGraph with a floor at or below threshold. matrix and
+        method are ignored.
+
+    Returns
+    -------
+    set
+        Names that are kept
+    """
+    names = np.asarray(names, dtype=object)
+    name_codes, uniques = pd.factorize(names)
+    removed = np.zeros(len(uniques) + 1, dtype=bool)
+    to_keep = set()
+    if scores is not None:
+        candidates = _graph_candidates(sparse.csr_matrix(scores), name_codes,
+                                       removed)
+    elif method == 'exact':
+        matrix = _as_counts(matrix)
+        candidates = _exact_candidates(matrix, name_codes, removed,
+                                       block_size)
+    elif method == 'minhash':
+        matrix = _as_counts(matrix)
+        candidates = _minhash_candidates(matrix, name_codes, removed,
+                                         threshold, num_perm, seed,
+                                         block_size)
+    else:
+        raise ValueError("method must be 'exact' or 'minhash'")
+
+    for i, cols, row_scores in candidates:
+        term_1 = names[i]
+        to_keep.add(term_1)
+        if verbose:
+            print("Finding matches for {}".format(term_1))
+        alive = ~removed[name_codes[cols]]
+        cols, row_scores = cols[alive], row_scores[alive]
+        if verbose:
+            for j, score in zip(cols, row_scores):
+                print("\tScore for {} is {:.3f}".format(names[j], score))
+                if score > threshold:
+                    print("\t\tRemoving {}".format(names[j]))
+        removed[name_codes[cols[row_scores > threshold]]] = True
+    return to_keep
+
+
+def _exact_candidates(matrix, name_codes, removed, block_size):
+    """ Yields each kept set with its scores against all later sets """
+    n = matrix.shape[0]
+    sizes = set_sizes(matrix)
+    for start in range(0, n, block_size):
+        block = np.arange(start, min(start + block_size, n))
+        block = block[~removed[name_codes[block]]]
+        if not len(block):
+            continue
+        cols = np.arange(block[0] + 1, n)
+        cols = cols[~removed[name_codes[cols]]]
+        scores = jaccard_block(matrix, block, cols, sizes)
+        for row, i in enumerate(block):
+            # sets removed by an earlier set of this block are skipped
+            if removed[name_codes[i]]:
+                continue
+            later = cols > i
+            yield i, cols[later], scores[row, later]
+
+
+def _graph_candidates(scores, name_codes, removed):
+    """ Yields each kept set with its stored scores against later sets """
+    for i in range(scores.shape[0]):
+        if removed[name_codes[i]]:
+            continue
+        start, end = scores.indptr[i], scores.indptr[i + 1]
+        cols = scores.indices[start:end]
+        later = cols > i
+        yield i, cols[later], scores.data[start:end][later]
+
+
+def _minhash_candidates(matrix, name_codes, removed, threshold, num_perm,
+                        seed, block_size):
+    """ Yields each kept set with scores against later sets in its buckets """
+    n = matrix.shape[0]
+    sizes = set_sizes(matrix)
+    signatures = minhash_signatures(matrix, num_perm, seed)
+    bands, rows_per_band = lsh_parameters(threshold, num_perm)
+    # sets x (band, bucket) membership, sets sharing a bucket are candidates
+    buckets = np.empty((n, bands), dtype=np.int64)
+    for band in range(bands):
+        part = signatures[:, band * rows_per_band:(band + 1) * rows_per_band]
+        _, inverse = np.unique(part, axis=0, return_inverse=True)
+        buckets[:, band] = inverse.ravel() + band * n
+    membership = sparse.csr_matrix(
+        (np.ones(n * bands, dtype=np.int32), buckets.ravel(),
+         np.arange(0, n * bands + 1, bands)),
+        shape=(n, n * bands)
+    )
+    for start in range(0, n, block_size):
+        block = np.arange(start, min(start + block_size, n))
+        block = block[~removed[name_codes[block]]]
+        if not len(block):
+            continue
+        shared = (membership[block] @ membership.T).tocoo()
+        rows, cols = block[shared.row], shared.col
+        keep = (cols > rows) & ~removed[name_codes[cols]]
+        rows, cols = rows[keep], cols[keep]
+        order = np.lexsort((cols, rows))
+        rows, cols = rows[order], cols[order]
+        scores = jaccard_pairs(matrix, rows, cols, sizes)
+        bounds = np.searchsorted(rows, block, side='left')
+        ends = np.searchsorted(rows, block, side='right')
+        for i, lo, hi in zip(block, bounds, ends):
+            # sets removed by an earlier set of this block are skipped
+            if removed[name_codes[i]]:
+                continue
+            yield i, cols[lo:hi], scores[lo:hi]
+
+
+def minhash_signatures(matrix, num_perm=128, seed=0):
+    """ MinHash signature of each row of a binary csr matrix
+
+    Parameters
+    ----------
+    matrix : scipy.sparse.csr_matrix
+    num_perm : int
+    seed : int
+
+    Returns
+    -------
+    np.ndarray
+        rows x num_perm, empty rows have every value set to the hash prime
+    """
+    rng = np.random.RandomState(seed)
+    a = rng.randint(1, _prime, num_perm).astype(np.int64)
+    b = rng.randint(0, _prime, num_perm).astype(np.int64)
+    codes = matrix.indices.astype(np.int64)[:, np.newaxis]
+    signatures = np.full((matrix.shape[0], num_perm), _prime, dtype=np.int64)
+    non_empty = set_sizes(matrix) > 0
+    starts = matrix.indptr[:-1][non_empty]
+    if not len(starts):
+        return signatures
+    # hash in chunks to bound memory to nnz x 16 values
+    for chunk in range(0, num_perm, 16):
+        cols = slice(chunk, min(chunk + 16, num_perm))
+        hashed = (codes * a[cols] + b[cols]) % _prime
+        signatures[non_empty, cols] = np.minimum.reduceat(hashed, starts,
+                                                          axis=0)
+    return signatures
+
+
+def lsh_parameters(threshold, num_perm):
+    """ Number of bands and rows per band for a jaccard threshold
+
+    Sets with a jaccard index of (1 / bands) ** (1 / rows) have a 50% chance
+    of sharing a bucket. The largest such threshold at or below the requested
+    one is used, favouring recall over speed.
+    """
+    options = []
+    for rows in range(1, num_perm + 1):
+        bands = num_perm // rows
+        approx = (1. / bands) ** (1. / rows)
+        options.append((approx <= threshold, approx, bands, rows))
+    below = [i for i in options if i[0]]
+    if below:
+        _, _, bands, rows = max(below, key=lambda i: i[1])
+    else:
+        _, _, bands, rows = min(options, key=lambda i: i[1])
+    return bands, rows
+
+
+class TermSimilarityGraph(object):
+    """ Sparse graph of gene set pairs with a similarity at or above a floor
+
+    Once built, any threshold at or above the floor can be answered without
+    comparing gene sets again.
+
+    Parameters
+    ----------
+    keys : list
+        Label of each gene set, term names or (term_name, sample_id) pairs
+    scores : scipy.sparse.csr_matrix
+        Symmetric keys x keys jaccard index, only stored at or above floor
+    floor : float
+    digest : str, optional
+        Fingerprint of the data the graph was built from
+    """
+
+    def __init__(self, keys, scores, floor, digest=None):
+        self.keys = list(keys)
+        self.scores = sparse.csr_matrix(scores)
+        self.floor = floor
+        self.digest = digest
+        self.position = {k: i for i, k in enumerate(self.keys)}
+
+    @classmethod
+    def build(cls, matrix, keys, floor, groups=None, digest=None):
+        """ Score gene sets against each other
+
+        Parameters
+        ----------
+        matrix : scipy.sparse.csr_matrix
+            Binary keys x genes matrix
+        keys : list
+        floor : float
+        groups : array_like, optional
+            Only gene sets of the same group are compared
+        digest : str, optional
+
+        Returns
+        -------
+        TermSimilarityGraph
+        """
+        if groups is None:
+            scores = similarity_matrix(matrix, threshold=floor)
+        else:
+            group_codes, _ = pd.factorize(np.asarray(groups, dtype=object))
+            order = np.argsort(group_codes, kind='stable')
+            splits = np.flatnonzero(np.diff(group_codes[order])) + 1
+            rows, cols, data = [], [], []
+            for members in np.split(order, splits):
+                sub = similarity_matrix(matrix[members], threshold=floor)
+                sub = sub.tocoo()
+                rows.append(members[sub.row])
+                cols.append(members[sub.col])
+                data.append(sub.data)
+            n = matrix.shape[0]
+            scores = sparse.csr_matrix(
+                (np.concatenate(data), (np.concatenate(rows),
+                                        np.concatenate(cols))),
+                shape=(n, n)
+            )
+        return cls(keys, scores, floor, digest)
+
+    def covers(self, threshold):
+        """ If every score above threshold is stored """
+        return threshold >= self.floor
+
+    def neighbors(self, key):
+        """ Keys and scores of gene sets at or above the floor, except key """
+        i = self.position[key]
+        start, end = self.scores.indptr[i], self.scores.indptr[i + 1]
+        cols = self.scores.indices[start:end]
+        scores = self.scores.data[start:end]
+        other = cols != i
+        return [self.keys[j] for j in cols[other]], scores[other]
+
+    def subgraph(self, keys):
+        """ Scores between keys, in the order of keys
+
+        Returns
+        -------
+        scipy.sparse.csr_matrix or None
+            None if a key is not part of the graph
+        """
+        try:
+            positions = [self.position[k] for k in keys]
+        except (KeyError, TypeError):
+            return None
+        return self.scores[positions][:, positions]
+
+    def save(self, file_name):
+        """ Save graph to a compressed numpy file """
+        with open(file_name, 'wb') as f:
+            np.savez_compressed(
+                f, data=self.scores.data, indices=self.scores.indices,
+                indptr=self.scores.indptr, floor=self.floor,
+                keys=json.dumps(self.keys, default=_to_python),
+                digest=str(self.digest),
+            )
+
+    @classmethod
+    def load(cls, file_name):
+        """ Load graph saved with save """
+        with np.load(file_name) as f:
+            keys = [tuple(k) if isinstance(k, list) else k
+                    for k in json.loads(str(f['keys']))]
+            n = len(keys)
+            scores = sparse.csr_matrix(
+                (f['data'], f['indices'], f['indptr']), shape=(n, n)
+            )
+            return cls(keys, scores, float(f['floor']), str(f['digest']))
+
+
+def _to_python(value):
+    # numpy scalars, such as integer sample_ids, are not json serializable
+    return value.item()
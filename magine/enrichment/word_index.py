@@ -0,0 +1,193 @@
+"""
+Inverted index of the words in term names.
+
+Term names repeat across samples and databases, so each distinct name is
+tokenized once. Finding the rows containing a word is a lookup in the token
+vocabulary of a TokenIndex, and names x words are stored as sparse matrices,
+so counting words per sample is a single sparse product.
+"""
+import re
+
+import numpy as np
+import pandas as pd
+import scipy.sparse as sparse
+
+from magine.data.row_index import TokenIndex
+
+# tokens of wordcloud.WordCloud.process_text
+_word = re.compile(r"\w[\w']*")
+
+
+def clean_term_name(term_name):
+    """ Lower case term name without its database suffix, p53 as tp53
+
+    Examples
+    --------
+    >>> clean_term_name('p53 signaling pathway_Homo sapiens_hsa04115')
+    'tp53 signaling pathway'
+    """
+    x = ' ' + term_name.split('_')[0].lower()
+    x = x.replace(' p53', ' tp53')
+    x = x.replace('  ', ' ')
+    if x[:1] == ' ':
+        x = x[1:]
+    if x[-1:] == ' ':
+        x = x[:-1]
+    return x
+
+
+def _words(text):
+    words = [w[:-2] if w.endswith("'s") else w for w in _word.findall(text)]
+    return [w for w in words if not w.isdigit()]
+
+
+class TermWordIndex(object):
+    """ Tokens and word counts of term names
+
+    Parameters
+    ----------
+    term_names : array_like
+        term_name of each row
+
+    Examples
+    --------
+    >>> index = TermWordIndex(['apoptosis', 'p53 signaling', 'apoptosis'])
+    >>> index.row_mask('apop').tolist()
+    [True, False, True]
+    """
+
+    def __init__(self, term_names):
+        codes, names = pd.factorize(np.asarray(term_names, dtype=object))
+        self.row_codes = codes
+        self.names = np.asarray(names, dtype=object)
+        self._lower = None
+        self._cleaned = None
+        self._tokens = None
+        self._word_matrices = {}
+
+    @property
+    def n_rows(self):
+        return len(self.row_codes)
+
+    @property
+    def lower_names(self):
+        if self._lower is None:
+            self._lower = pd.Series(self.names, dtype=object).str.lower()
+        return self._lower
+
+    def _token_index(self):
+        if self._tokens is None:
+            self._tokens = TokenIndex(self.lower_names)
+        return self._tokens
+
+    def name_mask(self, words):
+        """ If each distinct name contains any of words, as str.contains
+
+        Parameters
+        ----------
+        words : str or list of str
+            Substrings or regular expressions, matched against lower case
+            names
+
+        Returns
+        -------
+        np.ndarray of bool
+        """
+        if isinstance(words, str):
+            words = [words]
+        found = np.zeros(len(self.names), dtype=bool)
+        for word in words:
+            found |= self._token_index().contains(word)
+        return found
+
+    def row_mask(self, words):
+        """ If each row's term name contains any of words """
+        found = self.name_mask(words)
+        return (self.row_codes >= 0) & found[self.row_codes]
+
+    def cleaned_names(self):
+        """ clean_term_name of each distinct name """
+        if self._cleaned is None:
+            self._cleaned = np.array(
+                [clean_term_name(i) for i in self.names], dtype=object
+            )
+        return self._cleaned
+
+    def word_matrix(self, stopwords=()):
+        """ Words of each distinct name, as counted for word clouds
+
+        Names are cleaned with clean_term_name and split like
+        wordcloud.WordCloud.process_text. Stop words and numbers are dropped
+        and a plural is counted as its singular if the singular also occurs.
+
+        Parameters
+        ----------
+        stopwords : set of str
+
+        Returns
+        -------
+        words : np.ndarray
+        matrix : scipy.sparse.csr_matrix
+            names x words counts
+        """
+        key = frozenset(i.lower() for i in stopwords)
+        if key not in self._word_matrices:
+            words = [[w for w in _words(i) if w not in key]
+                     for i in self.cleaned_names()]
+            vocabulary = set(w for i in words for w in i)
+            singular = dict(
+                (w, w[:-1]) for w in vocabulary
+                if w.endswith('s') and not w.endswith('ss')
+                and w[:-1] in vocabulary
+            )
+            words = [[singular.get(w, w) for w in i] for i in words]
+            self._word_matrices[key] = _incidence(words, binary=False)
+        return self._word_matrices[key]
+
+    def word_counts(self, groups, stopwords=()):
+        """ Count words of the term names of each group of rows
+
+        Parameters
+        ----------
+        groups : array_like
+            Group of each row, such as sample_id. Rows with a missing group
+            are not counted.
+        stopwords : set of str
+
+        Returns
+        -------
+        pandas.DataFrame
+            words x groups, words that are not found are dropped
+        """
+        group_codes, group_values = pd.factorize(
+            np.asarray(groups, dtype=object)
+        )
+        keep = (group_codes >= 0) & (self.row_codes >= 0)
+        rows = sparse.csr_matrix(
+            (np.ones(keep.sum(), dtype=np.int64),
+             (group_codes[keep], self.row_codes[keep])),
+            shape=(len(group_values), len(self.names))
+        )
+        words, matrix = self.word_matrix(stopwords)
+        counts = np.asarray((rows @ matrix).T.todense())
+        found = counts.sum(axis=1) > 0
+        return pd.DataFrame(counts[found], index=words[found],
+                            columns=group_values)
+
+
+def _incidence(tokens, binary=True):
+    # names x vocabulary matrix of lists of tokens
+    lengths = np.fromiter((len(i) for i in tokens), dtype=np.int64,
+                          count=len(tokens))
+    flat = np.fromiter((t for i in tokens for t in i), dtype=object,
+                       count=lengths.sum())
+    codes, vocabulary = pd.factorize(flat, sort=True)
+    matrix = sparse.csr_matrix(
+        (np.ones(len(codes), dtype=np.int32), codes,
+         np.r_[0, np.cumsum(lengths)]),
+        shape=(len(tokens), len(vocabulary))
+    )
+    matrix.sum_duplicates()
+    if binary:
+        matrix.data[:] = 1
+    return np.asarray(vocabulary, dtype=object), matrix
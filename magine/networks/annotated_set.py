@@ -243,9 +243,9 @@ def create_asn(df, network, terms=None, save_name=None, draw_png=False,
     labels = df_copy['sample_id'].unique()
     # create dictionary of values
     label_dict, term_dict = dict(), dict()
+    gene_index = df_copy.gene_index
     for i in terms:
-        genes = set(df_copy.term_to_genes(i))
-        term_dict[i] = genes
+        term_dict[i] = gene_index.term_genes(i)
         label_dict[i] = i
 
     ong = AnnotatedSetNetworkGenerator(network=network)
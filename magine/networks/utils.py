@@ -457,8 +457,8 @@ def add_data_to_graph(network, exp_data):
         network = add_attribute_to_network(network, spec, attr_name,
                                            'red', 'blue')
     # add labels for if node is measured in any of our samples
-    for time, spec in zip(exp_data.species.sig.sample_ids,
-                          exp_data.species.sig.by_sample):
+    sig = exp_data.species.sig
+    for time, spec in zip(sig.sample_ids, sig.by_sample):
         time = 'sample{}'.format(time)
         network = add_attribute_to_network(network, spec, time, 'red', 'blue')
     return n_copy
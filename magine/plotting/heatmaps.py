@@ -4,6 +4,7 @@ from itertools import chain
 import matplotlib.pyplot as plt
 import numpy as np
 import scipy.cluster.hierarchy as sch
+import scipy.sparse as sparse
 import seaborn as sns
 
 
@@ -56,13 +57,9 @@ def heatmap_from_array(data, convert_to_log=False, y_tick_labels='auto',
     plt.Figure
 
     """
-    if min_sig:
-        d_copy = data.require_n_sig(columns=columns, index=index,
-                                    n_sig=min_sig)
-    else:
-        d_copy = data.copy()
-    array = d_copy.pivoter(convert_to_log, columns=columns, index=index,
-                           fill_value=0.0, values=values, min_sig=min_sig)
+    # pivoter filters by min_sig itself, and caches tables on data
+    array = data.pivoter(convert_to_log, columns=columns, index=index,
+                         fill_value=0.0, values=values, min_sig=min_sig)
     if not len(array):
         warnings.warn("Empty array after filtering.")
         return
@@ -106,8 +103,9 @@ def heatmap_from_array(data, convert_to_log=False, y_tick_labels='auto',
         array = array.reindex(new_index)
     elif isinstance(sort_row, list):
         array = array.reindex(sort_row)
-    if cluster_by_set and "genes" in d_copy.columns:
+    if cluster_by_set and "genes" in data.columns:
         # clustering will be based on jaccard index of terms
+        d_copy = _require_n_sig(data, columns, index, min_sig)
         dist_mat, names = d_copy.calc_dist(level='sample')
         linkage = sch.linkage(dist_mat, method='average')
         # Add row cluster flag in case user didn't set
@@ -129,7 +127,7 @@ def heatmap_from_array(data, convert_to_log=False, y_tick_labels='auto',
 
     # check annotations exist
     if annotate_sig:
-        annotate_sig, annotations, fmt = _get_sig_annotations(array, d_copy,
+        annotate_sig, annotations, fmt = _get_sig_annotations(array, data,
                                                               columns,
                                                               index, min_sig)
     cluster_args = dict(method='complete', metric='correlation')
@@ -171,6 +169,7 @@ def heatmap_from_array(data, convert_to_log=False, y_tick_labels='auto',
 
         # add labels to column colors
         if add_col_group:
+            d_copy = _require_n_sig(data, columns, index, min_sig)
             fig = _add_column_color_groups(d_copy, fig, col_color_map,
                                            col_labels, columns)
 
@@ -381,8 +380,8 @@ def cluster_distance_mat(dist_mat, names, figsize=(8, 8)):
 
     Parameters
     ----------
-    dist_mat : np.array
-        Distance matrix array.
+    dist_mat : np.array or scipy.sparse matrix
+        Distance matrix array. Sparse matrices are densified.
     names : list_like
         Names of ticks for distance matrix
     figsize : tuple
@@ -392,6 +391,9 @@ def cluster_distance_mat(dist_mat, names, figsize=(8, 8)):
     -------
 
     """
+    if sparse.issparse(dist_mat):
+        dist_mat = dist_mat.toarray()
+    names = np.asarray(names)
     # Compute and plot first dendrogram.
     fig = plt.figure(figsize=figsize)
 
@@ -436,6 +438,14 @@ def cluster_distance_mat(dist_mat, names, figsize=(8, 8)):
     return fig
 
 
+def _require_n_sig(data, columns, index, min_sig):
+    # rows that are pivoted, only needed to cluster or group columns
+    if min_sig:
+        return data.require_n_sig(columns=columns, index=index,
+                                  n_sig=min_sig)
+    return data
+
+
 def _set_col_colors(array):
     col_labels = array.columns.levels[0]
     labels = list(array.columns.levels[1])
@@ -11,6 +11,7 @@ import seaborn as sns
 from plotly.offline import plot, iplot, init_notebook_mode
 
 import magine.html_templates.html_tools as ht
+from magine.data.row_index import RowIndex
 from magine.data.tools import log2_normalize_df
 
 fold_change = 'fold_change'
@@ -122,19 +123,21 @@ def plot_genes_by_ont(data, list_of_terms, save_name, out_dir=None,
     # here we are going to iterate through all sig GO terms and create
     # a list of plots to create. For the HTML side, we need to point to
     # a location
-    _data = exp_data.data.copy()
+    _data = exp_data.data
+    species_rows = _data.row_index(identifier)
+    term_rows = data.groupby('term_name', sort=False).indices
     # create plot of genes over time
     for n, i in enumerate(list_of_terms):
         # want to plot all species over time
-        index = data['term_name'] == i
+        term = data.iloc[term_rows.get(i, [])]
 
-        name = data[index]['term_name'].unique()
+        name = term['term_name'].unique()
 
         if len(name) > 0:
             name = name[0]
 
         gene_set = set()
-        genes = data[index]['genes']
+        genes = term['genes']
         for g in genes:
             if isinstance(g, list):
                 each = g
@@ -156,7 +159,7 @@ def plot_genes_by_ont(data, list_of_terms, save_name, out_dir=None,
         figure_locations[i] = out_point
 
         title = "{0} : {1}".format(str(i), name)
-        local_df = _data.loc[_data[identifier].isin(list(gene_set))].copy()
+        local_df = _data.iloc[species_rows.rows(gene_set)]
         p_input = [local_df, list(gene_set), local_save_name, out_dir,
                    title, plot_type]
 
@@ -191,6 +194,7 @@ def plot_dataframe(exp_data, html_filename, out_dir='proteins',
         os.mkdir(out_dir)
     local_data = exp_data.copy()
     species_to_plot = local_data[identifier].unique()
+    species_rows = RowIndex(local_data[identifier].values)
 
     fig_loc = {}
     plots = []
@@ -200,16 +204,18 @@ def plot_dataframe(exp_data, html_filename, out_dir='proteins',
     for i in species_to_plot:
         save_name = re.sub('[/_.]', '', i)
 
-        plots.append([local_data, [i], save_name, out_dir, i, plot_type])
+        # each plot gets only the rows of its species
+        plots.append([local_data.iloc[species_rows.rows([i])], [i],
+                      save_name, out_dir, i, plot_type])
 
         n = '<a href="{0}/{1}.{2}">{1}</a>'.format(out_dir, save_name, suffix)
         fig_loc[i] = n
 
     _make_plots(plots, plot_species, run_parallel)
 
-    # Place a link to the species for each key
-    for key, value in fig_loc.items():
-        local_data.loc[exp_data[identifier] == key, identifier] = value
+    # Place a link to the species for each key, map also renames the
+    # categories of categorical identifiers
+    local_data[identifier] = local_data[identifier].map(fig_loc)
     cols = [identifier, label_col, fold_change, p_val, sample_id, exp_method,
             flag]
     local_data = local_data[cols]
@@ -1,9 +1,12 @@
 import types
 
 import matplotlib.pyplot as plt
+import numpy as np
 import pandas as pd
 from wordcloud import STOPWORDS, WordCloud
 
+from magine.enrichment.word_index import TermWordIndex, clean_term_name
+
 # Will be OK in Python 2
 try:
     basestring
@@ -38,6 +41,10 @@ def word_cloud_from_array(enrichment_array, sample_ids, category=None,
     """
     Creates a word cloud for each sample_id
 
+    Words are counted for all samples at once with the word index of
+    enrichment_array. Only single words are counted, bigrams of words that
+    often occur together are not, as in create_wordcloud. Word cloud
+    images are only drawn if save_name is given.
 
     Parameters
     ----------
@@ -51,31 +58,28 @@ def word_cloud_from_array(enrichment_array, sample_ids, category=None,
     -------
 
     """
-    samples = []
+    keep = enrichment_array.filter_multi(
+        p_value=p_value, db=database_list, sample_id=sample_ids,
+        category=category, as_mask=True
+    )
     all_samples = []
+    groups = np.full(len(keep), None, dtype=object)
+    sample_column = enrichment_array['sample_id'].values
     for i in sample_ids:
-        sample = enrichment_array.filter_multi(
-            p_value=p_value, db=database_list, sample_id=i, category=category
-        )
-
+        rows = keep & (sample_column == i)
+        sample = enrichment_array[rows]
         all_samples.append(sample)
-        if len(sample) != 0:
-            if save_name is not None:
-                output = "{}_{}_wordcloud".format(save_name, i)
-            else:
-                output = None
-            hits_1 = create_wordcloud(sample, save_name=output)
-            df1 = pd.DataFrame(
-                list(hits_1.word_dict.items()), columns=['words', 'counts']
-            )
-            df1.sort_values('counts', ascending=False, inplace=True)
-            df1['sample'] = i
-            samples.append(df1.copy())
-
-    df = pd.concat(samples)
-    samples = df['sample'].unique()
-    df = pd.pivot_table(df, index='words', columns=['sample']).fillna(0)
-    df.columns = df.columns.droplevel()
+        groups[rows] = i
+        if len(sample) != 0 and save_name is not None:
+            create_wordcloud(sample,
+                             save_name="{}_{}_wordcloud".format(save_name, i))
+
+    index = _word_index(enrichment_array)
+    df = index.word_counts(groups, stopwords=basic_words)
+    df = df[sorted(df.columns)]
+    samples = list(df.columns)
+    df.index.name = 'words'
+    df.columns.name = 'sample'
     df['sum'] = df[samples].sum(axis=1)
     df.sort_values('sum', ascending=False, inplace=True)
     # print("\nSorted by sum of all")
@@ -88,9 +92,10 @@ def create_wordcloud(df, save_name=None):
     Creates a word cloud based on enrichment array
 
     Must have column 'term_name'.
-    It takes this column, flattens it into a large string.
-    Then we pass it to the python package wordcloud, which generates the
-    wordcloud.
+    Words of the cleaned term names are counted with the word index of df,
+    as by wordcloud.WordCloud.process_text without collocations, so the
+    counts are those of word_cloud_from_array. Then we pass them to the
+    python package wordcloud, which generates the wordcloud.
 
     It returns the figure with a save method and a dictionary of counts.
 
@@ -105,15 +110,16 @@ def create_wordcloud(df, save_name=None):
     -------
 
     """
-    data = df.apply(_cleanup_term_name, axis=1)
-    text = ' '.join(data)
+    index = _word_index(df)
+    counts = index.word_counts(np.zeros(index.n_rows, dtype=np.int64),
+                               stopwords=basic_words)
+    word_dict = dict((i, int(j)) for i, j in counts.sum(axis=1).items())
     # Generate a word cloud image
     wc = WordCloud(margin=0, background_color=None, mode='RGBA',
                    # min_count=1,
-                   width=800, height=600, collocations=True,
+                   width=800, height=600, collocations=False,
                    stopwords=basic_words)
-    wordcloud = wc.generate(text)
-    word_dict = wc.process_text(text)
+    wordcloud = wc.generate_from_frequencies(word_dict)
 
     def plot(self, save_name=None, figsize=(8, 5)):
         fig = plt.figure(figsize=figsize)
@@ -144,15 +150,14 @@ def create_wordcloud(df, save_name=None):
     return wordcloud
 
 
+def _word_index(df):
+    # EnrichmentResult keeps its index between calls
+    if hasattr(df, 'word_index'):
+        return df.word_index
+    return TermWordIndex(df['term_name'].values)
+
+
 def _cleanup_term_name(row):
     if not isinstance(row['term_name'], basestring):
         print(row)
-    x = row['term_name'].split('_')[0].lower()
-    x = ' ' + x
-    x = x.replace(' p53', ' tp53')
-    x = x.replace('  ', ' ')
-    if x[0] == ' ':
-        x = x[1:]
-    if x[-1] == ' ':
-        x = x[:-1]
-    return x
+    return clean_term_name(row['term_name'])
@@ -0,0 +1,224 @@
+"""
+Local stand-in for the enrichR web service.
+
+Only the endpoints used by magine.enrichment.enrichr.Enrichr are served,
+"/addList", "/enrich" and "/datasetStatistics". Gene set libraries are
+rebuilt from the recorded enrichR output in Data/enrichr_test_enrichr.csv,
+and "/enrich" replays the recorded scores of every term that overlaps the
+uploaded gene list.
+
+Examples
+--------
+>>> from magine.enrichment.enrichr import Enrichr
+>>> with EnrichrServer() as server:
+...     e = Enrichr(url=server.url)
+...     df = e.run(['BAX', 'BCL2', 'CASP3'], 'KEGG_2016')
+"""
+import email
+import json
+import os
+import threading
+import time
+from collections import Counter, OrderedDict
+from http.server import BaseHTTPRequestHandler, HTTPServer
+from socketserver import ThreadingMixIn
+from urllib.parse import parse_qs, urlparse
+
+import pandas as pd
+
+_recorded = os.path.join(os.path.dirname(__file__), 'Data',
+                         'enrichr_test_enrichr.csv')
+
+
+def load_recorded_libraries(file_name=_recorded):
+    """ Build gene set libraries from a recorded enrichment output
+
+    Parameters
+    ----------
+    file_name : str
+        csv created by Enrichr.run_samples
+
+    Returns
+    -------
+    dict
+        library name -> OrderedDict of term name -> (genes, recorded scores)
+    """
+    return libraries_from_table(pd.read_csv(file_name))
+
+
+def libraries_from_table(df):
+    """ Build gene set libraries from an enrichment output table
+
+    Parameters
+    ----------
+    df : pandas.DataFrame
+        Enrichment output with term_name, genes, db and score columns
+
+    Returns
+    -------
+    dict
+        library name -> OrderedDict of term name -> (genes, recorded scores)
+    """
+    libraries = dict()
+    for db, rows in df.groupby('db', sort=False):
+        terms = OrderedDict()
+        for row in rows.itertuples():
+            genes, scores = terms.get(row.term_name, (set(), None))
+            genes.update(row.genes.split(','))
+            if scores is None:
+                scores = (row.p_value, row.z_score, row.combined_score,
+                          row.adj_p_value)
+            terms[row.term_name] = (genes, scores)
+        libraries[db] = terms
+    return libraries
+
+
+class _ThreadedHTTPServer(ThreadingMixIn, HTTPServer):
+    daemon_threads = True
+
+
+class EnrichrServer(object):
+    """ Threaded HTTP server that mimics enrichR
+
+    Parameters
+    ----------
+    libraries : dict, optional
+        library name -> OrderedDict of term -> (genes, scores), defaults to
+        :func:`load_recorded_libraries`
+    latency : float
+        Seconds to wait before answering each request
+    n_failures : int
+        Number of initial "/enrich" requests to reject with a 503
+    """
+
+    def __init__(self, libraries=None, latency=0., n_failures=0):
+        if libraries is None:
+            libraries = load_recorded_libraries()
+        self.libraries = libraries
+        self.latency = latency
+        self.n_failures = n_failures
+        self.requests = Counter()
+        self.max_in_flight = 0
+        self._in_flight = 0
+        self._lists = dict()
+        self._lock = threading.Lock()
+        self._server = _ThreadedHTTPServer(('127.0.0.1', 0),
+                                           self._handler_class())
+        self._thread = None
+
+    @property
+    def url(self):
+        return 'http://127.0.0.1:{}/Enrichr/'.format(
+            self._server.server_address[1]
+        )
+
+    def start(self):
+        self._thread = threading.Thread(target=self._server.serve_forever)
+        self._thread.daemon = True
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._server.shutdown()
+        self._server.server_close()
+        self._thread.join()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *args):
+        self.stop()
+
+    def _add_list(self, body, content_type):
+        msg = email.message_from_bytes(
+            b'Content-Type: ' + content_type.encode() + b'\r\n\r\n' + body
+        )
+        genes = []
+        for part in msg.get_payload():
+            name = part.get_param('name', header='content-disposition')
+            if name == 'list':
+                genes = part.get_payload(decode=True).decode().split('\n')
+        with self._lock:
+            list_id = len(self._lists) + 1
+            self._lists[list_id] = set(genes)
+        return {'userListId': list_id, 'shortId': str(list_id)}
+
+    def _enrich(self, query):
+        list_id = int(query['userListId'][0])
+        lib = query['backgroundType'][0]
+        genes = self._lists[list_id]
+        entries = []
+        for term, (term_genes, scores) in self.libraries.get(lib, {}).items():
+            overlap = sorted(genes.intersection(term_genes))
+            if not overlap:
+                continue
+            p_value, z_score, combined_score, adj_p_value = scores
+            entries.append([len(entries) + 1, term, p_value, z_score,
+                            combined_score, overlap, adj_p_value, 0, 0])
+        return {lib: entries}
+
+    def _statistics(self):
+        statistics = []
+        for lib, terms in self.libraries.items():
+            genes = [i[0] for i in terms.values()]
+            statistics.append({
+                'libraryName': lib, 'numTerms': len(terms),
+                'geneCoverage': len(set().union(*genes)),
+                'genesPerTerm': sum(map(len, genes)) / max(len(genes), 1)
+            })
+        return {'statistics': statistics}
+
+    def _handler_class(self):
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def log_message(self, *args):
+                pass
+
+            def _respond(self, status, data=None):
+                body = json.dumps(data).encode()
+                self.send_response(status)
+                self.send_header('Content-Type', 'application/json')
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def _handle(self, method):
+                path = urlparse(self.path)
+                endpoint = path.path.rstrip('/').rsplit('/', 1)[-1]
+                with server._lock:
+                    server.requests[endpoint] += 1
+                    server._in_flight += 1
+                    server.max_in_flight = max(server.max_in_flight,
+                                               server._in_flight)
+                    fail = endpoint == 'enrich' and server.n_failures > 0
+                    if fail:
+                        server.n_failures -= 1
+                try:
+                    time.sleep(server.latency)
+                    if fail:
+                        return self._respond(503)
+                    if method == 'POST' and endpoint == 'addList':
+                        length = int(self.headers['Content-Length'])
+                        return self._respond(200, server._add_list(
+                            self.rfile.read(length),
+                            self.headers['Content-Type']
+                        ))
+                    if method == 'GET' and endpoint == 'enrich':
+                        return self._respond(200, server._enrich(
+                            parse_qs(path.query)
+                        ))
+                    if method == 'GET' and endpoint == 'datasetStatistics':
+                        return self._respond(200, server._statistics())
+                    self._respond(404)
+                finally:
+                    with server._lock:
+                        server._in_flight -= 1
+
+            def do_GET(self):
+                self._handle('GET')
+
+            def do_POST(self):
+                self._handle('POST')
+
+        return Handler
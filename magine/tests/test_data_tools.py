@@ -1,3 +1,4 @@
+import numpy as np
 import pandas as pd
 from nose.tools import raises, ok_
 
@@ -36,6 +37,93 @@ def test_pivot():
     ok_(df.shape == (3, 2))
 
 
+def test_pivot_cache():
+    index = 'protein'
+    values = 'treated_control_fold_change'
+    columns = 'time_points'
+    x = [
+        {values: 1, index: 'x', columns: '1'},
+        {values: -2, index: 'i', columns: '2'},
+        {values: -4, index: 'b', columns: '1'},
+        {values: -4, index: 'b', columns: '2'},
+    ]
+
+    d = ConcentrationBaseData(x)
+    df = d.pivoter(values=values, columns=columns)
+    df.loc['b', '1'] = 100
+    ok_(d.pivoter(values=values, columns=columns).loc['b', '1'] == -4)
+    ok_(len(d._pivot_cache) == 1)
+    d.pivoter(True, values=values, columns=columns)
+    ok_(len(d._pivot_cache) == 2)
+
+    # changes to the data clear the cache
+    d.loc[d[index] == 'b', values] = 8
+    ok_(d._pivot_cache is None)
+    ok_(d.pivoter(values=values, columns=columns).loc['b', '1'] == 8)
+    d.log2_normalize_df(values, inplace=True)
+    ok_(d.pivoter(values=values, columns=columns).loc['b', '1'] == 3)
+
+    # least recently used tables are dropped
+    d.pivot_cache_bytes = d._pivot_cache.n_bytes
+    d._pivot_cache.max_bytes = d.pivot_cache_bytes
+    d.pivoter(True, values=values, columns=columns)
+    ok_(len(d._pivot_cache) == 1)
+    ok_(d.pivoter(True, values=values, columns=columns).loc['b', '1'] ==
+        np.log2(3))
+
+
+def test_pivot_cache_column_writes():
+    index = 'protein'
+    values = 'treated_control_fold_change'
+    columns = 'time_points'
+    x = [
+        {values: 1., index: 'x', columns: '1'},
+        {values: -2., index: 'i', columns: '2'},
+        {values: -4., index: 'b', columns: '1'},
+        {values: -4., index: 'b', columns: '2'},
+    ]
+
+    # writes through a column don't reach the frame
+    d = ConcentrationBaseData(x)
+    ok_(d.pivoter(values=values, columns=columns).loc['b', '1'] == -4)
+    d[values].iloc[2] = 5.
+    ok_(d.pivoter(values=values, columns=columns).loc['b', '1'] == 5)
+    getattr(d, values)[2] = 6.
+    ok_(d.pivoter(values=values, columns=columns).loc['b', '1'] == 6)
+    d[values].values[2] = 7.
+    ok_(d.pivoter(values=values, columns=columns).loc['b', '1'] == 7)
+    d[index].values[0] = 'b'
+    ok_(d.pivoter(values=values, columns=columns).loc['b', '1'] == 4)
+
+
+def test_row_index():
+    index = 'protein'
+    values = 'treated_control_fold_change'
+    x = [
+        {values: 1, index: 'AKT1'},
+        {values: -2, index: 'BAX'},
+        {values: -4, index: 'AKT2'},
+        {values: 3, index: None},
+        {values: 2, index: 'AKT1'},
+        {values: 5, index: 'p-AKT1'},
+    ]
+    d = ConcentrationBaseData(x)
+    rows = d.row_index(index)
+    ok_(d.row_index(index) is rows)
+    ok_(rows.rows(['AKT1', 'TP53']).tolist() == [0, 4])
+    ok_(rows.rows({'AKT2', None}).tolist() == [2, 3])
+    ok_(rows.rows([]).tolist() == [])
+    for pattern in ['AKT', 'KT1', 'AKT1$', '^A', 'p-', 'x']:
+        expected = np.flatnonzero(
+            d[index].str.contains(pattern).fillna(False).values.astype(bool)
+        )
+        ok_(rows.contains(pattern).tolist() == expected.tolist())
+
+    # changes to the data rebuild the index
+    d.loc[1, index] = 'AKT3'
+    ok_(d.row_index(index).contains('AKT').tolist() == [0, 1, 2, 4, 5])
+
+
 @raises(AssertionError)
 def test_min_raises():
     index = 'protein'
@@ -88,6 +176,61 @@ def test_filter_min():
     ok_(df.shape == (3, 5))
 
 
+def test_present_in_all_columns():
+    index = 'protein'
+    columns = 'time_points'
+    flag = 'significant'
+    x = [
+        {index: 'x', columns: '1', flag: True, 'db': 'a'},
+        {index: 'b', columns: '1', flag: False, 'db': 'a'},
+        {index: 'i', columns: '2', flag: True, 'db': 'a'},
+        {index: 'b', columns: '2', flag: True, 'db': 'b'},
+    ]
+
+    d = ConcentrationBaseData(x)
+    df = d.present_in_all_columns(columns=columns)
+    ok_(set(df[index]) == {'b'})
+    df = d.present_in_all_columns(columns=columns, index=[index, 'db'])
+    ok_(df.shape[0] == 0)
+
+    df = d.require_n_sig(columns=columns, index=[index, 'db'], n_sig=1)
+    ok_(set(df[index]) == {'x', 'i', 'b'})
+    d.require_n_sig(columns=columns, n_sig=1, inplace=True)
+    ok_(d.shape == (4, 4))
+    d.present_in_all_columns(columns=columns, inplace=True)
+    ok_(d.shape == (2, 4))
+
+
+def test_present_in_all_columns_categorical():
+    index = ['term_name', 'db']
+    columns = 'sample_id'
+    flag = 'significant'
+    x = [
+        {'term_name': 'x', columns: '1', flag: True, 'db': 'a'},
+        {'term_name': 'b', columns: '1', flag: True, 'db': 'a'},
+        {'term_name': 'i', columns: '2', flag: True, 'db': 'a'},
+        {'term_name': 'b', columns: '2', flag: False, 'db': 'a'},
+        {'term_name': 'b', columns: '2', flag: True, 'db': 'b'},
+    ]
+    d = ConcentrationBaseData(x)
+    # unused categories are not grouped
+    categories = ['t{}'.format(i) for i in range(2000)]
+    cat = d.copy()
+    for i in index:
+        cat[i] = pd.Categorical(cat[i],
+                                categories=sorted(set(cat[i])) + categories)
+
+    for n_sig in (0, 1, 2):
+        ok_(cat.require_n_sig(columns=columns, index=index,
+                              n_sig=n_sig).index.equals(
+            d.require_n_sig(columns=columns, index=index,
+                            n_sig=n_sig).index))
+    df = cat.present_in_all_columns(columns=columns, index=index)
+    ok_(df.index.equals(
+        d.present_in_all_columns(columns=columns, index=index).index))
+    ok_(set(df['term_name']) == {'b'})
+
+
 def test_log_normal():
     x = [['a', 2],
          ['b', -2],
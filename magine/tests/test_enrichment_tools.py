@@ -1,7 +1,10 @@
 import os
+import tempfile
 
 import matplotlib.figure
 import matplotlib.pyplot as plt
+import numpy as np
+import pandas as pd
 from nose.tools import ok_, raises
 
 import magine.enrichment.enrichment_result as et
@@ -32,6 +35,40 @@ class TestEnrichmentResult(object):
         slimmed = self.data.filter_multi(p_value=0.05, combined_score=20)
         ok_(slimmed.shape[0] == 8)
 
+    def test_filter_mask(self):
+        mask = self.data.filter_multi(p_value=0.05, combined_score=20,
+                                      as_mask=True)
+        ok_(mask.sum() == 8)
+        ok_(self.data[mask].equals(
+            self.data.filter_multi(p_value=0.05, combined_score=20)))
+        mask = self.data.filter_rows('term_name', 'apoptosis_hsa_hsa04210',
+                                     as_mask=True)
+        ok_(mask.sum() == 3)
+
+    def test_compact(self):
+        compact = self.data.compact()
+        ok_(compact.memory_usage(deep=True).sum() <
+            self.data.memory_usage(deep=True).sum())
+        ok_(compact['genes'].tolist() == self.data['genes'].tolist())
+        ok_(compact.term_to_genes('apoptosis_hsa_hsa04210') ==
+            self.data.term_to_genes('apoptosis_hsa_hsa04210'))
+        ok_(compact.filter_multi(p_value=0.05, combined_score=20).shape[0]
+            == 8)
+
+        out_dir = tempfile.mkdtemp()
+        csv_name = os.path.join(out_dir, 'compact.csv')
+        compact.to_csv(csv_name, index=False)
+        pd.testing.assert_frame_equal(et.load_enrichment_csv(csv_name),
+                                      self.data)
+        pd.testing.assert_frame_equal(
+            et.load_enrichment_csv(csv_name, compact=True), compact)
+
+        parquet_name = os.path.join(out_dir, 'compact.parquet')
+        compact.to_parquet(parquet_name)
+        loaded = et.load_enrichment_parquet(parquet_name)
+        pd.testing.assert_frame_equal(loaded, compact)
+        ok_(loaded.remove_redundant(level='sample').shape[0] == 7)
+
     def test_term_to_gene(self):
         genes = self.data.term_to_genes('apoptosis_hsa_hsa04210')
         ok_(genes == {'CASP8', 'CASP10', 'BCL2', 'BAX', 'CASP3'})
@@ -43,6 +80,18 @@ class TestEnrichmentResult(object):
         slimmed = self.data.filter_based_on_words(['apop', 'p53'])
         ok_(slimmed.shape[0] == 11)
 
+        # regular expressions are matched against the names
+        slimmed = self.data.filter_based_on_words('apop|p53')
+        ok_(slimmed.shape[0] == 11)
+        slimmed = self.data.filter_based_on_words('cell cycle')
+        ok_(slimmed.shape[0] == 0)
+
+        # index follows changes to the data
+        data = self.data.copy()
+        data.word_index
+        data['term_name'] = 'p53 ' + data['term_name']
+        ok_(data.filter_based_on_words('p53').shape[0] == data.shape[0])
+
     def test_all_genes(self):
         all_g = self.data.all_genes_from_df()
         ok_(all_g == {'CASP8', 'CASP10', 'BCL2', 'BAX', 'CASP3'})
@@ -61,6 +110,60 @@ class TestEnrichmentResult(object):
         copy_data.remove_redundant(level='sample', verbose=True, inplace=True)
         ok_(copy_data.shape[0] == 7)
 
+    def test_filter_sim_terms_minhash(self):
+        sim2 = self.data.remove_redundant(level='dataframe', method='minhash')
+        ok_(0 < sim2.shape[0] <= self.data.shape[0])
+
+        genes = ['G{}'.format(i) for i in range(50)]
+        df = et.EnrichmentResult({
+            'term_name': ['a', 'b', 'c'],
+            'genes': [','.join(genes), ','.join(genes[1:]), 'X,Y'],
+            'combined_score': [3, 2, 1],
+        })
+        ok_(df.unique_terms(0.9, method='minhash') == {'a', 'c'})
+        ok_(df.unique_terms(0.9) == {'a', 'c'})
+
+    def test_similarity_graph(self):
+        expected = {}
+        for level in ('sample', 'dataframe'):
+            for threshold in (.5, .75):
+                expected[level, threshold] = self.data.copy().remove_redundant(
+                    threshold, level=level).shape[0]
+
+        file_name = os.path.join(tempfile.mkdtemp(), 'graph.npz')
+        graph = self.data.similarity_graph('dataframe', floor=.5,
+                                           file_name=file_name)
+        ok_(os.path.exists(file_name))
+        ok_(self.data.similarity_graph('dataframe', floor=.6) is graph)
+        self.data.similarity_graph('sample', floor=.5)
+        for level in ('sample', 'dataframe'):
+            for threshold in (.5, .75):
+                ok_(self.data._cached_graph(level, threshold) is not None)
+                sim = self.data.remove_redundant(threshold, level=level)
+                ok_(sim.shape[0] == expected[level, threshold])
+
+        term = 'apoptosis_hsa_hsa04210'
+        direct = self.data.find_similar_terms(term, level='dataframe')
+        cached = self.data.find_similar_terms(term, level='dataframe',
+                                              threshold=.5)
+        ok_(set(cached.term_name) ==
+            set(direct.loc[direct.similarity_score >= .5, 'term_name']))
+
+        loaded = self.data.copy().similarity_graph('dataframe', floor=.5,
+                                                   file_name=file_name)
+        ok_(loaded.digest == graph.digest)
+        ok_((loaded.scores != graph.scores).nnz == 0)
+
+        # changed genes invalidate the graph
+        copy_data = self.data.copy()
+        copy_data.similarity_graph('dataframe', floor=.5)
+        copy_data['genes'] = 'TP53'
+        ok_(copy_data._cached_graph('dataframe', .5) is None)
+
+    @raises(ValueError)
+    def test_filter_sim_terms_bad_method(self):
+        self.data.unique_terms(method='lsh')
+
     def test_dist(self):
         # dist = self.data.dist_matrix()
         # assert isinstance(dist, matplotlib.figure.Figure)
@@ -82,6 +185,21 @@ class TestEnrichmentResult(object):
         heatmap_by_terms(df.species, ['1', '2'], terms)
         plt.close()
 
+    def test_calc_dist(self):
+        mat, names = self.data.calc_dist(level='dataframe')
+        ok_(mat.shape == (len(names), len(names)))
+        ok_(np.allclose(mat, mat.T))
+        ok_(np.all(np.diag(mat) == 1.))
+        i, j = 0, 1
+        ok_(mat[i, j] == et.jaccard_index(self.data.term_to_genes(names[i]),
+                                          self.data.term_to_genes(names[j])))
+
+        sparse_mat, _ = self.data.calc_dist(level='each', dtype=np.float32,
+                                            threshold=.5)
+        dense, _ = self.data.calc_dist(level='each')
+        ok_(sparse_mat.dtype == np.float32)
+        ok_(np.allclose(sparse_mat.toarray(), np.where(dense >= .5, dense, 0)))
+
     @raises(DeprecationWarning)
     def test_deprecated_warning(self):
         # dist = self.data.dist_matrix()
@@ -106,6 +224,32 @@ class TestEnrichmentResult(object):
 
         ok_(score == 0.6)
 
+    def test_gene_index(self):
+        index = self.data.gene_index
+        ok_(self.data.gene_index is index)
+        words = self.data.word_index
+        self.data.copy()
+        ok_(self.data.gene_index is index)
+        ok_(self.data.word_index is words)
+        ok_(index.decode(index.term_sample_codes('apoptosis_hsa_hsa04210', 1))
+            == {'BAX', 'BCL2', 'CASP3'})
+        ok_(self.data.term_to_genes('not a term') == set())
+        ok_(self.data.term_to_genes(['apoptosis_hsa_hsa04210',
+                                     'colorectal cancer_hsa_hsa05210']) ==
+            {'CASP8', 'CASP10', 'BCL2', 'BAX', 'CASP3'})
+
+        # index is rebuilt after data changes
+        copy_data = self.data.copy()
+        copy_data.gene_index
+        copy_data['genes'] = 'TP53'
+        ok_(copy_data.all_genes_from_df() == {'TP53'})
+        copy_data.loc[copy_data.index[0], 'genes'] = 'MDM2'
+        ok_(copy_data.all_genes_from_df() == {'TP53', 'MDM2'})
+        copy_data.filter_rows('term_name', 'apoptosis_hsa_hsa04210',
+                              inplace=True)
+        ok_(copy_data.shape[0] == 3)
+        ok_(copy_data.gene_index.n_rows == 3)
+
     def test_term_to_dict(self):
         g = self.data.term_to_genes_dict(
             ['apoptosis_hsa_hsa04210', 'p53 signaling pathway_hsa_hsa04115']
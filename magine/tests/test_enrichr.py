@@ -1,10 +1,21 @@
+import os
 import tempfile
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+import pandas as pd
 
 from nose.tools import ok_
 
+import magine.enrichment.enrichr as enrichr
 from magine.data.experimental_data import ExperimentalData
-from magine.enrichment.enrichr import Enrichr, clean_drug_dbs, clean_tf_names, \
-    get_background_list, get_libraries, run_enrichment_for_project
+from magine.enrichment.cache import EnrichrCache
+from magine.enrichment.enrichment_result import load_enrichment_csv
+from magine.enrichment.enrichr import Enrichr, clean_drug_dbs, \
+    clean_term_names, clean_tf_names, get_background_list, get_libraries, \
+    normalize_term_names, run_enrichment_for_project
+from magine.enrichment.manifest import RunManifest
+from magine.tests.enrichr_server import EnrichrServer
 from magine.tests.sample_experimental_data import exp_data
 
 e = Enrichr()
@@ -96,5 +107,254 @@ def test_tf_names():
         ok_('_' not in i)
 
 
+def test_concurrent_local_server():
+    dbs = ['KEGG_2016', 'NCI-Nature_2016']
+    genes = ['BAX', 'BCL2', 'CASP3', 'CASP8']
+    with EnrichrServer(latency=0.05) as server:
+        serial = Enrichr(url=server.url).run(genes, dbs)
+        e_parallel = Enrichr(url=server.url, max_workers=2)
+        parallel = e_parallel.run(genes, dbs)
+        ok_(server.max_in_flight == 2)
+    ok_(serial.equals(parallel))
+    ok_(list(parallel['db'].unique()) == dbs)
+
+
+def test_retry_local_server():
+    with EnrichrServer(n_failures=2) as server:
+        df = Enrichr(url=server.url, backoff_factor=0).run(
+            ['BAX', 'BCL2', 'CASP3'], 'KEGG_2016'
+        )
+        ok_(server.requests['enrich'] == 3)
+    ok_(df.shape[0] > 0)
+    with EnrichrServer(n_failures=2) as server:
+        df = Enrichr(url=server.url, max_retries=1, backoff_factor=0).run(
+            ['BAX', 'BCL2', 'CASP3'], 'KEGG_2016'
+        )
+    ok_(df.shape[0] == 0)
+
+
+def test_cache():
+    dbs = ['KEGG_2016', 'NCI-Nature_2016']
+    genes = ['BAX', 'BCL2', 'CASP3', 'CASP8']
+    cache = EnrichrCache(cache_dir=tempfile.mkdtemp())
+    with EnrichrServer() as server:
+        e = Enrichr(url=server.url, cache=cache)
+        df = e.run(genes, dbs)
+        ok_(cache.misses == 2 and cache.hits == 0)
+        # same genes in a different order are served from the cache
+        df2 = e.run(genes[::-1], dbs)
+        ok_(cache.hits == 2)
+        ok_(server.requests['addList'] == 1)
+        ok_(server.requests['enrich'] == 2)
+    ok_(df.equals(df2))
+
+    offline = Enrichr(cache=cache, offline=True)
+    ok_(offline.run(genes, dbs).equals(df))
+    ok_(offline.run(['BAX'], dbs).shape[0] == 0)
+
+    # responses of an updated library are not used
+    with EnrichrServer() as server:
+        server.libraries['KEGG_2016'].popitem()
+        e = Enrichr(url=server.url,
+                    cache=EnrichrCache(cache_dir=cache.cache_dir))
+        e.run(genes, dbs)
+        ok_(e.cache.misses == 1 and e.cache.hits == 1)
+        ok_(server.requests['datasetStatistics'] == 1)
+
+    cache.max_bytes = 0
+    cache.evict()
+    ok_(cache.stats()['n_entries'] == 0)
+
+
+def test_run_samples_local_server():
+    lists = [['BAX', 'BCL2', 'CASP3'],
+             ['CASP10', 'CASP8', 'BAX'],
+             ['BCL2', 'CASP3']]
+    dbs = ['KEGG_2016', 'NCI-Nature_2016']
+    out_file = os.path.join(tempfile.mkdtemp(), 'stream.csv')
+    with EnrichrServer() as server:
+        e = Enrichr(url=server.url)
+        df = e.run_samples(lists, ['1', '2', '3'], gene_set_lib=dbs)
+        ok_(e.run_samples(lists, ['1', '2', '3'], gene_set_lib=dbs,
+                          stream_to=out_file) == out_file)
+    ok_(list(df['sample_id'].cat.categories) == ['1', '2', '3'])
+    ok_(list(df['db'].cat.categories) == dbs)
+    streamed = load_enrichment_csv(out_file, dtype={'sample_id': str})
+    ok_(streamed.shape[0] >= df.shape[0])
+    ok_(set(streamed['sample_id']) == {'1', '2', '3'})
+
+
+def test_save_pivot_local_server():
+    lists = [['BAX', 'BCL2', 'CASP3'],
+             ['CASP10', 'CASP8', 'BAX']]
+    out_dir = tempfile.mkdtemp()
+    cwd = os.getcwd()
+    os.chdir(out_dir)
+    try:
+        with EnrichrServer() as server:
+            e = Enrichr(url=server.url)
+            df = e.run_samples(lists, ['1', '2'], gene_set_lib='KEGG_2016',
+                               save_name='pivot', pivot=True)
+    finally:
+        os.chdir(cwd)
+    saved = pd.read_excel(os.path.join(out_dir, 'pivot_enrichr.xlsx'),
+                          header=[0, 1], index_col=[0, 1])
+    ok_(saved.shape[0] == df['term_name'].nunique())
+    ok_(set(saved.columns.get_level_values(1).astype(str)) == {'1', '2'})
+    ok_(os.path.exists(os.path.join(out_dir, 'pivot_enrichr.csv')))
+
+
+def test_project_partitioned_local_server():
+    slimmed = exp_data.species.copy()
+    slimmed = slimmed.loc[slimmed.source.isin(['label_free', 'silac'])]
+    slimmed = slimmed.loc[slimmed.sample_id.isin(['Time_1', 'Time_2', ])]
+    slimmed = ExperimentalData(slimmed)
+    dbs = ['KEGG_2016', 'NCI-Nature_2016']
+    out_dir = tempfile.mkdtemp()
+    cwd = os.getcwd()
+    os.chdir(out_dir)
+    try:
+        with EnrichrServer() as server:
+            run_enrichment_for_project(slimmed, 'serial', databases=dbs,
+                                       url=server.url)
+            run_enrichment_for_project(slimmed, 'part', databases=dbs,
+                                       url=server.url, max_workers=2,
+                                       partitioned=True)
+            n_enrich = server.requests['enrich']
+
+            # a finished run does not query enrichR again
+            run_enrichment_for_project(slimmed, 'part', databases=dbs,
+                                       url=server.url, partitioned=True)
+            ok_(server.requests['enrich'] == n_enrich)
+
+            # a lost unit is the only one run again
+            manifest = RunManifest(os.path.join(
+                out_dir, 'enrichment_output', 'part_manifest.json'))
+            ok_(list(manifest.counts()) == ['done'])
+            unit = [i for i in manifest.units.values() if i['path']][0]
+            os.remove(os.path.join(out_dir, 'enrichment_output',
+                                   unit['path']))
+            run_enrichment_for_project(slimmed, 'part', databases=dbs,
+                                       url=server.url, partitioned=True)
+            ok_(server.requests['enrich'] == n_enrich + 1)
+    finally:
+        os.chdir(cwd)
+
+    serial = load_enrichment_csv(os.path.join(out_dir,
+                                              'serial_enrichment.csv.gz'))
+    part = load_enrichment_csv(os.path.join(out_dir,
+                                            'part_enrichment.csv.gz'))
+    key = ['category', 'sample_id', 'db', 'term_name']
+    serial = serial.sort_values(key).reset_index(drop=True)
+    part = part.sort_values(key).reset_index(drop=True)
+    # empty samples make the serial rank and n_genes float
+    pd.testing.assert_frame_equal(serial, part, check_dtype=False)
+    dataset = pd.read_parquet(os.path.join(out_dir, 'enrichment_output',
+                                           'part_enrichment'))
+    ok_(dataset.shape[0] == part.shape[0])
+
+
+def test_shared_gene_lists():
+    genes = ['BAX', 'BCL2', 'CASP3', 'CASP8']
+    dbs = ['KEGG_2016', 'NCI-Nature_2016']
+    with EnrichrServer(latency=0.2) as server:
+        e = Enrichr(url=server.url, max_workers=2)
+        pool = ThreadPoolExecutor(2)
+        first, second = pool.map(lambda g: e.run(g, dbs),
+                                 [genes, genes[::-1]])
+        ok_(server.requests['addList'] == 1)
+        ok_(server.requests['enrich'] == 2)
+        ok_(e.saved_calls == {'addList': 1, 'enrich': 2})
+    ok_(first.equals(second))
+
+    # identical samples are only run once within a project
+    slimmed = exp_data.species.copy()
+    slimmed = slimmed.loc[slimmed.source == 'label_free']
+    slimmed = slimmed.loc[slimmed.sample_id == 'Time_1']
+    copy = slimmed.copy()
+    copy['sample_id'] = 'Time_2'
+    slimmed = ExperimentalData(pd.concat([slimmed, copy]))
+    out_dir = tempfile.mkdtemp()
+    cwd = os.getcwd()
+    os.chdir(out_dir)
+    try:
+        for partitioned in (False, True):
+            with EnrichrServer() as server:
+                run_enrichment_for_project(
+                    slimmed, 'shared', databases=dbs, url=server.url,
+                    partitioned=partitioned,
+                    output_path=os.path.join(out_dir, str(partitioned))
+                )
+                # both and up lists of both samples are the same single gene
+                ok_(server.requests['addList'] == 1)
+                ok_(server.requests['enrich'] == len(dbs))
+    finally:
+        os.chdir(cwd)
+    manifest = RunManifest(os.path.join(out_dir, 'True',
+                                        'shared_manifest.json'))
+    ok_(manifest.summary['saved_calls'] == 3 * (1 + len(dbs)))
+    ok_(manifest.counts() == {'done': 4 * len(dbs)})
+
+
+def test_normalize_term_names():
+    rows = [
+        ('apoptotic process (GO:0006915)', 'GO_Biological_Process_2017'),
+        ('apoptotic process (go:0006915)', 'GO_Biological_Process_2018'),
+        ('GO: strange (GO:1)(GO:2)', 'GO_Cellular_Component_2017b'),
+        ('Abnormality of the eye (HP:0000478)', 'Human_Phenotype_Ontology'),
+        ('MP:0001 abnormal  survival', 'MGI_Mammalian_Phenotype_2017'),
+        ('no mp id', 'MGI_Mammalian_Phenotype_2017'),
+        ('Cisplatin-7.5_mg/kg_in_CMC_Rat-Liver-1d-up', 'DrugMatrix'),
+        ('no-direction', 'DrugMatrix'),
+        ('cisplatin-1234', 'Old_CMAP_up'),
+        ('IL6_human_GSE1', 'Ligand_Perturbations_from_GEO_up'),
+        ('Apoptosis Homo sapiens R-HSA-109581', 'Reactome_2016'),
+        ('  p53 signaling Mus musculus hg19 ', 'KEGG_2016'),
+        (np.nan, 'KEGG_2016'),
+        ('apoptosis', np.nan),
+    ]
+    df = pd.DataFrame(rows, columns=['term_name', 'db'], index=[0, 1] * 7)
+    expected = [clean_term_names(row) for _, row in df.iterrows()]
+    for _ in range(2):
+        # second call is answered from the memo
+        out = normalize_term_names(df)
+        ok_(out.index.equals(df.index))
+        ok_(all(i == j or (pd.isnull(i) and pd.isnull(j))
+                for i, j in zip(out.values, expected)))
+
+    # the memo is cleared when it holds too many names
+    max_memo_size = enrichr._max_memo_size
+    enrichr._max_memo_size = 3
+    try:
+        enrichr._term_name_memo.clear()
+        out = normalize_term_names(df)
+        ok_(sum(len(i) for i in enrichr._term_name_memo.values()) <= 3)
+        ok_(all(i == j or (pd.isnull(i) and pd.isnull(j))
+                for i, j in zip(out.values, expected)))
+
+        # threads clean names and clear the memo at the same time
+        with ThreadPoolExecutor(8) as pool:
+            outs = list(pool.map(lambda _: normalize_term_names(df),
+                                 range(200)))
+        ok_(all(i.equals(out) for i in outs))
+    finally:
+        enrichr._max_memo_size = max_memo_size
+
+
+def test_clean_drug_names_vectorized():
+    df = pd.DataFrame([
+        ['cpc006 snuc5 6h-quinine hemisulfate-10.0',
+         'LINCS_L1000_Chem_Pert_up'],
+        ['cpc006 snuc5 6h', 'LINCS_L1000_Chem_Pert_up'],
+        ['cisplatin_human_GSE123_up', 'Drug_Perturbations_from_GEO_2014'],
+        ['BAX_ARCHS4', 'ARCHS4_TFs_Coexp'],
+        ['tp53', 'ChEA_2016'],
+    ], columns=['term_name', 'db'])
+    df = clean_drug_dbs(df)
+    ok_(list(df['term_name']) == ['quinine hemisulfate', 'cpc006 snuc5 6h',
+                                  'cisplatin_up', 'BAX_ARCHS4', 'tp53'])
+    ok_(list(clean_tf_names(df)['term_name']) == ['BAX', 'TP53'])
+
+
 if __name__ == '__main__':
     test_single_run()
@@ -6,7 +6,8 @@ import matplotlib.pyplot as plt
 import pandas as pd
 from nose.tools import ok_
 
-from magine.data.experimental_data import ExperimentalData, load_data
+from magine.data.experimental_data import ExperimentalData, csv_to_parquet, \
+    load_data
 from magine.plotting.species_plotting import plot_dataframe
 
 
@@ -16,7 +17,10 @@ class TestExpData(object):
         self.exp_data = load_data(
             os.path.join(self._dir, 'example_apoptosis.csv')
         )
+        # plots and tables without an out_dir are written to the cwd
         self.out_dir = tempfile.mkdtemp()
+        self._cwd = os.getcwd()
+        os.chdir(self.out_dir)
 
     def test_plot(self):
         plot_dataframe(self.exp_data.data, 'test.html', out_dir='proteins',
@@ -24,6 +28,7 @@ class TestExpData(object):
 
     def tearDown(self):
         self.exp_data = None
+        os.chdir(self._cwd)
         shutil.rmtree(self.out_dir)
 
     def test_load_from_df(self):
@@ -58,6 +63,36 @@ class TestExpData(object):
                                                 'AGTR2', 'TP53', 'BID', 'AKT1'}
             )
 
+    def test_ranked_by_sample(self):
+        genes = self.exp_data.genes
+        ranked = genes.ranked_by_sample()
+        ok_(len(ranked) == len(genes.sample_ids))
+        for values in ranked:
+            ok_(values.index.is_unique)
+            ok_((values.diff().dropna() <= 0).all())
+        up = set(ranked[0][ranked[0] > 0].index)
+        ok_(genes.up_by_sample[0] <= up)
+        ranked = genes.ranked_by_sample('fold_change')
+        ok_(len(ranked) == len(genes.sample_ids))
+
+    def test_ids_by_sample(self):
+        genes = self.exp_data.genes
+        for direction, sets in [('both', genes.by_sample),
+                                ('up', genes.up_by_sample),
+                                ('down', genes.down_by_sample)]:
+            arrays = genes.ids_by_sample(direction)
+            ok_([set(i) for i in arrays] == sets)
+            ok_(all(len(set(i)) == len(i) for i in arrays))
+        ok_(genes.up_by_sample == [
+            set(genes.loc[genes['sample_id'] == i].up.id_list)
+            for i in genes.sample_ids
+        ])
+
+        # cached until the data changes
+        down = genes.down_by_sample
+        genes['fold_change'] = -genes['fold_change']
+        ok_(genes.up_by_sample == down)
+
     def test_rna(self):
         ok_(self.exp_data.rna.id_list == {'AIF1', 'AKT1', 'AKT2'})
         ok_(self.exp_data.rna.sig.id_list == {'AIF1', 'AKT1'})
@@ -81,6 +116,29 @@ class TestExpData(object):
                                                   'HMDB0000001', 'ADRA1A',
                                                   'HMDB0009901'})
 
+    def test_sample_attributes(self):
+        data = self.exp_data.data
+        for i in self.exp_data.exp_methods + self.exp_data.sample_ids:
+            column = 'source' if i in self.exp_data.exp_methods \
+                else 'sample_id'
+            expected = data.loc[data[column] == i]
+            ok_(self.exp_data[i].equals(expected))
+            ok_(getattr(self.exp_data, i) is self.exp_data[i])
+        ok_(not hasattr(self.exp_data, 'Time_4'))
+
+        # changes to subsets are not seen by data
+        before = data.copy()
+        pivot = data.pivoter()
+        species = self.exp_data.species
+        species.loc[species.index[0], 'fold_change'] = 999.
+        species.iloc[1, species.columns.get_loc('fold_change')] = 555.
+        species.log2_normalize_df(inplace=True)
+        self.exp_data.silac['fold_change'] = 0.
+        ok_(self.exp_data.data is data)
+        ok_(data.equals(before))
+        ok_(data.pivoter().equals(pivot))
+        ok_(not (species['fold_change'] == data['fold_change']).all())
+
     def test_plot_list(self):
         self.exp_data.rna.plot_species(self.exp_data.rna.sig.id_list,
                                        save_name='del_test',
@@ -143,6 +201,31 @@ class TestExpData(object):
         self.exp_data.create_summary_table(sig=True)
         self.exp_data.create_summary_table(sig=True, index='label')
 
+        both = self.exp_data.create_summary_table(sig='both')
+        ok_(both['measured'].equals(self.exp_data.create_summary_table()))
+        ok_(both['significant'].equals(
+            self.exp_data.create_summary_table(sig=True)))
+        ok_(both.loc['rna_seq', ('measured', 'Time_3')] == 3)
+        ok_(both.loc['rna_seq', ('significant', 'Time_3')] == 2)
+        ok_(both.loc['rna_seq', ('measured', 'Time_1')] == '-')
+        ok_(both.loc['label_free', ('measured', 'Total Unique Across')] == 7)
+        ok_(both.loc['label_free',
+                     ('significant', 'Total Unique Across')] == 5)
+
+    def test_data_changes(self):
+        label_free = self.exp_data.label_free
+        ok_(self.exp_data['label_free'] is label_free)
+        ok_(self.exp_data.Time_1 is self.exp_data.Time_1)
+
+        # sources and sample_ids follow changes to data
+        data = self.exp_data.data
+        data.loc[data['source'] == 'label_free', 'fold_change'] = 100.
+        ok_((self.exp_data.label_free['fold_change'] == 100).all())
+        self.exp_data.data = data.loc[data['source'] != 'rna_seq']
+        ok_(not hasattr(self.exp_data, 'rna_seq'))
+        ok_(self.exp_data.Time_3.shape[0] ==
+            (self.exp_data.data['sample_id'] == 'Time_3').sum())
+
     def test_log2(self):
         x = self.exp_data.rna.log2_normalize_df('fold_change')
         ok_(x.to_dict() ==
@@ -168,3 +251,59 @@ class TestExpData(object):
         species = ['AKT1', 'AIF1']
         x = self.exp_data.subset(species, index='identifier')
         ok_(x.shape == (2, 8))
+        x = self.exp_data.subset('AK', index='label')
+        data = self.exp_data.data
+        ok_(x.index.tolist() ==
+            data.index[data['label'].str.contains('AK')].tolist())
+        x = self.exp_data.label_free.subset(['AKT1', 'BAX'],
+                                            sample_ids=['Time_1'])
+        ok_(set(x['identifier']) <= {'AKT1', 'BAX'})
+        ok_(set(x['sample_id']) <= {'Time_1'})
+
+
+class TestExpDataParquet(TestExpData):
+    """ Runs every test on typed data loaded from parquet """
+
+    def setUp(self):
+        super(TestExpDataParquet, self).setUp()
+        self.parquet_file = csv_to_parquet(
+            os.path.join(self._dir, 'example_apoptosis.csv'),
+            os.path.join(self.out_dir, 'example_apoptosis.parquet'),
+            block_size=200
+        )
+        self.exp_data = load_data(self.parquet_file)
+
+    def test_types(self):
+        data = self.exp_data.data
+        for i in ['identifier', 'label', 'source', 'species_type',
+                  'sample_id']:
+            ok_(data[i].dtype.name == 'category')
+        ok_(data['significant'].dtype == bool)
+        csv_data = load_data(
+            os.path.join(self._dir, 'example_apoptosis.csv')
+        ).data
+        ok_(data.astype(object).equals(csv_data.astype(object)))
+
+    def test_table_order(self):
+        csv_data = load_data(
+            os.path.join(self._dir, 'example_apoptosis.csv')
+        )
+        # categories in reverse order of their values
+        data = self.exp_data.data.copy()
+        for i in ['source', 'sample_id']:
+            data[i] = data[i].cat.reorder_categories(
+                sorted(data[i].cat.categories, reverse=True)
+            )
+        for exp_data in [self.exp_data, ExperimentalData(data)]:
+            for sig in [False, True, 'both']:
+                table = exp_data.create_summary_table(sig=sig)
+                expected = csv_data.create_summary_table(sig=sig)
+                ok_(table.equals(expected))
+                ok_(list(table.index) == sorted(table.index))
+
+    def test_feather(self):
+        feather_file = os.path.join(self.out_dir, 'example_apoptosis.arrow')
+        self.exp_data.data.to_feather(feather_file)
+        feather_data = load_data(feather_file)
+        ok_(feather_data.data.equals(self.exp_data.data))
+        ok_(feather_data.genes.by_sample == self.exp_data.genes.by_sample)
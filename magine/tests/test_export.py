@@ -0,0 +1,84 @@
+import os
+import tempfile
+
+import numpy as np
+import pandas as pd
+from nose.tools import ok_, raises
+
+from magine.enrichment import load_enrichment_csv, load_enrichment_feather, \
+    load_enrichment_parquet
+from magine.enrichment.export import write_pivot_xlsx
+
+
+def _data():
+    df = load_enrichment_csv(os.path.join(os.path.dirname(__file__), 'Data',
+                                          'enrichr_test_enrichr.csv'))
+    other = df.iloc[:40].copy()
+    other['db'] = 'other'
+    other['sample_id'] = 5
+    df = pd.concat([df, other], ignore_index=True)
+    df['sample_id'] = pd.Categorical(df['sample_id'],
+                                     categories=[1, 2, 3, 4, 5])
+    return df
+
+
+def _pivot_table(df):
+    return pd.pivot_table(df, index=['term_name', 'db'], columns='sample_id',
+                          aggfunc='first')
+
+
+def test_lazy_pivot():
+    df = _data()
+    expected = _pivot_table(df)
+    pivot = df.lazy_pivot()
+    ok_(pivot.n_rows == expected.shape[0])
+    for block_size in (7, 10000):
+        blocks = list(pivot.blocks(block_size))
+        ok_(max(i.shape[0] for i in blocks) <= block_size)
+        pd.testing.assert_frame_equal(pd.concat(blocks).astype(object),
+                                      expected.astype(object),
+                                      check_frame_type=False)
+
+
+def test_write_pivot_xlsx():
+    df = _data()
+    out_dir = tempfile.mkdtemp()
+    expected = os.path.join(out_dir, 'expected.xlsx')
+    _pivot_table(df).to_excel(expected, merge_cells=True)
+    streamed = os.path.join(out_dir, 'streamed.xlsx')
+    write_pivot_xlsx(df.lazy_pivot(), streamed, block_size=7)
+    pd.testing.assert_frame_equal(
+        pd.read_excel(streamed, header=[0, 1], index_col=[0, 1]),
+        pd.read_excel(expected, header=[0, 1], index_col=[0, 1])
+    )
+
+
+def test_to_partitioned():
+    df = _data()
+    out_dir = tempfile.mkdtemp()
+    files = df.to_partitioned(os.path.join(out_dir, 'parquet'))
+    ok_(len(files) == df.groupby(['db', 'sample_id'], observed=True).ngroups)
+    ok_(os.path.join('db=other', 'sample_id=5') in files[-1])
+
+    def _sorted(data):
+        data = pd.DataFrame(data)[df.columns]
+        data['db'] = data['db'].astype(str)
+        data['sample_id'] = data['sample_id'].astype(int)
+        return data.sort_values(['db', 'sample_id', 'term_name']) \
+            .reset_index(drop=True)
+
+    expected = _sorted(df)
+    loaded = load_enrichment_parquet(os.path.join(out_dir, 'parquet'))
+    pd.testing.assert_frame_equal(_sorted(loaded), expected)
+
+    df.to_partitioned(os.path.join(out_dir, 'feather'), file_format='feather')
+    loaded = load_enrichment_feather(os.path.join(out_dir, 'feather'))
+    pd.testing.assert_frame_equal(_sorted(loaded), expected)
+
+
+@raises(ValueError)
+def test_to_partitioned_missing():
+    df = _data()
+    df['db'] = df['db'].astype(object)
+    df.loc[0, 'db'] = np.nan
+    df.to_partitioned(tempfile.mkdtemp())
@@ -0,0 +1,130 @@
+import os
+import tempfile
+
+from nose.tools import ok_
+
+from magine.enrichment.go_index import GOIndex
+
+obo = """format-version: 1.2
+data-version: releases/2020-01-01
+
+[Term]
+id: GO:0000001
+name: root
+namespace: biological_process
+
+[Term]
+id: GO:0000002
+name: a
+namespace: biological_process
+is_a: GO:0000001 ! root
+
+[Term]
+id: GO:0000003
+name: b
+namespace: biological_process
+is_a: GO:0000001 ! root
+
+[Term]
+id: GO:0000004
+name: ab
+namespace: biological_process
+is_a: GO:0000002 ! a
+is_a: GO:0000003 ! b
+
+[Term]
+id: GO:0000005
+name: ab child
+namespace: biological_process
+is_a: GO:0000004 ! ab
+relationship: part_of GO:0000003 ! b
+
+[Term]
+id: GO:0000006
+name: a child
+namespace: biological_process
+alt_id: GO:0000016
+is_a: GO:0000002 ! a
+
+[Term]
+id: GO:0000007
+name: old
+namespace: biological_process
+is_obsolete: true
+
+[Term]
+id: GO:0000008
+name: function root
+namespace: molecular_function
+
+[Typedef]
+id: part_of
+name: part of
+"""
+
+
+def _obo_file():
+    file_name = os.path.join(tempfile.mkdtemp(), 'go.obo')
+    with open(file_name, 'w') as f:
+        f.write(obo)
+    return file_name
+
+
+def test_go_index():
+    index = GOIndex.from_obo(_obo_file())
+    ok_(len(index) == 7)
+    ok_('GO:0000007' not in index)
+    ok_(index.release == 'releases/2020-01-01')
+    ok_(index.depth[index.position['GO:0000005']] == 3)
+    ok_(index.level[index.position['GO:0000005']] == 3)
+    ok_(index.ancestors_of('GO:0000005') ==
+        {'GO:0000001', 'GO:0000002', 'GO:0000003', 'GO:0000004',
+         'GO:0000005'})
+    ok_(index.ancestors_of('GO:0000016', include_self=False) ==
+        {'GO:0000001', 'GO:0000002'})
+    ok_(index.is_ancestor('GO:0000003', 'GO:0000005'))
+    ok_(not index.is_ancestor('GO:0000006', 'GO:0000005'))
+
+    ok_(index.common_ancestors(['GO:0000005', 'GO:0000006']) ==
+        {'GO:0000001', 'GO:0000002'})
+    ok_(index.deepest_common_ancestor(['GO:0000005', 'GO:0000006']) ==
+        'GO:0000002')
+    dca = index.deepest_common_ancestors(
+        ['GO:0000005', 'GO:0000004', 'GO:0000005'],
+        ['GO:0000006', 'GO:0000003', 'GO:0000008']
+    )
+    ok_(list(index.ids[dca[:2]]) == ['GO:0000002', 'GO:0000003'])
+    ok_(dca[2] == -1)
+    lengths = index.min_branch_lengths(['GO:0000005', 'GO:0000004'],
+                                       ['GO:0000006', 'GO:0000004'])
+    ok_(list(lengths) == [3, 0])
+
+    mask = index.has_ancestor_in(['GO:0000001', 'GO:0000005', 'GO:0000008'])
+    ok_(list(mask) == [False, True, False])
+    ok_(set(index.edges_to_root('GO:0000004')) ==
+        {('GO:0000002', 'GO:0000004'), ('GO:0000003', 'GO:0000004'),
+         ('GO:0000001', 'GO:0000002'), ('GO:0000001', 'GO:0000003')})
+
+
+def test_go_index_relationships():
+    index = GOIndex.from_obo(_obo_file(), relationships=('part_of',))
+    ok_(index.is_ancestor('GO:0000003', 'GO:0000005'))
+    ok_(len(index.parents[index.position['GO:0000005']].indices) == 2)
+
+
+def test_go_index_load_or_build():
+    obo_file = _obo_file()
+    file_name = os.path.join(tempfile.mkdtemp(), 'go_index.npz')
+    index = GOIndex.load_or_build(obo_file, file_name)
+    loaded = GOIndex.load_or_build(obo_file, file_name)
+    ok_(list(loaded.ids) == list(index.ids))
+    ok_((loaded.ancestors != index.ancestors).nnz == 0)
+    ok_((loaded.depth == index.depth).all())
+    ok_(loaded.position['GO:0000016'] == index.position['GO:0000006'])
+
+    # new release is rebuilt
+    with open(obo_file, 'w') as f:
+        f.write(obo.replace('2020-01-01', '2021-01-01'))
+    ok_(GOIndex.load_or_build(obo_file, file_name).release ==
+        'releases/2021-01-01')
+    ok_(GOIndex.load(file_name).release == 'releases/2021-01-01')
@@ -0,0 +1,124 @@
+import tempfile
+
+import numpy as np
+import pandas as pd
+from nose.tools import ok_
+from scipy.stats import fisher_exact
+
+from magine.enrichment.local_enrichment import GeneSetLibrary, LocalEnrichr
+
+term_to_genes = {
+    'apoptosis': ['BAX', 'BCL2', 'CASP3', 'CASP8', 'BID', 'FAS'],
+    'dna repair': ['ATM', 'ATR', 'CHEK1', 'TP53', 'BRCA1'],
+    'p53 signaling': ['TP53', 'BAX', 'MDM2', 'CASP8', 'ATM'],
+    'cell cycle': ['CDK1', 'CDK2', 'CHEK1', 'TP53', 'MDM2', 'CCNB1'],
+    'metabolism': ['HK1', 'PFKM', 'PKM', 'LDHA'],
+}
+library = GeneSetLibrary.from_dict('Test_Lib', term_to_genes)
+
+
+def _local():
+    e = LocalEnrichr(download=False)
+    e.add_library(library)
+    return e
+
+
+def test_fisher():
+    genes = ['BAX', 'BCL2', 'CASP3', 'TP53']
+    df = _local().run(genes, 'Test_Lib')
+    ok_(set(df['term_name']) == {'apoptosis', 'p53 signaling', 'dna repair',
+                                 'cell cycle'})
+    row = df.loc[df['term_name'] == 'apoptosis'].iloc[0]
+    n_total = library.n_genes
+    table = [[3, 1], [3, n_total - 7]]
+    ok_(np.isclose(row['p_value'],
+                   fisher_exact(table, alternative='greater')[1]))
+    ok_(row['genes'] == 'BAX,BCL2,CASP3')
+    ok_(row['n_genes'] == 3)
+    ok_(row['rank'] == 1)
+    ok_(row['combined_score'] > 0)
+    ok_((df['adj_p_value'] >= df['p_value']).all())
+
+
+def test_samples_match_single_runs():
+    e = _local()
+    lists = [['BAX', 'BCL2', 'CASP3'], ['ATM', 'ATR', 'TP53'], ['HK1']]
+    df = e._run(lists, ['1', '2', '3'], 'Test_Lib')
+    for genes, sample_id in zip(lists, ['1', '2', '3']):
+        single = e.run(genes, 'Test_Lib').sort_values('term_name')
+        multi = df.loc[df['sample_id'] == sample_id].sort_values('term_name')
+        ok_(np.allclose(single['p_value'], multi['p_value']))
+        ok_(list(single['genes']) == list(multi['genes']))
+
+
+def test_no_overlap():
+    e = _local()
+    df = e.run_samples([['Z'], ['Y']], ['s1', 's2'], 'Test_Lib')
+    ok_(df.shape[0] == 0)
+    ok_('sample_id' in df.columns)
+    ranked = pd.Series([1., -1.], index=['Z', 'Y'])
+    df = e.run_prerank([ranked], ['s1'], 'Test_Lib', n_perm=10)
+    ok_(df.shape[0] == 0)
+    ok_('sample_id' in df.columns)
+
+
+def test_background():
+    genes = ['BAX', 'BCL2', 'CASP3', 'TP53']
+    background = ['BAX', 'BCL2', 'CASP3', 'TP53', 'ATM', 'MDM2', 'HK1']
+    df = LocalEnrichr(background=background, download=False)
+    df.add_library(library)
+    df = df.run(genes, 'Test_Lib')
+    row = df.loc[df['term_name'] == 'apoptosis'].iloc[0]
+    table = [[3, 1], [0, 3]]
+    ok_(np.isclose(row['p_value'],
+                   fisher_exact(table, alternative='greater')[1]))
+
+
+def test_save_load():
+    out_dir = tempfile.mkdtemp()
+    library.save(out_dir)
+    loaded = GeneSetLibrary.load('Test_Lib', out_dir)
+    ok_(isinstance(loaded.genes, np.memmap))
+    ok_((loaded.matrix != library.matrix).nnz == 0)
+    e = LocalEnrichr(library_dir=out_dir, download=False)
+    ok_(e.run(['BAX', 'TP53'], 'Test_Lib').equals(
+        _local().run(['BAX', 'TP53'], 'Test_Lib')))
+
+
+def _running_sum(ranked, genes, weight=1.):
+    # O(n) reference of the weighted running sum
+    hits = np.array([g in genes for g in ranked.index])
+    weights = np.abs(ranked.values) ** weight * hits
+    steps = np.where(hits, weights / weights.sum(),
+                     -1. / (len(ranked) - hits.sum()))
+    walk = np.cumsum(steps)
+    return walk.max() if walk.max() >= -walk.min() else walk.min()
+
+
+def test_prerank():
+    genes = sorted(library.genes)
+    first = ['BAX', 'BCL2', 'CASP3', 'CASP8', 'BID', 'FAS']
+    order = first + [g for g in genes if g not in first]
+    ranked = pd.Series(np.linspace(2, -2, len(order)), index=order)
+    reverse = pd.Series(np.linspace(3, -1, len(order)), index=order[::-1])
+    e = _local()
+    df = e.run_prerank([ranked, reverse], ['1', '2'], 'Test_Lib',
+                       n_perm=200, min_size=3)
+    ok_(set(df['sample_id']) == {'1', '2'})
+    for sample_id, values in (('1', ranked), ('2', reverse)):
+        sample = df.loc[df['sample_id'] == sample_id]
+        ok_(sample['rank'].tolist() == list(range(1, len(sample) + 1)))
+        for _, row in sample.iterrows():
+            term_genes = set(term_to_genes[row['term_name']])
+            ok_(np.isclose(row['es'], _running_sum(values, term_genes)))
+    row = df.loc[df['term_name'] == 'apoptosis'].iloc[0]
+    ok_(np.isclose(row['es'], 1.))
+    ok_(row['nes'] > 0 and row['combined_score'] > 0)
+    ok_(row['genes'] == ','.join(first))
+    ok_(row['p_value'] < .05)
+    ok_((df['adj_p_value'] >= df['p_value'] - 1e-12).all())
+
+    # permutations are reproducible
+    again = e.run_prerank([ranked, reverse], ['1', '2'], 'Test_Lib',
+                          n_perm=200, min_size=3)
+    ok_(np.allclose(again['p_value'], df['p_value']))
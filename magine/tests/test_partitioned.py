@@ -0,0 +1,94 @@
+import os
+import shutil
+import tempfile
+
+import matplotlib.pyplot as plt
+from nose.tools import ok_
+
+from magine.data.experimental_data import ExperimentalData, load_data
+from magine.data.partitioned import csv_to_partitioned, write_partitioned
+
+csv_file = os.path.join(os.path.dirname(__file__), 'Data',
+                        'example_apoptosis.csv')
+
+
+class TestPartitionedData(object):
+    def setUp(self):
+        self.exp_data = load_data(csv_file)
+        self.out_dir = tempfile.mkdtemp()
+        self.data = write_partitioned(self.exp_data,
+                                      os.path.join(self.out_dir, 'data'))
+
+    def tearDown(self):
+        shutil.rmtree(self.out_dir)
+
+    def test_partitions(self):
+        ok_(set(self.data.exp_methods) == set(self.exp_data.exp_methods))
+        ok_(self.data.sample_ids == self.exp_data.sample_ids)
+        ok_(len(os.listdir(os.path.join(self.out_dir, 'data'))) ==
+            len(self.exp_data.exp_methods))
+
+    def test_samples(self):
+        for i in self.exp_data.exp_methods + self.exp_data.sample_ids:
+            ok_(self.data[i].id_list == self.exp_data[i].id_list)
+            ok_(self.data[i].shape == self.exp_data[i].shape)
+        ok_(self.data.label_free.sig.id_list ==
+            self.exp_data.label_free.sig.id_list)
+        for i in ['genes', 'proteins', 'rna', 'compounds', 'species']:
+            ok_(getattr(self.data, i).id_list ==
+                getattr(self.exp_data, i).id_list)
+
+    def test_summaries(self):
+        species = self.exp_data.species
+        ok_(self.data.id_list() == species.id_list)
+        ok_(self.data.id_list(sig=True) == species.sig.id_list)
+        ok_(self.data.by_sample() == species.by_sample)
+        ok_(self.data.by_sample(sig=True) == species.sig.by_sample)
+        ok_(self.data.by_sample('up') == species.up_by_sample)
+        ok_(self.data.by_sample('down') == species.down_by_sample)
+        ok_(self.data.get_measured_by_datatype() ==
+            self.exp_data.get_measured_by_datatype())
+        for sig in [False, True]:
+            table = self.data.create_summary_table(sig=sig)
+            expected = self.exp_data.create_summary_table(sig=sig)
+            ok_(table.equals(expected))
+
+    def test_missing_identifier(self):
+        df = self.exp_data.data.copy()
+        df.loc[df.index[:3], 'identifier'] = None
+        exp_data = ExperimentalData(df)
+        data = write_partitioned(exp_data, os.path.join(self.out_dir, 'na'))
+        for sig in [False, True]:
+            table = data.create_summary_table(sig=sig)
+            expected = exp_data.create_summary_table(sig=sig)
+            ok_(table.equals(expected))
+
+    def test_missing_keys(self):
+        df = self.exp_data.data.copy()
+        df.loc[df.index[:2], 'sample_id'] = None
+        df.loc[df.index[-2:], 'source'] = None
+        data = write_partitioned(df, os.path.join(self.out_dir, 'keys'))
+        with_sample = ExperimentalData(df.dropna(subset=['sample_id']))
+        with_source = ExperimentalData(df.dropna(subset=['source']))
+        ok_(data.sample_ids == with_sample.sample_ids)
+        ok_(set(data.exp_methods) == set(with_source.exp_methods))
+        ok_(data.by_sample() == with_sample.species.by_sample)
+        ok_(data.get_measured_by_datatype() ==
+            with_source.get_measured_by_datatype())
+        for sig in [False, True]:
+            table = data.create_summary_table(sig=sig)
+            expected = ExperimentalData(df).create_summary_table(sig=sig)
+            ok_(table.equals(expected))
+
+    def test_volcano(self):
+        self.data.volcano_analysis(out_dir=os.path.join(self.out_dir, 'v'))
+        plt.close()
+        ok_(len(os.listdir(os.path.join(self.out_dir, 'v'))) ==
+            len(self.exp_data.exp_methods))
+
+    def test_csv_to_partitioned(self):
+        data = csv_to_partitioned(csv_file,
+                                  os.path.join(self.out_dir, 'csv'),
+                                  block_size=200)
+        ok_(data.id_list() == self.data.id_list())
+        ok_(data.by_sample('up') == self.data.by_sample('up'))
@@ -4,6 +4,8 @@ import tempfile
 
 import matplotlib.pyplot as plt
 import pandas as pd
+from nose.tools import ok_
+from wordcloud import WordCloud
 
 import magine.plotting.wordcloud_tools as wt
 from magine.enrichment import load_enrichment_csv
@@ -47,5 +49,19 @@ def test_filter():
 
     x.plot(save_name=os.path.join(out_dir, 'test_wc'))
     plt.close()
-    wt.word_cloud_from_array(df, sample_ids=[1, 2])
+    samples, counts = wt.word_cloud_from_array(df, sample_ids=[1, 2])
     plt.close()
+    ok_(len(samples) == 2)
+    ok_(list(counts.columns) == [1, 2, 'sum'])
+    sample_1 = samples[0]
+    ok_(counts.loc['tp53', 1] ==
+        sample_1['term_name'].str.contains('p53').sum())
+    ok_((counts['sum'] == counts[1] + counts[2]).all())
+
+    # create_wordcloud counts the same words as word_cloud_from_array
+    x = wt.create_wordcloud(sample_1)
+    plt.close()
+    ok_(x.word_dict == counts.loc[counts[1] > 0, 1].to_dict())
+    text = ' '.join(sample_1['term_name'].map(wt.clean_term_name))
+    wc = WordCloud(collocations=False, stopwords=wt.basic_words)
+    ok_(x.word_dict == wc.process_text(text))
@@ -47,7 +47,7 @@ setup(
 
     # You can just specify the packages manually here if your project is
     # simple. Or you can use find_packages().
-    packages=find_packages(exclude=['docs']),
+    packages=find_packages(exclude=['docs', 'benchmarks', 'benchmarks.*']),
 
     install_requires=[
         'bioservices',
@@ -79,6 +79,8 @@ setup(
 
     extras_require={
         'test': ['coverage'],
+        'parquet': ['pyarrow'],
+        'gsea': ['numba'],
     },
     include_package_data=True,
     scripts=['scripts/create_template_project',